@@ -0,0 +1,264 @@
+import datetime
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from jobstate import *
+from nodestate import *
+from snapshot import Snapshot
+from partitions import PartitionSummary, get_partition_summaries
+from fit import PartitionFit, ResourceRequest
+from history import HistoryQuery, HistorySeries, get_node_resources, resource_columns
+from metrics import Gauge, Metric
+
+
+def as_json_time(t: Optional[datetime.datetime]) -> Optional[str]:
+    return t.isoformat() if t is not None else None
+
+
+def as_json_seconds(t: Optional[datetime.timedelta]) -> Optional[int]:
+    return int(t.total_seconds()) if t is not None else None
+
+
+def job_as_json(job: JobState) -> Dict[str, Any]:
+    return {
+        "job_id": job.job_id,
+        "cluster": job.cluster,
+        "array_job_id": job.array_job_id,
+        "array_task_id": job.array_task_id,
+        "array_task_throttle": job.array_task_throttle,
+        "job_name": job.job_name,
+        "user_name": job.user_name,
+        "group_name": job.group_name,
+        "account": job.account,
+        "qos": job.qos,
+        "priority": job.priority,
+        "job_state": job.job_state,
+        "job_state_reasons": job.job_state_reasons,
+        "exit_code": job.exit_code,
+        "exit_signal": job.exit_signal,
+        "partition": job.partition,
+        "nodes": job.nodes,
+        "nodes_compact": job.nodes_compact,
+        "trackable_resources": job.trackable_resources,
+        "trackable_resources_per_node": job.trackable_resources_per_node,
+        "run_time": as_json_seconds(job.run_time),
+        "max_time_limit": as_json_seconds(job.max_time_limit),
+        "submit_time": as_json_time(job.submit_time),
+        "start_time": as_json_time(job.start_time),
+        "end_time": as_json_time(job.end_time),
+        "features": job.features,
+        "command": job.command,
+        "workdir": str(job.workdir),
+        "stdout_path": job.stdout_path,
+        "stderr_path": job.stderr_path,
+    }
+
+
+def node_as_json(node: NodeState) -> Dict[str, Any]:
+    return {
+        "name": node.name,
+        "cluster": node.cluster,
+        "state": node.state,
+        "state_reason": node.state_reason,
+        "up": node.up,
+        "partitions": node.partitions,
+        "cpu_alloc": node.cpu_alloc,
+        "cpu_total": node.cpu_total,
+        "cpu_load": node.cpu_load,
+        "memory_alloc_mbytes": node.memory_alloc_mbytes,
+        "memory_total_mbytes": node.memory_total_mbytes,
+        "memory_free_mbytes": node.memory_free_mbytes,
+        "gres": node.gres,
+        "tres_alloc": node.tres_alloc,
+        "tres_total": node.tres_total,
+        "available_features": node.available_features,
+        "active_features": node.active_features,
+    }
+
+
+def partition_as_json(partition: PartitionSummary) -> Dict[str, Any]:
+    return {
+        "cluster": partition.cluster,
+        "name": partition.name,
+        "nodes": [node.name for node in partition.nodes],
+        "nodes_up": partition.nodes_up,
+        "nodes_down": partition.nodes_down,
+        "cpu_alloc": partition.cpu_alloc,
+        "cpu_total": partition.cpu_total,
+        "cpu_free": partition.cpu_free,
+        "memory_alloc_mbytes": partition.memory_alloc_mbytes,
+        "memory_total_mbytes": partition.memory_total_mbytes,
+        "memory_free_mbytes": partition.memory_free_mbytes,
+        "gpus": {
+            gpu_type: {"alloc": usage.alloc, "total": usage.total, "free": usage.free}
+            for gpu_type, usage in partition.gpus.items()
+        },
+        "job_states": partition.job_states,
+    }
+
+
+def partitions_as_json(snapshot: Snapshot) -> Dict[str, Dict[str, Any]]:
+    """Partitions by name, qualified with their cluster (see `qualify`)."""
+    return {
+        key: partition_as_json(partition)
+        for key, partition in get_partition_summaries(snapshot).items()
+    }
+
+
+def encode_json(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+class JsonFragments:
+    """Serialized JSON of the entries of a snapshot, each encoded on its first
+    use and then reused by all requests on that snapshot."""
+
+    def __init__(self, as_json):
+        self.as_json = as_json
+        self.fragments: Dict[Any, bytes] = {}
+
+    def get(self, key: Any, entry: Any) -> bytes:
+        fragment = self.fragments.get(key)
+
+        if fragment is None:
+            fragment = encode_json(self.as_json(entry))
+            self.fragments[key] = fragment
+
+        return fragment
+
+
+def make_list_body(snapshot: Snapshot, name: str, fragments: Iterable[bytes]) -> bytes:
+    return b"".join([
+        b'{"version":', str(snapshot.version).encode(),
+        b',"time":', encode_json(as_json_time(snapshot.time)),
+        b',"', name.encode(), b'":[', b",".join(fragments), b"]}"
+    ])
+
+
+def encode_jobs(snapshot: Snapshot, jobs: List[JobState]) -> bytes:
+    fragments = snapshot.derive("api_job_fragments", lambda _: JsonFragments(job_as_json))
+    return make_list_body(snapshot, "jobs", (fragments.get(job.key, job) for job in jobs))
+
+
+def encode_nodes(snapshot: Snapshot, nodes: List[NodeState]) -> bytes:
+    fragments = snapshot.derive("api_node_fragments", lambda _: JsonFragments(node_as_json))
+    return make_list_body(snapshot, "nodes", (fragments.get(node.key, node) for node in nodes))
+
+
+def encode_partitions(snapshot: Snapshot, partition_names: Optional[List[str]]) -> bytes:
+    partitions = snapshot.derive("api_partitions", partitions_as_json)
+
+    if partition_names is not None:
+        partitions = {name: partitions[name] for name in partition_names if name in partitions}
+
+    return b"".join([
+        b'{"version":', str(snapshot.version).encode(),
+        b',"time":', encode_json(as_json_time(snapshot.time)),
+        b',"partitions":', encode_json(partitions), b"}"
+    ])
+
+
+def fit_as_json(fit: PartitionFit, request: ResourceRequest) -> Dict[str, Any]:
+    return {
+        "cluster": fit.cluster,
+        "name": fit.name,
+        "fits": fit.fits(request),
+        "job_count": fit.count_jobs(request),
+        "nodes": [
+            {
+                "name": entry.node.name,
+                "job_count": count,
+                "cpu_free": entry.cpus,
+                "memory_free_mbytes": entry.memory_mbytes,
+                "gpus_free": entry.gpus,
+                "features": sorted(entry.features),
+            }
+            for entry, count in fit.nodes
+        ],
+    }
+
+
+def encode_fits(snapshot: Snapshot, request: ResourceRequest, fits: List[PartitionFit]) -> bytes:
+    return encode_json({
+        "version": snapshot.version,
+        "time": as_json_time(snapshot.time),
+        "request": {
+            "cpus": request.cpus,
+            "memory_mbytes": request.memory_mbytes,
+            "gpus": request.gpus,
+            "gpu_type": request.gpu_type,
+            "features": [sorted(alternatives) for alternatives in request.features],
+            "nodes": request.nodes,
+        },
+        "partitions": [fit_as_json(fit, request) for fit in fits],
+    })
+
+
+# metric name and scale of each of `history.resource_columns`
+resource_metrics = {
+    "cpu_alloc": ("cpus_allocated", 1),
+    "cpu_total": ("cpus_total", 1),
+    "memory_alloc_mbytes": ("memory_allocated_bytes", 1024 * 1024),
+    "memory_total_mbytes": ("memory_total_bytes", 1024 * 1024),
+    "gpu_alloc": ("gpus_allocated", 1),
+    "gpu_total": ("gpus_total", 1),
+}
+
+def snapshot_metrics(snapshot: Snapshot) -> List[Metric]:
+    """Cluster gauges exported by `/metrics`, computed from `snapshot`."""
+    version = Gauge("swatch_snapshot_version", "Version of the latest snapshot, incremented when the cluster state changes")
+    version.set(snapshot.version)
+
+    timestamp = Gauge("swatch_snapshot_timestamp_seconds", "Time at which the cluster state of the latest snapshot was queried")
+    timestamp.set(snapshot.time.timestamp())
+
+    # the cluster label is empty when monitoring a single cluster
+    resource_gauges = {
+        kind: [
+            Gauge(f"swatch_{kind}_{resource_metrics[column][0]}", f"{column} summed over the nodes of the {kind}", label_names)
+            for column in resource_columns
+        ]
+        for kind, label_names in (("cluster", ["cluster"]), ("partition", ["cluster", "partition"]))
+    }
+
+    nodes = Gauge("swatch_nodes", "Nodes by cluster and state", ["cluster", "state"])
+
+    for node in snapshot.nodes.values():
+        cluster = node.cluster or ""
+        labels = [(resource_gauges["cluster"], (cluster,))]
+        labels.extend((resource_gauges["partition"], (cluster, partition)) for partition in node.partitions or [])
+
+        for gauges, label_values in labels:
+            for gauge, column, value in zip(gauges, resource_columns, get_node_resources(node)):
+                gauge.labels(*label_values).inc(value * resource_metrics[column][1])
+
+        nodes.labels(cluster, node.state).inc()
+
+    jobs = Gauge("swatch_jobs", "Jobs by cluster, partition and state", ["cluster", "partition", "state"])
+    for job in snapshot.sorted_jobs:
+        jobs.labels(job.cluster or "", job.partition, job.job_state).inc()
+
+    cpus_free = Gauge("swatch_partition_cpus_free", "Unallocated CPUs on the nodes of the partition that are up", ["cluster", "partition"])
+    gpus_free = Gauge("swatch_partition_gpus_free", "Unallocated GPUs on the nodes of the partition that are up, by GPU type", ["cluster", "partition", "type"])
+
+    for partition in get_partition_summaries(snapshot).values():
+        cpus_free.labels(partition.cluster or "", partition.name).set(partition.cpu_free)
+
+        for gpu_type, usage in partition.gpus.items():
+            gpus_free.labels(partition.cluster or "", partition.name, gpu_type).set(usage.free)
+
+    return [version, timestamp, *resource_gauges["cluster"], *resource_gauges["partition"], jobs, nodes, cpus_free, gpus_free]
+
+
+def encode_history(query: HistoryQuery, series_list: List[HistorySeries]) -> bytes:
+    return encode_json({
+        "kind": query.kind,
+        "start": query.start,
+        "end": query.end,
+        "resolution": query.resolution.name,
+        "resolution_seconds": query.resolution.seconds,
+        "series": [
+            dict({"name": series.name, "time": series.times}, **series.values)
+            for series in series_list
+        ],
+    })
@@ -0,0 +1,96 @@
+import datetime
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Union
+
+from jobstate import *
+from columnar import get_job_gpus, get_job_memory_mbytes
+
+
+@dataclass
+class JobArray:
+    """The tasks of a job array among a job selection, shown as a single row.
+    Pending tasks are usually reported as one job standing for many tasks,
+    which counts as `array_task_count` tasks here."""
+
+    cluster: Optional[str]
+    array_job_id: int
+
+    # in the order of the selection
+    tasks: List[JobState] = field(default_factory=list)
+
+    task_count: int = 0
+
+    # by job state, in tasks
+    state_counts: Dict[str, int] = field(default_factory=dict)
+
+    # requested by all tasks
+    cpus: int = 0
+    memory_mbytes: float = 0
+    gpus: int = 0
+
+    longest_run_time: Optional[datetime.timedelta] = None
+
+    @property
+    def key(self) -> str:
+        return qualify(self.cluster, str(self.array_job_id))
+
+    @property
+    def first(self) -> JobState:
+        """The task that decides where the array sorts and how it looks."""
+        return self.tasks[0]
+
+    def add(self, task: JobState):
+        count = task.array_task_count
+
+        self.tasks.append(task)
+        self.task_count += count
+        self.state_counts[task.job_state] = self.state_counts.get(task.job_state, 0) + count
+
+        self.cpus += task.get_cpus() * count
+        self.memory_mbytes += get_job_memory_mbytes(task) * count
+        self.gpus += get_job_gpus(task) * count
+
+        if task.run_time is not None and (self.longest_run_time is None or task.run_time > self.longest_run_time):
+            self.longest_run_time = task.run_time
+
+
+def group_job_arrays(jobs: List[JobState]) -> List[Union[JobState, JobArray]]:
+    """Replaces the tasks of each job array in `jobs` by a `JobArray`, placed
+    where its first task was. Other jobs are kept as is, in the same order."""
+    rows: List[Union[JobState, JobArray]] = []
+    arrays: Dict[str, JobArray] = {}
+
+    for job in jobs:
+        array_key = job.array_key
+
+        if array_key is None:
+            rows.append(job)
+            continue
+
+        array = arrays.get(array_key)
+        if array is None:
+            array = arrays[array_key] = JobArray(job.cluster, job.array_job_id)
+            rows.append(array)
+
+        array.add(job)
+
+    return rows
+
+
+def index_jobs_by_array(jobs: Iterable[JobState]) -> Dict[str, List[JobState]]:
+    """Builds an array key -> tasks index, preserving the order of `jobs`."""
+    jobs_by_array = defaultdict(list)
+
+    for job in jobs:
+        array_key = job.array_key
+        if array_key is not None:
+            jobs_by_array[array_key].append(job)
+
+    return dict(jobs_by_array)
+
+
+def wants_grouped_arrays(query) -> bool:
+    """Whether pages for `query` group array tasks: unless `arrays=tasks` is
+    given, or the tasks of given arrays are selected with `array`."""
+    return query.get("arrays") != "tasks" and "array" not in query
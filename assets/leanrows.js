@@ -0,0 +1,133 @@
+// expands the job tables of lean pages: each table with a data-lean-rows
+// attribute gets the rows at that index of the #lean-rows JSON (see
+// leanrows.py), built as make_job_row in include/jobutil.html renders them.
+// Tooltips of the rows are only built when shown, see getTooltipContents.
+
+const leanRows = JSON.parse(document.getElementById("lean-rows").textContent);
+
+const leanColumnIndexes = Object.fromEntries(leanRows.columns.map((name, index) => [name, index]));
+
+// jobs as objects, decoded when first needed
+const leanJobs = [];
+
+function getLeanJob(index) {
+    if (leanJobs[index] === undefined) {
+        const row = leanRows.jobs[index];
+        const job = {};
+
+        for (const [name, columnIndex] of Object.entries(leanColumnIndexes)) {
+            const table = leanRows.tables[name];
+            job[name] = table !== undefined ? table[row[columnIndex]] : row[columnIndex];
+        }
+
+        leanJobs[index] = job;
+    }
+
+    return leanJobs[index];
+}
+
+const htmlEscapes = {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&#34;", "'": "&#39;"};
+
+function escapeHtml(value) {
+    return String(value).replace(/[&<>"']/g, (character) => htmlEscapes[character]);
+}
+
+function leanTooltip(titleId) {
+    return ' data-bs-toggle="tooltip" data-title-id="' + titleId + '"';
+}
+
+function leanRichTooltip(kind) {
+    return ' data-bs-toggle="tooltip" data-stickable="" data-bs-html="true" data-lean-tooltip="' + kind + '"';
+}
+
+// the resource columns of compact rows are per job, the others per node
+function leanNodeDivisor(job) {
+    return job.node_count > 1 ? ' <span class="text-muted small"' + leanTooltip(leanRows.titles.node_divisor) + ">÷" + job.node_count + "</span>" : "";
+}
+
+function leanNodeMultiplier(job) {
+    return job.node_count > 1 ? '<span class="text-muted small"' + leanTooltip(leanRows.titles.node_multiplier) + ">" + job.node_count + "× </span>" : "";
+}
+
+function makeLeanJobRow(index, compact) {
+    const job = getLeanJob(index);
+    const url = "/job/" + job.job_id + (job.cluster !== null ? "?cluster=" + job.cluster : "");
+    let html = '<tr class="' + escapeHtml(leanRows.classes[job.state]) + '" data-job-id="' + escapeHtml(job.key)
+        + '" data-sort="' + escapeHtml(job.sort) + '" data-lean-job="' + index + '">';
+
+    if (!compact) {
+        html += '<td class="min"' + leanRichTooltip("state") + '><i class="bi ' + escapeHtml(leanRows.icons[job.state]) + '"></i> '
+            + leanRows.partition_icons[job.partition] + "</td>";
+    }
+
+    html += '<td scope="row" class="min important">'
+        + (job.cluster !== null ? '<span class="text-muted small">' + escapeHtml(job.cluster) + "/</span>" : "")
+        + '<a class="link-unstyled" href="' + escapeHtml(url) + '">' + escapeHtml(job.display_id) + "</a></td>";
+
+    html += '<td class="cut" style="min-width: 30px; max-width: 80px;">' + escapeHtml(job.user) + "</td>";
+    html += '<td class="cut" style="min-width: 30px; max-width: 400px;"' + leanRichTooltip("details") + ">" + escapeHtml(job.name) + "</td>";
+
+    if (!compact) {
+        html += '<td class="cut" style="max-width: 15%;"' + leanRichTooltip("nodes") + ">" + escapeHtml(job.nodes) + "</td>";
+    }
+
+    html += '<td class="min">' + job.cpus + (compact ? leanNodeDivisor(job) : "") + "</td>";
+    html += '<td class="min">' + escapeHtml(job.memory) + (compact ? leanNodeDivisor(job) : "") + "</td>";
+    html += '<td class="cut" style="max-width: 7%;">' + (compact ? escapeHtml(job.gpus_compact) : leanNodeMultiplier(job) + escapeHtml(job.gpus)) + "</td>";
+
+    if (!compact) {
+        html += '<td class="min"' + leanRichTooltip("times") + "><span data-run-time>" + escapeHtml(job.run_time) + "</span></td>";
+    }
+
+    return html + "</tr>";
+}
+
+// contents of the rich tooltips of make_job_row, by `data-lean-tooltip`
+const leanTooltipTexts = {
+    state: (job) => "Reasons for the " + job.state + " state: " + job.reasons + "\n\n"
+        + "Exit code:   " + job.exit_code + "\n"
+        + "Exit signal: " + job.exit_signal,
+    details: (job) => "Command:  " + job.command + "\n"
+        + "Workdir:  " + job.workdir + "\n\n"
+        + "stdout:   " + job.stdout + "\n"
+        + "stderr:   " + job.stderr + "\n\n"
+        + "e-mail:   " + job.mail_user + " (on: " + job.mail_type + ")\n\n"
+        + "sbatch:   " + job.sbatch + "\n\n"
+        + "Features: " + job.features,
+    nodes: (job) => "#Requested: " + job.node_count + "\n"
+        + "Requested:  " + job.requested_nodes + "\n"
+        + "Excluded:   " + job.excluded_nodes + "\n"
+        + "Allocated:  " + job.nodes_compact + "\n\n"
+        + "#Sockets/Node: " + job.layout[0] + "\n"
+        + "#Tasks/Node:   " + job.layout[1] + "\n"
+        + "#Tasks/Board:  " + job.layout[2] + "\n"
+        + "#Tasks/Socket: " + job.layout[3] + "\n"
+        + "#Tasks/Core:   " + job.layout[4],
+    times: (job) => "Submitted:    " + job.submit_time + "\n"
+        + "Eligible:     " + job.eligible_time + "\n"
+        + "Accrue time:  " + job.accrue_time + "\n"
+        + "Start time:   " + job.start_time + "\n"
+        + "End time:     " + job.end_time + "\n"
+        + "Deadline:     " + job.deadline + "\n"
+        + "Suspend time: " + job.suspend_time,
+};
+
+// title element of a tooltip of a lean row, like the ones of #tooltip-titles
+function buildLeanTooltipTitle(triggerEl) {
+    const job = getLeanJob(Number(triggerEl.closest("tr").dataset.leanJob));
+    const titleEl = document.createElement("div");
+    const pre = document.createElement("pre");
+
+    pre.textContent = leanTooltipTexts[triggerEl.dataset.leanTooltip](job);
+    titleEl.appendChild(pre);
+    return titleEl;
+}
+
+document.querySelectorAll("table[data-lean-rows]").forEach((table) => {
+    const compact = table.dataset.compact === "1";
+    const rows = leanRows.rows[Number(table.dataset.leanRows)];
+
+    // job arrays come rendered, see make_array_row
+    const html = rows.map((row) => typeof row === "number" ? makeLeanJobRow(row, compact) : row);
+    table.tBodies[0].insertAdjacentHTML("beforeend", html.join(""));
+});
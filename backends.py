@@ -0,0 +1,619 @@
+import asyncio
+import datetime
+import functools
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+from jobstate import *
+from nodestate import *
+from metrics import slurm_query_seconds
+from scontrol import CircuitBreaker, ProcessSlots, ScontrolRunner, SlurmUnavailableError
+from sharedstore import SharedStoreReader
+
+
+class BackendError(Exception):
+    pass
+
+
+def json_number(value: Any) -> Optional[float]:
+    """Unwraps Slurm JSON numbers, which newer versions report as
+    `{"set": ..., "infinite": ..., "number": ...}`. Returns `None` when the
+    number is unset or infinite."""
+    if isinstance(value, dict):
+        if not value.get("set", True) or value.get("infinite", False):
+            return None
+
+        return value.get("number")
+
+    return value
+
+def json_is_infinite(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("infinite", False)
+
+def json_int(value: Any, default: int = 0) -> str:
+    number = json_number(value)
+    return str(int(number)) if number is not None else str(default)
+
+def json_count(value: Any) -> str:
+    """Formats counts the way `scontrol` does, with `*` when unset."""
+    number = json_number(value)
+    return str(int(number)) if number is not None and number >= 0 else "*"
+
+def json_text(value: Any) -> str:
+    if value is None or value == "":
+        return "(null)"
+
+    return str(value)
+
+def json_list(value: Any) -> str:
+    if isinstance(value, list):
+        value = ",".join(value)
+
+    return json_text(value)
+
+def json_state(value: Any, flags: Any = None) -> str:
+    states = value if isinstance(value, list) else [value]
+    states = states + (flags or [])
+    return "+".join(state.upper() for state in states if state)
+
+def json_date(value: Any) -> str:
+    """Converts an epoch timestamp to the local ISO date printed by
+    `scontrol`."""
+    if json_is_infinite(value):
+        return "UNLIMITED"
+
+    timestamp = json_number(value)
+    if not timestamp:
+        return "Unknown"
+
+    return datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+def json_minutes(value: Any) -> str:
+    if json_is_infinite(value):
+        return "UNLIMITED"
+
+    minutes = json_number(value)
+    if not minutes:
+        return "N/A"
+
+    return as_slurm_timedelta(datetime.timedelta(minutes=minutes))
+
+def json_exit_code(value: Any) -> str:
+    if isinstance(value, dict) and "return_code" in value:
+        signal = json_number(value.get("signal", {}).get("id")) or 0
+        return f"{int(json_number(value['return_code']) or 0)}:{int(signal)}"
+
+    return f"{int(json_number(value) or 0)}:0"
+
+def get_json_run_time(job: Dict[str, Any], now: float) -> datetime.timedelta:
+    start_time = json_number(job.get("start_time")) or 0
+    end_time = json_number(job.get("end_time")) or 0
+    state = json_state(job.get("job_state"))
+
+    # pending jobs report their expected start time, which may have passed
+    if start_time == 0 or start_time > now or state == "PENDING":
+        return datetime.timedelta()
+
+    if state in ("RUNNING", "COMPLETING") or end_time == 0:
+        end_time = now
+
+    run_time = end_time - start_time - (json_number(job.get("suspend_time_total")) or 0)
+    return datetime.timedelta(seconds=int(max(run_time, 0)))
+
+
+def get_json_array_task_id(job: Dict[str, Any]) -> Optional[str]:
+    if not json_number(job.get("array_job_id")):
+        return None
+
+    return job.get("array_task_string") or json_int(job.get("array_task_id"))
+
+def get_json_array_throttle(job: Dict[str, Any]) -> Optional[str]:
+    throttle = json_number(job.get("array_max_tasks"))
+
+    if not json_number(job.get("array_job_id")) or not throttle:
+        return None
+
+    return str(int(throttle))
+
+
+# converters from Slurm's JSON job objects to the fields of `scontrol show jobs
+# --oneliner`, returning `None` for the fields that `scontrol` would omit
+job_json_fields: Dict[str, Callable[[Dict[str, Any]], Optional[str]]] = {
+    "JobId": lambda j: str(j["job_id"]),
+    "ArrayJobId": lambda j: json_int(j.get("array_job_id")) if json_number(j.get("array_job_id")) else None,
+    "ArrayTaskId": get_json_array_task_id,
+    "ArrayTaskThrottle": get_json_array_throttle,
+    "JobName": lambda j: j.get("name", ""),
+    "UserId": lambda j: f"{j.get('user_name', '')}({j.get('user_id', 0)})",
+    "GroupId": lambda j: f"{j.get('group_name', '')}({j.get('group_id', 0)})",
+    "MCS_label": lambda j: j.get("mcs_label") or "N/A",
+    "Priority": lambda j: json_int(j.get("priority")),
+    "Nice": lambda j: json_int(j.get("nice")),
+    "Account": lambda j: json_text(j.get("account")),
+    "QOS": lambda j: json_text(j.get("qos")),
+    "JobState": lambda j: json_state(j.get("job_state")),
+    "Reason": lambda j: j.get("state_reason") or "None",
+    "Dependency": lambda j: json_text(j.get("dependency")),
+    "Requeue": lambda j: str(int(bool(j.get("requeue")))),
+    "Restarts": lambda j: json_int(j.get("restart_cnt")),
+    "BatchFlag": lambda j: str(int(bool(j.get("batch_flag")))),
+    "Reboot": lambda j: str(int(bool(j.get("reboot")))),
+    "ExitCode": lambda j: json_exit_code(j.get("exit_code")),
+    # depends on the query time, see `JsonJobFields`
+    "RunTime": None,
+    "TimeLimit": lambda j: json_minutes(j.get("time_limit")),
+    "TimeMin": lambda j: json_minutes(j.get("time_minimum")),
+    "SubmitTime": lambda j: json_date(j.get("submit_time")),
+    "EligibleTime": lambda j: json_date(j.get("eligible_time")),
+    "AccrueTime": lambda j: json_date(j.get("accrue_time")),
+    "StartTime": lambda j: json_date(j.get("start_time")),
+    "EndTime": lambda j: json_date(j.get("end_time")),
+    "Deadline": lambda j: json_date(j.get("deadline")).replace("Unknown", "N/A"),
+    "SuspendTime": lambda j: json_date(j.get("suspend_time")).replace("Unknown", "None"),
+    "SecsPreSuspend": lambda j: json_int(j.get("pre_sus_time")),
+    "LastSchedEval": lambda j: json_date(j.get("last_sched_evaluation")),
+    "Partition": lambda j: j.get("partition", ""),
+    "ReqNodeList": lambda j: json_text(j.get("required_nodes")),
+    "ExcNodeList": lambda j: json_text(j.get("excluded_nodes")),
+    "NodeList": lambda j: json_text(j.get("nodes")),
+    "BatchHost": lambda j: json_text(j.get("batch_host")),
+    "NumNodes": lambda j: json_int(j.get("node_count")),
+    "NumCPUs": lambda j: json_int(j.get("cpus")),
+    "NumTasks": lambda j: json_int(j.get("tasks")),
+    "CPUs/Task": lambda j: json_int(j.get("cpus_per_task"), default=1),
+    "ReqB:S:C:T": lambda j: ":".join([
+        json_count(j.get("boards_per_node")),
+        json_count(j.get("sockets_per_board")),
+        json_count(j.get("cores_per_socket")),
+        json_count(j.get("threads_per_core")),
+    ]),
+    "TRES": lambda j: json_text(j.get("tres_alloc_str") or j.get("tres_req_str")),
+    "Socks/Node": lambda j: json_count(j.get("sockets_per_node")),
+    "NtasksPerN:B:S:C": lambda j: ":".join([
+        json_int(j.get("tasks_per_node")),
+        json_int(j.get("tasks_per_board")),
+        json_count(j.get("tasks_per_socket")),
+        json_count(j.get("tasks_per_core")),
+    ]),
+    "CoreSpec": lambda j: json_count(j.get("core_spec")),
+    "MinCPUsNode": lambda j: json_int(j.get("minimum_cpus_per_node")),
+    "MinMemoryNode": lambda j: f"{json_int(j.get('memory_per_node'))}M",
+    "MinTmpDiskNode": lambda j: json_int(j.get("minimum_tmp_disk_per_node")),
+    "Features": lambda j: json_text(j.get("features")),
+    "DelayBoot": lambda j: as_slurm_timedelta(datetime.timedelta(seconds=json_number(j.get("delay_boot")) or 0)),
+    "OverSubscribe": lambda j: "NO" if j.get("exclusive") else "OK",
+    "Contiguous": lambda j: str(int(bool(j.get("contiguous")))),
+    "Command": lambda j: json_text(j.get("command")),
+    "WorkDir": lambda j: j.get("current_working_directory", ""),
+    "StdErr": lambda j: j.get("standard_error", ""),
+    "StdIn": lambda j: j.get("standard_input", ""),
+    "StdOut": lambda j: j.get("standard_output", ""),
+    "Power": lambda j: "",
+    "TresPerNode": lambda j: j.get("tres_per_node") or None,
+    "MailUser": lambda j: json_text(j.get("mail_user")),
+    "MailType": lambda j: json_list(j.get("mail_type")).replace("(null)", "NONE"),
+}
+
+
+class JsonJobFields(Mapping):
+    """Fields of a job as reported by `scontrol show jobs --json` and
+    slurmrestd, exposed under the names of `scontrol show jobs --oneliner` so
+    that `JobState` can be built the same way from all backends.
+
+    Like `JobState` attributes, fields are only converted when accessed. Two
+    instances compare equal when their JSON objects and run times are equal,
+    which is much cheaper than comparing converted fields."""
+
+    __slots__ = ("job", "run_time")
+
+    def __init__(self, job: Dict[str, Any], now: float):
+        self.job = job
+        self.run_time = as_slurm_timedelta(get_json_run_time(job, now))
+
+    def __getitem__(self, key: str) -> str:
+        if key == "RunTime":
+            return self.run_time
+
+        value = job_json_fields[key](self.job)
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __iter__(self):
+        return (key for key in job_json_fields if key in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, JsonJobFields):
+            return NotImplemented
+
+        return self.run_time == other.run_time and self.job == other.job
+
+    __hash__ = None
+
+
+def node_fields_from_json(node: Dict[str, Any]) -> Dict[str, str]:
+    """Converts a node as reported by `scontrol show nodes --json` and
+    slurmrestd to the fields of `scontrol show nodes --oneliner`."""
+    cpu_load = json_number(node.get("cpu_load"))
+    free_memory = json_number(node.get("free_mem"))
+
+    fields = {
+        "NodeName": node["name"],
+        "Arch": node.get("architecture", ""),
+        "CoresPerSocket": json_int(node.get("cores")),
+        "CPUAlloc": json_int(node.get("alloc_cpus")),
+        "CPUTot": json_int(node.get("cpus")),
+        # reported in hundredths
+        "CPULoad": f"{cpu_load / 100:.2f}" if cpu_load is not None else "N/A",
+        "AvailableFeatures": json_list(node.get("features")),
+        "ActiveFeatures": json_list(node.get("active_features")),
+        "Gres": json_text(node.get("gres")),
+        "NodeAddr": node.get("address", ""),
+        "NodeHostName": node.get("hostname", ""),
+        "Version": node.get("version", ""),
+        "OS": node.get("operating_system", ""),
+        "RealMemory": json_int(node.get("real_memory")),
+        "AllocMem": json_int(node.get("alloc_memory")),
+        "FreeMem": str(int(free_memory)) if free_memory is not None else "N/A",
+        "Sockets": json_int(node.get("sockets")),
+        "Boards": json_int(node.get("boards")),
+        "State": json_state(node.get("state"), node.get("state_flags")),
+        "ThreadsPerCore": json_int(node.get("threads"), default=1),
+        "Partitions": json_list(node.get("partitions")),
+        "CfgTRES": json_text(node.get("tres")),
+        "AllocTRES": node.get("tres_used") or "",
+    }
+
+    if node.get("reason"):
+        fields["Reason"] = node["reason"]
+
+    return fields
+
+
+def check_json_errors(data: Dict[str, Any]):
+    errors = data.get("errors") or []
+
+    if len(errors) > 0:
+        raise BackendError(f"Slurm reported errors: {errors}")
+
+
+class ScontrolTextBackend:
+    """Parses the `--oneliner` text output of `scontrol`, supported by all
+    Slurm versions.
+
+    `cluster` is set when monitoring several clusters, in which case `runner`
+    usually passes `-M` to select that cluster."""
+
+    def __init__(self, runner: ScontrolRunner, cluster: Optional[str] = None):
+        self.runner = runner
+        self.cluster = cluster
+
+        self.job_parser = IncrementalParser("JobId", functools.partial(JobState, cluster=cluster), "jobs", cluster)
+        self.node_parser = IncrementalParser("NodeName", functools.partial(NodeState, cluster=cluster), "nodes", cluster)
+
+    async def query_jobs(self) -> Tuple[Dict[str, JobState], ParseDiff]:
+        return await query_jobs(self.runner, self.job_parser)
+
+    async def query_nodes(self) -> Tuple[Dict[str, NodeState], ParseDiff]:
+        return await query_nodes(self.runner, self.node_parser)
+
+    async def query_job(self, job_id: str) -> JobState:
+        job = await query_job(job_id, self.runner, self.cluster)
+
+        # some scontrol versions print nothing for jobs that left slurmctld
+        if "JobId" not in job.fields:
+            raise BackendError(f"Job {job_id} not found")
+
+        return job
+
+    async def close(self):
+        pass
+
+
+class SlurmJsonBackend(ABC):
+    """Base of the backends reading Slurm's JSON data model. Subclasses only
+    fetch the decoded JSON documents."""
+
+    # labels the query metrics
+    name = "json"
+
+    def __init__(self, cluster: Optional[str] = None):
+        self.cluster = cluster
+
+        self.job_builder = IncrementalBuilder("JobId", functools.partial(JobState, cluster=cluster), "jobs", cluster)
+        self.node_builder = IncrementalBuilder("NodeName", functools.partial(NodeState, cluster=cluster), "nodes", cluster)
+
+    @abstractmethod
+    async def fetch(self, *path: str) -> Dict[str, Any]:
+        """Decoded JSON document of `path`, e.g. `("job", "42")`."""
+
+    async def fetch_timed(self, *path: str) -> Dict[str, Any]:
+        with slurm_query_seconds.labels(self.name, self.cluster or "", path[0]).time():
+            return await self.fetch(*path)
+
+    async def query_jobs(self) -> Tuple[Dict[str, JobState], ParseDiff]:
+        data = await self.fetch_timed("jobs")
+        check_json_errors(data)
+
+        now = time.time()
+        return self.job_builder.build(JsonJobFields(job, now) for job in data["jobs"])
+
+    async def query_nodes(self) -> Tuple[Dict[str, NodeState], ParseDiff]:
+        data = await self.fetch_timed("nodes")
+        check_json_errors(data)
+
+        return self.node_builder.build(node_fields_from_json(node) for node in data["nodes"])
+
+    async def query_job(self, job_id: str) -> JobState:
+        if not match_jobid.match(job_id):
+            raise ValueError("Invalid slurm JobID received")
+
+        data = await self.fetch_timed("job", job_id)
+        check_json_errors(data)
+
+        if len(data["jobs"]) == 0:
+            raise BackendError(f"Job {job_id} not found")
+
+        return JobState(JsonJobFields(data["jobs"][0], time.time()), self.cluster)
+
+    async def close(self):
+        pass
+
+
+class ScontrolJsonBackend(SlurmJsonBackend):
+    """Reads the `--json` output of `scontrol` (Slurm 21.08+), which needs no
+    tokenizing of free-form text."""
+
+    def __init__(self, runner: ScontrolRunner, cluster: Optional[str] = None):
+        super().__init__(cluster)
+        self.runner = runner
+
+    async def fetch(self, *path: str) -> Dict[str, Any]:
+        stdout = await self.runner.run("show", *path, "--json", count_errors=path[0] != "job")
+        return json.loads(stdout)
+
+
+class SlurmRestBackend(SlurmJsonBackend):
+    """Queries slurmrestd over a pooled HTTP connection, so that polling
+    spawns no process.
+
+    `url` is either an HTTP URL or `unix:/path/to/slurmrestd.socket`. The JWT,
+    if needed, is read from the `SLURM_JWT` environment variable like Slurm's
+    own tools do.
+
+    Requests time out after `timeout` seconds. Timeouts, connection errors and
+    server errors are reported to `breaker`, like `ScontrolRunner` does, since
+    slurmrestd forwards each request to slurmctld. They raise
+    `SlurmUnavailableError`, except server errors detailed by Slurm in JSON."""
+
+    name = "rest"
+
+    def __init__(
+        self,
+        url: str,
+        api_version: str = "v0.0.39",
+        token: Optional[str] = None,
+        cluster: Optional[str] = None,
+        timeout: float = 30,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        super().__init__(cluster)
+        self.url = url
+        self.api_version = api_version
+        self.token = token if token is not None else os.environ.get("SLURM_JWT")
+        self.timeout = timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker(cluster or "")
+
+        self.session = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            if self.url.startswith("unix:"):
+                connector = aiohttp.UnixConnector(path=self.url[len("unix:"):])
+                self.base_url = "http://localhost"
+            else:
+                connector = aiohttp.TCPConnector(limit=4)
+                self.base_url = self.url.rstrip("/")
+
+            headers = {"X-SLURM-USER-NAME": get_login()}
+            if self.token is not None:
+                headers["X-SLURM-USER-TOKEN"] = self.token
+
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+        return self.session
+
+    async def fetch(self, *path: str) -> Dict[str, Any]:
+        session = self.get_session()
+        url = "/".join([self.base_url, "slurm", self.api_version, *path])
+
+        # slurmrestd answers unknown job IDs with HTTP 500, which says nothing
+        # about the health of slurmctld, see `ScontrolRunner.run`
+        count_errors = path[0] != "job"
+
+        self.breaker.before_call()
+
+        try:
+            async with session.get(url) as response:
+                body = await response.read()
+        except asyncio.TimeoutError:
+            error = f"slurmrestd did not answer within {self.timeout:g}s"
+            self.breaker.record_failure(error)
+            raise SlurmUnavailableError(error)
+        except aiohttp.ClientError as e:
+            error = f"slurmrestd request failed: {e}"
+            self.breaker.record_failure(error)
+            raise SlurmUnavailableError(error)
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            # e.g. the HTML error page of a proxy in front of slurmrestd
+            data = None
+
+        if response.status >= 500:
+            error = f"slurmrestd returned HTTP {response.status}"
+
+            if count_errors:
+                self.breaker.record_failure(error)
+
+            if not isinstance(data, dict):
+                raise SlurmUnavailableError(error)
+        else:
+            self.breaker.record_success()
+
+            if not isinstance(data, dict):
+                raise BackendError(f"slurmrestd returned HTTP {response.status} without a JSON document")
+
+        if response.status != 200:
+            check_json_errors(data)
+            raise BackendError(f"slurmrestd returned HTTP {response.status}")
+
+        return data
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class SharedStoreBackend:
+    """Reads the snapshots that another swatch instance publishes with
+    `--publish` (see `sharedstore.py`), so that many instances on one login
+    node do not all query Slurm.
+
+    A document that was not replaced since the previous query yields the same
+    states without being read again. If it was already read and the publisher
+    reported an error, or stopped confirming it for longer than its
+    `stale_after`, queries fail so that pages show the data as stale."""
+
+    def __init__(self, reader: SharedStoreReader, cluster: Optional[str] = None):
+        self.reader = reader
+        self.cluster = cluster
+
+        self.job_builder = IncrementalBuilder("JobId", functools.partial(JobState, cluster=cluster), "jobs", cluster)
+        self.node_builder = IncrementalBuilder("NodeName", functools.partial(NodeState, cluster=cluster), "nodes", cluster)
+
+        # by entity, inode of the document the states were built from
+        self.inodes: Dict[str, int] = {}
+
+    def get_cluster_entry(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        for entry in document["clusters"]:
+            if entry["name"] == self.cluster:
+                return entry
+
+        published = ",".join(str(entry["name"]) for entry in document["clusters"] if entry["name"] is not None)
+
+        if self.cluster is None and published != "":
+            raise BackendError(f"{self.reader.path} holds several clusters, select them with -M {published}")
+
+        raise BackendError(f"{self.reader.path} has no data for {self.cluster or 'this cluster'} yet")
+
+    async def query_entity(self, entity: str, builder: IncrementalBuilder) -> Tuple[Dict[str, Any], ParseDiff]:
+        inode, document, age = await self.reader.read()
+        entry = self.get_cluster_entry(document)
+
+        if inode != self.inodes.get(entity):
+            states, diff = builder.build(entry[entity])
+            self.inodes[entity] = inode
+            return states, diff
+
+        if entry["error"] is not None:
+            raise SlurmUnavailableError(f"The collector failed to query Slurm: {entry['error']}")
+
+        if age > document["stale_after"]:
+            raise SlurmUnavailableError(f"{self.reader.path} was not updated for {age:.0f}s, is the collector running?")
+
+        return {key: state for key, (_, state) in builder.entries.items()}, ParseDiff()
+
+    async def query_jobs(self) -> Tuple[Dict[str, JobState], ParseDiff]:
+        return await self.query_entity("jobs", self.job_builder)
+
+    async def query_nodes(self) -> Tuple[Dict[str, NodeState], ParseDiff]:
+        return await self.query_entity("nodes", self.node_builder)
+
+    async def query_job(self, job_id: str) -> JobState:
+        if not match_jobid.match(job_id):
+            raise ValueError("Invalid slurm JobID received")
+
+        _, document, _ = await self.reader.read()
+
+        for fields in self.get_cluster_entry(document)["jobs"]:
+            if fields["JobId"] == job_id:
+                return JobState(fields, self.cluster)
+
+        raise BackendError(f"Job {job_id} not found")
+
+    async def close(self):
+        self.reader.close()
+
+
+backend_names = ["text", "json", "rest", "shared"]
+
+def parse_clusters(clusters: str) -> List[Tuple[str, Optional[str]]]:
+    """Parses the comma-separated `NAME` or `NAME=TARGET` entries of `-M`,
+    as `(name, target)` where `target` is `None` when not given."""
+    entries = []
+
+    for entry in clusters.split(","):
+        name, _, target = entry.partition("=")
+
+        if name == "" or "/" in name:
+            raise ValueError(f"Invalid cluster {entry!r}")
+
+        if any(name == other for other, _ in entries):
+            raise ValueError(f"Cluster {name!r} given more than once")
+
+        entries.append((name, target or None))
+
+    return entries
+
+def make_backend(
+    name: str,
+    scontrol: str = "scontrol",
+    slurmrestd_url: Optional[str] = None,
+    api_version: str = "v0.0.39",
+    cluster: Optional[str] = None,
+    scontrol_args: Sequence[str] = (),
+    timeout: float = 30,
+    slots: Optional[ProcessSlots] = None,
+    max_backoff: float = 300,
+    shared_store: Optional[SharedStoreReader] = None
+):
+    """Creates the backend `name`. Each backend gets its own `CircuitBreaker`,
+    so that a failing cluster does not suspend the queries to other ones,
+    while scontrol processes are bounded by the shared `slots`."""
+    breaker = CircuitBreaker(cluster or "", max_backoff=max_backoff)
+
+    if name in ("text", "json"):
+        runner = ScontrolRunner(scontrol, scontrol_args, timeout, slots, breaker)
+        backend_class = ScontrolTextBackend if name == "text" else ScontrolJsonBackend
+        return backend_class(runner, cluster)
+
+    if name == "rest":
+        if slurmrestd_url is None:
+            raise ValueError("The rest backend requires a slurmrestd URL")
+
+        return SlurmRestBackend(slurmrestd_url, api_version, cluster=cluster, timeout=timeout, breaker=breaker)
+
+    if name == "shared":
+        if shared_store is None:
+            raise ValueError("The shared backend requires a shared store")
+
+        return SharedStoreBackend(shared_store, cluster)
+
+    raise ValueError(f"Unknown backend {name!r}")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Compares the fetch and parse costs of the text, json and rest backends on
+the same synthetic cluster.
+
+The text and json backends run `fake_scontrol.py`, so their fetch time
+includes starting a Python interpreter, which is usually faster than a real
+`scontrol` querying the controller. The rest backend queries a
+`fake_slurmrestd.py` started in a subprocess.
+
+Run from the repository root: `python benchmarks/bench_backends.py --jobs 10000 --nodes 1000`"""
+
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict
+
+benchmarks_path = Path(__file__).absolute().parent
+sys.path.insert(0, str(benchmarks_path.parent))
+
+import aiohttp
+
+from fixtures import make_job_lines, make_node_lines
+from fake_slurmrestd import make_jobs_document, make_nodes_document
+from backends import *
+
+
+async def measure(function: Callable[[], Awaitable[Any]], repeat: int) -> Dict[str, float]:
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await function()
+        timings.append(time.perf_counter() - start)
+
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+
+async def run_fake_scontrol(*args: str) -> bytes:
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, str(benchmarks_path / "fake_scontrol.py"), *args,
+        stdout=asyncio.subprocess.PIPE)
+
+    stdout, _ = await proc.communicate()
+    return stdout
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_server(session: aiohttp.ClientSession, url: str):
+    for _ in range(100):
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                return
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.1)
+
+    raise RuntimeError("fake_slurmrestd did not start")
+
+
+async def benchmark(args, fixtures_dir: Path, port: int):
+    results = {}
+
+    async def run(stage: str, function: Callable[[], Awaitable[Any]]):
+        results[stage] = await measure(function, args.repeat)
+        print(f"  {stage:<28} {results[stage]['min'] * 1000:10.2f}ms")
+
+    job_text = (fixtures_dir / "jobs.txt").read_text().splitlines()
+    job_json = (fixtures_dir / "jobs.json").read_bytes()
+
+    # raw outputs, with no parsing
+    await run("fetch/text", lambda: run_fake_scontrol("show", "jobs", "--oneliner"))
+    await run("fetch/json", lambda: run_fake_scontrol("show", "jobs", "--json"))
+
+    headers = {"X-SLURM-USER-NAME": "bench"}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        jobs_url = f"http://localhost:{port}/slurm/v0.0.39/jobs"
+        await wait_for_server(session, jobs_url)
+
+        async def fetch_rest():
+            async with session.get(jobs_url) as response:
+                return await response.read()
+
+        await run("fetch/rest", fetch_rest)
+
+    # parsing from scratch, i.e. the first refresh
+    async def parse_text():
+        return IncrementalParser("JobId", JobState, "jobs").parse(job_text)
+
+    async def parse_json():
+        now = time.time()
+        return IncrementalBuilder("JobId", JobState, "jobs").build(
+            JsonJobFields(job, now) for job in json.loads(job_json)["jobs"])
+
+    await run("parse/text", parse_text)
+    await run("parse/json", parse_json)
+
+    # complete refreshes of jobs and nodes with warm incremental caches
+    backends = {
+        "text": make_backend("text", scontrol=str(benchmarks_path / "fake_scontrol.py")),
+        "json": make_backend("json", scontrol=str(benchmarks_path / "fake_scontrol.py")),
+        "rest": make_backend("rest", slurmrestd_url=f"http://localhost:{port}"),
+    }
+
+    for name, backend in backends.items():
+        async def refresh():
+            return await asyncio.gather(backend.query_jobs(), backend.query_nodes())
+
+        await refresh()
+        await run(f"refresh/{name}", refresh)
+        await backend.close()
+
+    return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as fixtures_dir:
+        fixtures_dir = Path(fixtures_dir)
+
+        job_lines = make_job_lines(args.jobs, args.seed, args.nodes)
+        node_lines = make_node_lines(args.nodes, args.seed)
+        (fixtures_dir / "jobs.txt").write_text("\n".join(job_lines) + "\n")
+        (fixtures_dir / "nodes.txt").write_text("\n".join(node_lines) + "\n")
+        (fixtures_dir / "jobs.json").write_text(json.dumps(make_jobs_document(job_lines)))
+        (fixtures_dir / "nodes.json").write_text(json.dumps(make_nodes_document(node_lines)))
+
+        os.environ["SWATCH_FIXTURES_DIR"] = str(fixtures_dir)
+
+        port = get_free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable, str(benchmarks_path / "fake_slurmrestd.py"),
+                "--jobs", str(args.jobs), "--nodes", str(args.nodes),
+                "--seed", str(args.seed), "--port", str(port)
+            ],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        try:
+            print(f"{args.jobs} jobs, {args.nodes} nodes, best of {args.repeat}:")
+            asyncio.run(benchmark(args, fixtures_dir, port))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
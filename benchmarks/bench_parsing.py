@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Compares `parsing.parse_info_line` against the original word-splitting
+implementation on a large synthetic `scontrol show jobs` dump.
+
+Run from the repository root: `python benchmarks/bench_parsing.py`"""
+
+import sys
+import timeit
+from argparse import ArgumentParser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from fixtures import make_job_lines
+from parsing import parse_info_line
+
+
+def parse_info_line_reference(job_line: str) -> dict:
+    fields = {}
+    last_field = None
+
+    for word in job_line.split(" "):
+        if "=" in word:
+            eq_index = word.index("=")
+            last_field = word[:eq_index]
+            fields[last_field] = word[eq_index+1:]
+        elif last_field is not None:
+            fields[last_field] += f" {word}"
+
+    return {k: v.strip() for k, v in fields.items()}
+
+
+def time_parser(parser, lines, repeat: int) -> float:
+    return min(timeit.repeat(lambda: [parser(line) for line in lines], number=1, repeat=repeat))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=40000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = make_job_lines(args.jobs)
+
+    for line in lines:
+        expected = parse_info_line_reference(line)
+        if parse_info_line(line) != expected:
+            raise AssertionError(f"parse_info_line differs from the reference on: {line}")
+
+    reference_time = time_parser(parse_info_line_reference, lines, args.repeat)
+    current_time = time_parser(parse_info_line, lines, args.repeat)
+
+    print(f"{args.jobs} lines, best of {args.repeat}:")
+    print(f"  reference:       {reference_time * 1000:8.1f}ms")
+    print(f"  parse_info_line: {current_time * 1000:8.1f}ms ({reference_time / current_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Emulates `sacct --parsable2 --noheader --format=... --starttime=...
+--endtime=...`, as queried by the job history (`--sacct-path`).
+
+Reports one synthetic job ending every `SWATCH_FAKE_SACCT_PERIOD` seconds
+(20 by default), the same ones on each call: jobs are derived from their end
+time, so that overlapping queries report the same jobs again. `--state` is
+ignored, all reported jobs have ended. Use with e.g.
+`--job-history-db /tmp/jobs.db --sacct-path benchmarks/fake_sacct.py`."""
+
+import datetime
+import os
+import random
+import sys
+
+
+def get_option(name: str) -> str:
+    for arg in sys.argv[1:]:
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+
+    sys.exit(f"--{name} is required")
+
+
+def parse_time(value: str) -> int:
+    if value == "now":
+        return int(datetime.datetime.now().timestamp())
+
+    return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+def format_time(t: int) -> str:
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def make_job(end: int, period: int) -> dict:
+    job_id = 1_000_000 + end // period % 9_000_000
+    rng = random.Random(job_id)
+
+    gpus = rng.choice([0, 0, 1, 2, 4])
+    partition = "gpu" if gpus > 0 else "cpuonly"
+    nodes = rng.choice([1, 1, 1, 2])
+    cpus = rng.choice([4, 8, 16, 32]) * nodes
+    elapsed = rng.randrange(10, 3 * 86400)
+    state = rng.choice(["COMPLETED"] * 6 + ["FAILED", "TIMEOUT", "OUT_OF_MEMORY", "CANCELLED by 1001"])
+    user = f"user{rng.randrange(50):03}"
+    first_node = rng.randrange(1, 8)
+
+    tres = f"billing={cpus},cpu={cpus},mem={cpus * 4}G,node={nodes}"
+    if gpus > 0:
+        tres += f",gres/gpu={gpus * nodes}"
+
+    return {
+        "JobIDRaw": str(job_id),
+        # about a third of the jobs are array tasks
+        "JobID": f"{job_id - job_id % 10}_{job_id % 10}" if job_id % 10 > 0 and job_id % 3 == 0 else str(job_id),
+        "User": user,
+        "UID": str(1000 + int(user[4:])),
+        "Group": "users",
+        "GID": "100",
+        "Account": "research",
+        "QOS": "normal",
+        "Partition": partition,
+        "State": state,
+        "Reason": "None",
+        "ExitCode": "0:0" if state == "COMPLETED" else "1:0",
+        "Submit": format_time(end - elapsed - rng.randrange(0, 3600)),
+        "Eligible": format_time(end - elapsed - 60),
+        "Start": format_time(end - elapsed),
+        "End": format_time(end),
+        "ElapsedRaw": str(elapsed),
+        "Timelimit": "3-00:00:00",
+        "NNodes": str(nodes),
+        "AllocCPUS": str(cpus),
+        "ReqMem": f"{cpus * 4}G",
+        "AllocTRES": tres,
+        "ReqTRES": tres,
+        "NodeList": f"{partition}[{first_node:03}-{first_node + nodes - 1:03}]" if nodes > 1 else f"{partition}{first_node:03}",
+        "WorkDir": f"/home/{user}/experiments",
+        "JobName": f"train_{job_id % 97}",
+    }
+
+
+def main():
+    period = int(os.environ.get("SWATCH_FAKE_SACCT_PERIOD", "20"))
+    fields = get_option("format").split(",")
+    start = parse_time(get_option("starttime"))
+    end = parse_time(get_option("endtime"))
+
+    lines = []
+    for job_end in range(start - start % period + period, end + 1, period):
+        job = make_job(job_end, period)
+        lines.append("|".join(job[field] for field in fields))
+
+    sys.stdout.write("".join(line + "\n" for line in lines))
+
+
+if __name__ == "__main__":
+    main()
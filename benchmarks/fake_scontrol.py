@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Emulates `scontrol show jobs|nodes|job <id>` with and without `--json`,
+reading fixtures from the directory in `SWATCH_FIXTURES_DIR`. That directory
+is filled by `fixtures.py --output-dir` (text output) and
+`fake_slurmrestd.py --output-dir` (JSON output).
+
+Used by `bench_backends.py` through the `--scontrol-path` of the text and json
+backends."""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+
+def main():
+    fixtures_dir = Path(os.environ["SWATCH_FIXTURES_DIR"])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    as_json = "--json" in sys.argv
+
+    if args[:1] != ["show"] or len(args) < 2:
+        sys.exit("usage: fake_scontrol.py show jobs|nodes|job <id> [--json] [--oneliner]")
+
+    if args[1] in ("jobs", "nodes"):
+        path = fixtures_dir / f"{args[1]}.{'json' if as_json else 'txt'}"
+        sys.stdout.buffer.write(path.read_bytes())
+        return
+
+    if args[1] == "job":
+        if as_json:
+            document = json.loads((fixtures_dir / "jobs.json").read_bytes())
+            document["jobs"] = [job for job in document["jobs"] if str(job["job_id"]) == args[2]]
+            print(json.dumps(document))
+        else:
+            prefix = f"JobId={args[2]} "
+            with open(fixtures_dir / "jobs.txt") as f:
+                sys.stdout.write("".join(line for line in f if line.startswith(prefix)))
+        return
+
+    sys.exit(f"unsupported entity {args[1]!r}")
+
+
+if __name__ == "__main__":
+    main()
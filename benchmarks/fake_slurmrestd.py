@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Local stand-in for slurmrestd serving the synthetic clusters of
+`fixtures.py` as Slurm JSON, to try and benchmark the `rest` backend without
+a Slurm cluster.
+
+Serves `/slurm/<version>/jobs`, `/slurm/<version>/nodes` and
+`/slurm/<version>/job/<job id>`:
+`python benchmarks/fake_slurmrestd.py --jobs 10000 --nodes 1000 --port 6820`
+then run swatch with `--backend rest --slurmrestd-url http://localhost:6820`.
+
+The documents can also be written to disk with `--output-dir`, for
+`fake_scontrol.py` to emulate `scontrol show ... --json`."""
+
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from aiohttp import web
+
+from fixtures import make_job_lines, make_node_lines
+from jobstate import parse_exit_code, parse_name_with_id
+from parsing import *
+
+
+def number(value: Any) -> Dict[str, Any]:
+    return {"set": value is not None, "infinite": False, "number": value if value is not None else 0}
+
+def epoch(date: str) -> Dict[str, Any]:
+    parsed = parse_slurm_date(date)
+    return number(int(parsed.timestamp()) if parsed is not None else 0)
+
+def minutes(duration: str) -> Dict[str, Any]:
+    parsed = parse_slurm_timedelta(duration)
+    return number(int(parsed.total_seconds() // 60) if parsed is not None else None)
+
+def nullable(value: str) -> str:
+    return "" if value == "(null)" else value
+
+
+def job_as_slurm_json(fields: Dict[str, str]) -> Dict[str, Any]:
+    user_name, user_id = parse_name_with_id(fields["UserId"])
+    group_name, group_id = parse_name_with_id(fields["GroupId"])
+    exit_code, exit_signal = parse_exit_code(fields["ExitCode"])
+    running = fields["JobState"] in ("RUNNING", "COMPLETING")
+
+    job = {
+        "job_id": int(fields["JobId"]),
+        "name": fields["JobName"],
+        "user_name": user_name,
+        "user_id": user_id,
+        "group_name": group_name,
+        "group_id": group_id,
+        "priority": number(int(fields["Priority"])),
+        "nice": int(fields["Nice"]),
+        "account": nullable(fields["Account"]),
+        "qos": fields["QOS"],
+        "job_state": [fields["JobState"]],
+        "state_reason": fields["Reason"],
+        "dependency": nullable(fields["Dependency"]),
+        "requeue": fields["Requeue"] == "1",
+        "restart_cnt": int(fields["Restarts"]),
+        "batch_flag": fields["BatchFlag"] == "1",
+        "reboot": fields["Reboot"] == "1",
+        "exit_code": {"status": ["SUCCESS"], "return_code": number(exit_code), "signal": {"id": number(exit_signal)}},
+        "time_limit": minutes(fields["TimeLimit"]),
+        "time_minimum": minutes(fields["TimeMin"]),
+        "submit_time": epoch(fields["SubmitTime"]),
+        "eligible_time": epoch(fields["EligibleTime"]),
+        "accrue_time": epoch(fields["AccrueTime"]),
+        "start_time": epoch(fields["StartTime"]),
+        "end_time": epoch(fields["EndTime"]),
+        "last_sched_evaluation": epoch(fields["LastSchedEval"]),
+        "partition": fields["Partition"],
+        "required_nodes": nullable(fields["ReqNodeList"]),
+        "excluded_nodes": nullable(fields["ExcNodeList"]),
+        "nodes": nullable(fields["NodeList"]),
+        "batch_host": fields["BatchHost"],
+        "node_count": number(int(fields["NumNodes"])),
+        "cpus": number(int(fields["NumCPUs"])),
+        "tasks": number(int(fields["NumTasks"])),
+        "cpus_per_task": number(int(fields["CPUs/Task"])),
+        "tres_req_str": fields["TRES"],
+        "tres_alloc_str": fields["TRES"] if running else "",
+        "minimum_cpus_per_node": number(int(fields["MinCPUsNode"])),
+        "memory_per_node": number(int(parse_size_mbytes(fields["MinMemoryNode"]))),
+        "minimum_tmp_disk_per_node": number(int(fields["MinTmpDiskNode"])),
+        "features": nullable(fields["Features"]),
+        "contiguous": fields["Contiguous"] == "1",
+        "command": fields["Command"],
+        "current_working_directory": fields["WorkDir"],
+        "standard_error": fields["StdErr"],
+        "standard_input": fields["StdIn"],
+        "standard_output": fields["StdOut"],
+        "mail_user": fields["MailUser"],
+        "mail_type": [],
+        "array_job_id": number(int(fields.get("ArrayJobId", 0))),
+        "array_task_id": number(None),
+        "array_task_string": "",
+        "array_max_tasks": number(int(fields.get("ArrayTaskThrottle", 0))),
+    }
+
+    if "ArrayTaskId" in fields:
+        if fields["ArrayTaskId"].isdigit():
+            job["array_task_id"] = number(int(fields["ArrayTaskId"]))
+        else:
+            job["array_task_string"] = fields["ArrayTaskId"]
+
+    if "TresPerNode" in fields:
+        job["tres_per_node"] = fields["TresPerNode"]
+
+    return job
+
+
+def node_as_slurm_json(fields: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        "name": fields["NodeName"],
+        "architecture": fields["Arch"],
+        "cores": int(fields["CoresPerSocket"]),
+        "cpus": int(fields["CPUTot"]),
+        "alloc_cpus": int(fields["CPUAlloc"]),
+        "cpu_load": round(float(fields["CPULoad"]) * 100),
+        "features": fields["AvailableFeatures"].split(","),
+        "active_features": fields["ActiveFeatures"].split(","),
+        "gres": nullable(fields["Gres"]),
+        "address": fields["NodeAddr"],
+        "hostname": fields["NodeHostName"],
+        "version": fields["Version"],
+        "operating_system": fields["OS"],
+        "real_memory": int(fields["RealMemory"]),
+        "alloc_memory": int(fields["AllocMem"]),
+        "free_mem": number(int(fields["FreeMem"])),
+        "sockets": int(fields["Sockets"]),
+        "boards": int(fields["Boards"]),
+        "state": fields["State"].split("+"),
+        "reason": fields.get("Reason", ""),
+        "threads": int(fields["ThreadsPerCore"]),
+        "partitions": fields["Partitions"].split(","),
+        "tres": fields["CfgTRES"],
+        "tres_used": fields["AllocTRES"],
+    }
+
+
+def make_document(name: str, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "meta": {"plugin": {"type": "openapi/v0.0.39", "name": "fake_slurmrestd"}},
+        "errors": [],
+        "warnings": [],
+        name: entries,
+    }
+
+def make_jobs_document(job_lines: List[str]) -> Dict[str, Any]:
+    return make_document("jobs", [job_as_slurm_json(parse_info_line(line)) for line in job_lines])
+
+def make_nodes_document(node_lines: List[str]) -> Dict[str, Any]:
+    return make_document("nodes", [node_as_slurm_json(parse_info_line(line)) for line in node_lines])
+
+
+proxy_error_page = "<html><body><h1>Proxy error</h1><p>The upstream server is not answering.</p></body></html>"
+
+
+def make_app(jobs_document: Dict[str, Any], nodes_document: Dict[str, Any], proxy_error: Optional[int] = None) -> web.Application:
+    """slurmrestd serving the given documents, or answering every request with
+    the HTML error page of a reverse proxy when `proxy_error` (e.g. 502) is
+    set, as when slurmrestd is down behind one."""
+    jobs_body = json.dumps(jobs_document).encode("utf-8")
+    nodes_body = json.dumps(nodes_document).encode("utf-8")
+    jobs_by_id = {str(job["job_id"]): job for job in jobs_document["jobs"]}
+
+    @web.middleware
+    async def check_user(request: web.Request, handler):
+        if "X-SLURM-USER-NAME" not in request.headers:
+            document = make_document("jobs", [])
+            document["errors"].append({"error": "Missing X-SLURM-USER-NAME header"})
+            return web.json_response(document, status=401)
+
+        return await handler(request)
+
+    async def get_jobs(request: web.Request):
+        return web.Response(body=jobs_body, content_type="application/json")
+
+    async def get_nodes(request: web.Request):
+        return web.Response(body=nodes_body, content_type="application/json")
+
+    async def get_job(request: web.Request):
+        job = jobs_by_id.get(request.match_info["job_id"])
+
+        if job is None:
+            document = make_document("jobs", [])
+            document["errors"].append({"error": "Invalid job id specified", "error_number": 2017})
+            return web.json_response(document, status=500)
+
+        return web.json_response(make_document("jobs", [job]))
+
+    @web.middleware
+    async def fail_as_proxy(request: web.Request, handler):
+        return web.Response(text=proxy_error_page, status=proxy_error, content_type="text/html")
+
+    app = web.Application(middlewares=[check_user] if proxy_error is None else [fail_as_proxy])
+    app.add_routes([
+        web.get("/slurm/{version}/jobs", get_jobs),
+        web.get("/slurm/{version}/nodes", get_nodes),
+        web.get("/slurm/{version}/job/{job_id}", get_job),
+    ])
+
+    return app
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=6820)
+    parser.add_argument("--unix-socket", help="Listen on this unix socket rather than on a TCP port")
+    parser.add_argument("--proxy-error", type=int, metavar="STATUS", help="Answer every request with an HTML error page of this HTTP status, e.g. 502, like a proxy whose slurmrestd is down")
+    parser.add_argument("--output-dir", type=Path, help="Write jobs.json and nodes.json to this directory instead of serving them")
+    args = parser.parse_args()
+
+    jobs_document = make_jobs_document(make_job_lines(args.jobs, args.seed, args.nodes))
+    nodes_document = make_nodes_document(make_node_lines(args.nodes, args.seed))
+
+    if args.output_dir is not None:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        (args.output_dir / "jobs.json").write_text(json.dumps(jobs_document))
+        (args.output_dir / "nodes.json").write_text(json.dumps(nodes_document))
+        return
+
+    app = make_app(jobs_document, nodes_document, args.proxy_error)
+
+    if args.unix_socket is not None:
+        web.run_app(app, path=args.unix_socket)
+    else:
+        web.run_app(app, host="localhost", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
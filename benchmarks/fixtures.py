@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Synthetic `scontrol show jobs/nodes --oneliner` outputs for benchmarking.
+
+The generated clusters have `gpu` and `cpuonly` partitions, multi-node jobs,
+job arrays, typed GPU TRES and long pending reasons.
+
+Can also be run to write fixtures to disk:
+`python benchmarks/fixtures.py --jobs 10000 --nodes 1000 --output-dir /tmp/fixtures`"""
+
+import random
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List
+
+users = [f"user{i:03}" for i in range(200)]
+
+partitions = ["gpu", "cpuonly"]
+
+gpu_types = [("a100", 4), ("v100", 8), ("rtx8000", 8)]
+
+job_states = ["RUNNING"] * 6 + ["PENDING"] * 3 + ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT"]
+
+pending_reasons = [
+    "Priority",
+    "Resources",
+    "QOSMaxGRESPerUser",
+    "ReqNodeNotAvail, UnavailableNodes:gpu[003,007-009],cpuonly[010-012]",
+    "Dependency",
+]
+
+node_down_reasons = [
+    "Not responding",
+    "Kill task failed [root@2022-11-01T10:00:00]",
+    "Maintenance: replacing GPU 3, see ticket 1234 [admin@2022-11-01T09:00:00]",
+]
+
+
+def get_node_name(partition: str, index: int) -> str:
+    return f"{partition}{index:03}"
+
+
+def make_job_line(rng: random.Random, job_id: int, nodes_per_partition: int, array_job_id: int = None, array_task_id: str = None) -> str:
+    user = rng.choice(users)
+    state = "PENDING" if array_task_id is not None and "-" in array_task_id else rng.choice(job_states)
+    partition = rng.choice(partitions)
+    num_nodes = min(rng.choice([1, 1, 1, 2, 4, 16]), nodes_per_partition)
+    cpus = rng.choice([1, 4, 8, 16, 32]) * num_nodes
+    gpus = rng.choice([1, 2, 4]) if partition == "gpu" else 0
+    gpu_type, _ = rng.choice(gpu_types)
+
+    if state == "PENDING":
+        node_list = "(null)"
+        reason = rng.choice(pending_reasons)
+    else:
+        first_node = rng.randrange(1, nodes_per_partition - num_nodes + 2)
+        if num_nodes > 1:
+            node_list = f"{partition}[{first_node:03}-{first_node + num_nodes - 1:03}]"
+        else:
+            node_list = get_node_name(partition, first_node)
+        reason = "None"
+
+    tres = f"cpu={cpus},mem={cpus * 4}G,node={num_nodes},billing={cpus}"
+    if gpus > 0:
+        tres += f",gres/gpu={gpus * num_nodes},gres/gpu:{gpu_type}={gpus * num_nodes}"
+
+    array_fields = ""
+    if array_job_id is not None:
+        array_fields = f" ArrayJobId={array_job_id} ArrayTaskId={array_task_id}"
+        if "%" in array_task_id:
+            array_fields += f" ArrayTaskThrottle={array_task_id[array_task_id.index('%')+1:]}"
+
+    workdir = f"/home/{user}/my experiments/run {job_id % 17}"
+
+    priority = rng.randrange(1, 100000)
+
+    # drawn for pending jobs too, so that the other jobs stay the same
+    run_time = f"0{rng.randrange(0, 3)}-{rng.randrange(0, 24):02}:{rng.randrange(0, 60):02}:{rng.randrange(0, 60):02}"
+    if state == "PENDING":
+        run_time = "00:00:00"
+
+    return " ".join([
+        f"JobId={job_id}{array_fields} JobName=train_{job_id % 97} UserId={user}({1000 + users.index(user)}) GroupId=users(100) MCS_label=N/A",
+        f"Priority={priority} Nice=0 Account=(null) QOS=normal",
+        f"JobState={state} Reason={reason} Dependency=(null)",
+        "Requeue=1 Restarts=0 BatchFlag=1 Reboot=0 ExitCode=0:0",
+        f"RunTime={run_time} TimeLimit=3-00:00:00 TimeMin=N/A",
+        "SubmitTime=2022-11-01T10:00:00 EligibleTime=2022-11-01T10:00:00 AccrueTime=2022-11-01T10:00:00",
+        "StartTime=2022-11-01T10:00:01 EndTime=2022-11-04T10:00:01 Deadline=N/A",
+        "SuspendTime=None SecsPreSuspend=0 LastSchedEval=2022-11-01T10:00:01 Scheduler=Main",
+        f"Partition={partition} AllocNode:Sid=login01:{rng.randrange(1000, 99999)}",
+        f"ReqNodeList=(null) ExcNodeList=(null) NodeList={node_list} BatchHost={get_node_name(partition, 1)}",
+        f"NumNodes={num_nodes} NumCPUs={cpus} NumTasks={num_nodes} CPUs/Task={cpus // num_nodes} ReqB:S:C:T=0:0:*:*",
+        f"TRES={tres} Socks/Node=* NtasksPerN:B:S:C=0:0:*:* CoreSpec=*",
+        f"MinCPUsNode={cpus // num_nodes} MinMemoryNode={cpus * 4 // num_nodes}G MinTmpDiskNode=0",
+        "Features=(null) DelayBoot=00:00:00 OverSubscribe=OK Contiguous=0 Licenses=(null) Network=(null)",
+        f"Command=/home/{user}/bin/train.sh --config configs/run {job_id % 5}.yaml --lr=0.001",
+        f"WorkDir={workdir} StdErr={workdir}/slurm-{job_id}.out StdIn=/dev/null StdOut={workdir}/slurm-{job_id}.out",
+        "Power=" + (f" TresPerNode=gres:gpu:{gpus}" if gpus > 0 else ""),
+        f"MailUser={user} MailType=NONE",
+    ])
+
+
+def make_job_lines(count: int, seed: int = 0, nodes: int = 200) -> List[str]:
+    """Generates `count` job lines, a few percent of them belonging to job arrays,
+    allocated on a cluster of `nodes` nodes as generated by `make_node_lines`."""
+    rng = random.Random(seed)
+    nodes_per_partition = max(nodes // len(partitions), 1)
+
+    lines = []
+    job_id = 100000
+
+    while len(lines) < count:
+        if rng.random() < 0.01:
+            # array: running tasks have their own line and job id, pending
+            # tasks share one line with the job id of the array itself
+            array_job_id = job_id
+            running_tasks = rng.randrange(1, 20)
+            pending_tasks = rng.randrange(0, 1000)
+
+            if pending_tasks > 0:
+                task_range = f"{running_tasks}-{running_tasks + pending_tasks - 1}%{rng.choice([10, 50])}"
+                lines.append(make_job_line(rng, array_job_id, nodes_per_partition, array_job_id, task_range))
+                job_id += 1
+
+            for task_id in range(running_tasks):
+                lines.append(make_job_line(rng, job_id, nodes_per_partition, array_job_id, str(task_id)))
+                job_id += 1
+
+            continue
+
+        lines.append(make_job_line(rng, job_id, nodes_per_partition))
+        job_id += 1
+
+    return lines[:count]
+
+
+def make_node_line(rng: random.Random, partition: str, index: int) -> str:
+    name = get_node_name(partition, index)
+
+    sockets = 2
+    cores_per_socket = rng.choice([16, 32])
+    cpu_total = sockets * cores_per_socket * 2
+    memory_total = rng.choice([256, 512, 1024]) * 1024
+
+    state = rng.choice(["MIXED"] * 5 + ["ALLOCATED"] * 3 + ["IDLE", "DOWN+DRAIN"])
+    up = state not in ("DOWN+DRAIN",)
+    cpu_alloc = 0 if state == "IDLE" or not up else rng.randrange(1, cpu_total + 1)
+    memory_alloc = 0 if cpu_alloc == 0 else rng.randrange(0, memory_total)
+
+    cfg_tres = f"cpu={cpu_total},mem={memory_total // 1024}G,billing={cpu_total}"
+    alloc_tres = f"cpu={cpu_alloc},mem={memory_alloc // 1024}G" if cpu_alloc > 0 else ""
+
+    features = "intel,avx512"
+    gres = "(null)"
+
+    if partition == "gpu":
+        gpu_type, gpu_count = rng.choice(gpu_types)
+        gres = f"gpu:{gpu_type}:{gpu_count}(S:0-1)"
+        features += f",{gpu_type},{rng.choice(['32gb', '48gb', '80gb'])}"
+        cfg_tres += f",gres/gpu={gpu_count}"
+        if cpu_alloc > 0:
+            alloc_tres += f",gres/gpu={rng.randrange(0, gpu_count + 1)}"
+
+    reason = f" Reason={rng.choice(node_down_reasons)}" if not up else ""
+
+    return " ".join([
+        f"NodeName={name} Arch=x86_64 CoresPerSocket={cores_per_socket}",
+        f"CPUAlloc={cpu_alloc} CPUTot={cpu_total} CPULoad={rng.uniform(0, cpu_total):.2f}",
+        f"AvailableFeatures={features} ActiveFeatures={features}",
+        f"Gres={gres}",
+        f"NodeAddr={name} NodeHostName={name} Version=22.05.6",
+        "OS=Linux 5.4.0-126-generic #142-Ubuntu SMP Fri Aug 26 12:12:57 UTC 2022",
+        f"RealMemory={memory_total} AllocMem={memory_alloc} FreeMem={rng.randrange(0, memory_total)} Sockets={sockets} Boards=1",
+        f"State={state} ThreadsPerCore=2 TmpDisk=0 Weight=1 Owner=N/A MCS_label=N/A",
+        f"Partitions={partition}",
+        "BootTime=2022-10-01T00:00:00 SlurmdStartTime=2022-10-01T00:01:00",
+        f"LastBusyTime=2022-11-01T10:00:01 CfgTRES={cfg_tres} AllocTRES={alloc_tres}",
+        "CapWatts=n/a CurrentWatts=0 AveWatts=0 ExtSensorsJoules=n/s ExtSensorsWatts=0 ExtSensorsTemp=n/s" + reason,
+    ])
+
+
+def make_node_lines(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    nodes_per_partition = max(count // len(partitions), 1)
+
+    return [
+        make_node_line(rng, partition, index)
+        for partition in partitions
+        for index in range(1, nodes_per_partition + 1)
+    ][:count]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", type=Path, required=True)
+    args = parser.parse_args()
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    (args.output_dir / "jobs.txt").write_text("\n".join(make_job_lines(args.jobs, args.seed, args.nodes)) + "\n")
+    (args.output_dir / "nodes.txt").write_text("\n".join(make_node_lines(args.nodes, args.seed)) + "\n")
+
+
+if __name__ == "__main__":
+    main()
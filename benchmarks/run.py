@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""Times each stage of serving swatch pages on synthetic clusters: parsing,
+state construction, filtering, sorting and template rendering, as well as
+the server startup.
+
+Run from the repository root:
+`python benchmarks/run.py --sizes small,medium --output results.json`
+
+Results saved with `--output` can be compared against a later run with
+`--compare results.json`."""
+
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+
+from mako.lookup import TemplateLookup
+
+from fixtures import make_job_lines, make_node_lines
+from jobstate import *
+from nodestate import *
+from snapshot import build_snapshot
+from filters import *
+from query import compile_job_query
+from columnar import JobColumns
+from pagination import job_sort_columns, paginate_jobs
+from partitions import summarize_partitions
+from fit import FreeResourceIndex, find_fits, get_free_resources, parse_resource_request
+from jobhistory import JobHistoryStore, sacct_fields
+from leanrows import LeanJobRows
+from fake_sacct import make_job
+
+# (jobs, nodes)
+cluster_sizes = {
+    "small": (1000, 100),
+    "medium": (10000, 1000),
+    "large": (100000, 5000),
+}
+
+filter_queries = {
+    "none": {},
+    "state": {"state": "RUNNING,PENDING"},
+    "user": {"user": "user005,user007"},
+    "partition_state": {"partition": "gpu", "state": "PENDING"},
+    "node": {"node": "gpu003,cpuonly010"},
+    "user_state": {"user": "user005", "state": "PENDING"},
+    "negated": {"state": "!COMPLETED"},
+    "prefix": {"user": "user00*"},
+}
+
+fit_queries = {
+    "cpus": {"cpus": "16"},
+    "memory": {"cpus": "4", "memory": "256G"},
+    "gpus": {"cpus": "8", "gpus": "v100:4"},
+    "features": {"cpus": "8", "features": "avx512&48gb"},
+    "multi_node": {"cpus": "64", "nodes": "8"},
+}
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+
+def touch_job_table_fields(job: JobState):
+    """Reads the fields the job table needs, so that they get parsed."""
+    return (
+        job.job_id, job.job_state, job.job_state_reasons, job.partition,
+        job.user_name, job.job_name, job.nodes, job.run_time,
+        job.get_cpus(), job.get_ram(), job.get_gpus(), job.get_node_count()
+    )
+
+
+def benchmark_cluster(job_count: int, node_count: int, repeat: int, render_repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    def run(stage: str, function: Callable[[], Any], stage_repeat: int = repeat):
+        results[stage] = measure(function, stage_repeat)
+        print(f"  {stage:<32} {results[stage]['min'] * 1000:10.2f}ms")
+
+    job_lines = make_job_lines(job_count, nodes=node_count)
+    node_lines = make_node_lines(node_count)
+
+    run("parse_info_line/jobs", lambda: [parse_info_line(line) for line in job_lines])
+    run("parse_info_line/nodes", lambda: [parse_info_line(line) for line in node_lines])
+
+    job_fields = [parse_info_line(line) for line in job_lines]
+    node_fields = [parse_info_line(line) for line in node_lines]
+
+    run("JobState/construction", lambda: [JobState(fields) for fields in job_fields])
+    run("JobState/table_fields", lambda: [touch_job_table_fields(JobState(fields)) for fields in job_fields])
+    run("NodeState/construction", lambda: [NodeState(fields) for fields in node_fields])
+
+    parser = IncrementalParser("JobId", JobState, "jobs")
+    parser.parse(job_lines)
+    run("IncrementalParser/unchanged", lambda: parser.parse(job_lines))
+
+    jobs = {fields["JobId"]: JobState(fields) for fields in job_fields}
+    nodes = {fields["NodeName"]: NodeState(fields) for fields in node_fields}
+    for job in jobs.values():
+        touch_job_table_fields(job)
+
+    run("sort", lambda: sorted(jobs.values(), key=make_job_sort_key()))
+
+    snapshot = build_snapshot(0, datetime.datetime.now(), jobs, nodes, ParseDiff(), ParseDiff())
+
+    run("filter/index/build", lambda: JobIndex(snapshot))
+
+    for name, query in filter_queries.items():
+        run(f"filter/index/{name}", lambda: select_jobs(snapshot, query))
+
+    run("filter/columnar/build", lambda: JobColumns.from_snapshot(snapshot))
+
+    for name, query in filter_queries.items():
+        run(f"filter/columnar/{name}", lambda: select_jobs(snapshot, query, columnar=True))
+
+    lookup = TemplateLookup(directories=[str(repository_path / "html")], default_filters=["h"])
+    joblist = lookup.get_template("joblist.html")
+    nodelist = lookup.get_template("nodelist.html")
+
+    full_page = paginate_jobs(snapshot, snapshot.sorted_jobs, {}, default_per_page=None)
+    first_page = paginate_jobs(snapshot, snapshot.sorted_jobs, {}, default_per_page=1000)
+    grouped_page = paginate_jobs(snapshot, snapshot.sorted_jobs, {}, default_per_page=None, group_arrays=True)
+
+    def get_page_kwargs(lean: bool = False) -> Dict[str, Any]:
+        """Arguments of all pages, see get_page_kwargs in swatch.py."""
+        return {
+            "clusters": [], "stale_pollers": [], "request_query": {}, "history_enabled": False, "job_history_enabled": False,
+            "page_tooltips": {}, "lean_rows": LeanJobRows() if lean else None,
+        }
+
+    def run_render(stage: str, render: Callable[[], str]):
+        """Times `render` as `run` does, also recording the size of the page."""
+        run(stage, render, render_repeat)
+        results[stage]["bytes"] = len(render().encode())
+        print(f"  {'':<32} {results[stage]['bytes'] / 1024:10.0f}KiB")
+
+    def render_joblist(page, lean: bool = False) -> str:
+        return joblist.render(page=page, snapshot_version=snapshot.version, partitions=[], **get_page_kwargs(lean))
+
+    run_render("render/joblist", lambda: render_joblist(full_page))
+    run_render("render/joblist/page", lambda: render_joblist(first_page))
+    run_render("render/joblist/arrays", lambda: render_joblist(grouped_page))
+    run_render("render/joblist/lean", lambda: render_joblist(full_page, lean=True))
+
+    for column in ("user", "time"):
+        run(f"sort/column/{column}", lambda: sorted(snapshot.sorted_jobs, key=job_sort_columns[column]))
+
+    run("partitions/summarize", lambda: summarize_partitions(snapshot))
+    partitions = list(summarize_partitions(snapshot).values())
+
+    run("fit/index/build", lambda: FreeResourceIndex(snapshot))
+
+    for name, query in fit_queries.items():
+        request = parse_resource_request(query)
+        run(f"fit/index/{name}", lambda: find_fits(snapshot, request, query))
+
+    # what each query would cost without the index
+    request = parse_resource_request(fit_queries["gpus"])
+    run("fit/scan/gpus", lambda: [node for node in nodes.values() if node.up and get_free_resources(node, 0).count_fits(request) > 0])
+
+    def render_nodelist(lean: bool = False) -> str:
+        job_keys = {job.key for job in jobs.values()}
+        return nodelist.render(
+            partitions=partitions,
+            node_keys=None,
+            group_arrays=True,
+            jobs_by_node=snapshot.jobs_by_node,
+            job_filter=lambda job: job.key in job_keys,
+            snapshot_version=snapshot.version,
+            **get_page_kwargs(lean)
+        )
+
+    run_render("render/nodelist", render_nodelist)
+    run_render("render/nodelist/lean", lambda: render_nodelist(lean=True))
+
+    results.update(benchmark_job_history(job_count, repeat))
+
+    return results
+
+
+def benchmark_job_history(job_count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Times adding `job_count` jobs that ended over the last week to the job
+    history, then listing pages of them as /jobs?history=7d does."""
+    results = {}
+
+    def run(stage: str, function: Callable[[], Any], stage_repeat: int = repeat):
+        results[stage] = measure(function, stage_repeat)
+        print(f"  {stage:<32} {results[stage]['min'] * 1000:10.2f}ms")
+
+    week = 7 * 86400
+    period = week // job_count
+    now = int(time.time())
+    records = [make_job(end, period) for end in range(now - week + period, now + 1, period)]
+    records = [{field: record[field] for field in sacct_fields} for record in records]
+
+    with tempfile.TemporaryDirectory() as directory:
+        def fill():
+            store = JobHistoryStore(str(Path(directory) / f"jobs-{time.perf_counter_ns()}.db"), week)
+            store.open()
+            store.add("", records, now)
+            return store
+
+        run("history/add", fill, 1)
+        store = fill()
+        since = now - week
+
+        for name, query, sort, number in (
+            ("first_page", {}, None, 1),
+            ("last_page", {}, None, job_count // 100),
+            ("user_state", {"user": "user005", "state": "FAILED"}, None, 1),
+            ("sort_cpus", {}, "cpus", 1),
+        ):
+            run(f"history/query/{name}", lambda: store.query(compile_job_query(query), since, sort, False, number, 100))
+
+        store.close()
+
+    return results
+
+
+def compile_templates(module_directory: Optional[str]):
+    html_path = repository_path / "html"
+    lookup = TemplateLookup(directories=[str(html_path)], default_filters=["h"], module_directory=module_directory)
+
+    for path in sorted(html_path.rglob("*.html")):
+        lookup.get_template(path.relative_to(html_path).as_posix())
+
+
+def benchmark_startup(repeat: int) -> Dict[str, Dict[str, float]]:
+    """Times what the server does before listening, apart from querying Slurm:
+    importing its modules and compiling its templates, or loading them from
+    the `--template-cache` of a previous start."""
+    results = {}
+
+    def run(stage: str, function: Callable[[], Any]):
+        results[stage] = measure(function, repeat)
+        print(f"  {stage:<32} {results[stage]['min'] * 1000:10.2f}ms")
+
+    # in a new interpreter each time, as imports are cached
+    imports = "import aiohttp.web, aiohttp_basicauth, mako.lookup, api, backends, filters, history, live, pagination, serverutil, sharedstore"
+    run("imports", lambda: subprocess.run([sys.executable, "-c", imports], cwd=repository_path, check=True))
+
+    run("templates/compile", lambda: compile_templates(None))
+
+    with tempfile.TemporaryDirectory() as module_directory:
+        compile_templates(module_directory)
+        run("templates/cached", lambda: compile_templates(module_directory))
+
+    return results
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repository_path, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(previous: dict, current: dict):
+    print(f"Compared to {previous.get('commit')} ({previous.get('time')}):")
+
+    for size, stages in current["results"].items():
+        previous_stages = previous["results"].get(size, {})
+
+        for stage, timing in stages.items():
+            if stage not in previous_stages:
+                continue
+
+            ratio = timing["min"] / previous_stages[stage]["min"]
+            print(f"  {size:<8} {stage:<32} {ratio:6.2f}x")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated cluster sizes among {', '.join(cluster_sizes)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--render-repeat", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="Save results as JSON to this path")
+    parser.add_argument("--compare", type=Path, help="Compare against results previously saved with --output")
+    args = parser.parse_args()
+
+    results = {}
+
+    print("startup")
+    results["startup"] = benchmark_startup(args.repeat)
+
+    for size in args.sizes.split(","):
+        job_count, node_count = cluster_sizes[size]
+        print(f"{size}: {job_count} jobs, {node_count} nodes")
+        results[size] = benchmark_cluster(job_count, node_count, args.repeat, args.render_repeat)
+
+    output = {
+        "commit": get_commit(),
+        "time": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "cluster_sizes": {size: cluster_sizes[size] for size in results if size in cluster_sizes},
+        "results": results,
+    }
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(output, indent=2))
+
+    if args.compare is not None:
+        print_comparison(json.loads(args.compare.read_text()), output)
+
+
+if __name__ == "__main__":
+    main()
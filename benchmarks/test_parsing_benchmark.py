@@ -0,0 +1,38 @@
+"""pytest-benchmark comparison of `parsing.parse_info_line` with the original
+word-splitting implementation on a large synthetic `scontrol show jobs` dump,
+like `bench_parsing.py`. Skipped without pytest-benchmark.
+
+Run from the repository root: `python -m pytest benchmarks/test_parsing_benchmark.py`"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+benchmarks_path = Path(__file__).absolute().parent
+sys.path.insert(0, str(benchmarks_path.parent))
+sys.path.insert(0, str(benchmarks_path))
+
+from fixtures import make_job_lines
+from bench_parsing import parse_info_line_reference
+from parsing import parse_info_line
+
+job_count = 40000
+
+
+@pytest.fixture(scope="module")
+def lines():
+    return make_job_lines(job_count)
+
+
+@pytest.fixture(scope="module")
+def expected(lines):
+    return [parse_info_line_reference(line) for line in lines]
+
+
+@pytest.mark.parametrize("parse", [parse_info_line_reference, parse_info_line], ids=["reference", "parse_info_line"])
+def test_parse_info_line(benchmark, lines, expected, parse):
+    benchmark.group = f"parse_info_line, {job_count} lines"
+    assert benchmark(lambda: [parse(line) for line in lines]) == expected
@@ -0,0 +1,157 @@
+from array import array
+from itertools import compress
+from typing import Dict, Iterable, List, Sequence
+
+from jobstate import *
+from query import compile_job_query
+
+
+class Categories:
+    """Interning table between the distinct strings of a column and small
+    integer codes."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+
+        return code
+
+    def lookup_table(self, allowed: Iterable[str]) -> bytes:
+        """Returns a table mapping codes to 1 if their value is in `allowed`,
+        0 otherwise."""
+        table = bytearray(max(len(self.values), 256))
+
+        for value in allowed:
+            code = self.codes.get(value)
+            if code is not None:
+                table[code] = 1
+
+        return bytes(table)
+
+
+def encode_column(categories: Categories, values: Iterable[str]) -> Sequence[int]:
+    codes = [categories.encode(value) for value in values]
+
+    # bytes columns can be masked using `bytes.translate`
+    if len(categories.values) <= 256:
+        return bytes(codes)
+
+    return array("I", codes)
+
+
+def mask_codes(codes: Sequence[int], table: bytes) -> bytes:
+    if isinstance(codes, bytes):
+        return codes.translate(table)
+
+    return bytes(map(table.__getitem__, codes))
+
+
+def and_masks(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, "little") & int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+not_table = bytes([1, 0]) + bytes(254)
+
+def not_mask(mask: bytes) -> bytes:
+    return mask.translate(not_table)
+
+
+def get_job_gpus(job: JobState) -> int:
+    return int(job.trackable_resources.get("gres/gpu", 0))
+
+
+def get_job_memory_mbytes(job: JobState) -> float:
+    return parse_size_mbytes(job.trackable_resources.get("mem", "0"))
+
+
+class JobColumns:
+    """Jobs of a snapshot stored as columns, in the snapshot's sorted order.
+
+    Filters are computed as byte masks (one byte per job) using operations
+    that run over whole columns at once rather than per-job Python code.
+    Selecting the jobs of a mask keeps them sorted."""
+
+    def __init__(self, sorted_jobs: List[JobState]):
+        self.jobs = sorted_jobs
+        self.rows_by_job_key = {job.key: row for row, job in enumerate(sorted_jobs)}
+
+        self.job_ids = array("q", (job.job_id for job in sorted_jobs))
+
+        self.clusters = Categories()
+        self.cluster_codes = encode_column(self.clusters, (job.cluster or "" for job in sorted_jobs))
+
+        self.states = Categories()
+        self.state_codes = encode_column(self.states, (job.job_state for job in sorted_jobs))
+
+        self.partitions = Categories()
+        self.partition_codes = encode_column(self.partitions, (job.partition for job in sorted_jobs))
+
+        self.users = Categories()
+        self.user_codes = encode_column(self.users, (job.user_name for job in sorted_jobs))
+
+    @staticmethod
+    def from_snapshot(snapshot) -> "JobColumns":
+        return JobColumns(snapshot.sorted_jobs)
+
+    def all_rows(self) -> bytes:
+        return b"\x01" * len(self.jobs)
+
+    def category_mask(self, codes: Sequence[int], categories: Categories, allowed: Iterable[str]) -> bytes:
+        return mask_codes(codes, categories.lookup_table(allowed))
+
+    def job_key_mask(self, job_keys: Iterable[str]) -> bytes:
+        mask = bytearray(len(self.jobs))
+
+        for job_key in job_keys:
+            row = self.rows_by_job_key.get(job_key)
+            if row is not None:
+                mask[row] = 1
+
+        return bytes(mask)
+
+    def query_mask(self, query, jobs_by_node: Dict[str, List[JobState]]) -> bytes:
+        """Mask of the jobs matching the same `query` parameters as
+        `filters.JobIndex.select`."""
+        mask = self.all_rows()
+
+        category_columns = {
+            "cluster": (self.cluster_codes, self.clusters),
+            "partition": (self.partition_codes, self.partitions),
+            "state": (self.state_codes, self.states),
+            "user": (self.user_codes, self.users),
+        }
+
+        for key, field_filter in compile_job_query(query):
+            if key in category_columns:
+                codes, categories = category_columns[key]
+                # single cluster jobs have no cluster, encoded as ""
+                allowed = [value for value in categories.values if field_filter.matches(value or None)]
+                mask = and_masks(mask, self.category_mask(codes, categories, allowed))
+                continue
+
+            if key == "node":
+                # jobs on any node of the given values
+                def job_keys(values):
+                    return (job.key for node in values.select(jobs_by_node) for job in jobs_by_node[node])
+            else:
+                def job_keys(values):
+                    return (job.key for job in self.jobs if values.contains(job.array_key))
+
+            if field_filter.includes is not None:
+                mask = and_masks(mask, self.job_key_mask(job_keys(field_filter.includes)))
+
+            if field_filter.excludes is not None:
+                mask = and_masks(mask, not_mask(self.job_key_mask(job_keys(field_filter.excludes))))
+
+        return mask
+
+    def select(self, mask: bytes) -> List[JobState]:
+        return list(compress(self.jobs, mask))
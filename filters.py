@@ -0,0 +1,98 @@
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set
+
+from jobstate import *
+from snapshot import Snapshot
+from columnar import JobColumns
+from query import ValueSet, compile_job_query, compile_node_query
+
+def combine_filters(filters):
+    return lambda x: all(fn(x) for fn in filters)
+
+# value of each job matched by the filters of `query.job_filter_keys`, except
+# `node`, which is matched against the nodes allocated to the job
+job_filter_fields: Dict[str, Callable[[JobState], Optional[str]]] = {
+    "cluster": lambda job: job.cluster,
+    "partition": lambda job: job.partition,
+    "state": lambda job: job.job_state,
+    "user": lambda job: job.user_name,
+    "array": lambda job: job.array_key,
+}
+
+
+class JobIndex:
+    """Secondary indexes of the jobs of a snapshot: for each filtered field,
+    the rows (indices in `sorted_jobs`) of the jobs having each value.
+
+    Filtering intersects the rows of the selected values, starting with the
+    smallest set, rather than evaluating every filter on every job. Built once
+    per snapshot with `Snapshot.derive`."""
+
+    def __init__(self, snapshot: Snapshot):
+        self.jobs = snapshot.sorted_jobs
+        self.rows: Dict[str, Dict[str, List[int]]] = {}
+
+        for key, get_value in job_filter_fields.items():
+            rows = defaultdict(list)
+
+            for row, job in enumerate(self.jobs):
+                value = get_value(job)
+                if value is not None:
+                    rows[value].append(row)
+
+            self.rows[key] = dict(rows)
+
+        rows_by_job_key = {job.key: row for row, job in enumerate(self.jobs)}
+        self.rows["node"] = {
+            node: [rows_by_job_key[job.key] for job in jobs]
+            for node, jobs in snapshot.jobs_by_node.items()
+        }
+
+    @staticmethod
+    def from_snapshot(snapshot: Snapshot) -> "JobIndex":
+        return JobIndex(snapshot)
+
+    def get_rows(self, key: str, values: ValueSet) -> Set[int]:
+        index = self.rows[key]
+        rows = set()
+
+        for value in values.select(index):
+            rows.update(index[value])
+
+        return rows
+
+    def select(self, query) -> List[JobState]:
+        """Returns the jobs matching the `query` filters, in sorted order."""
+        filters = compile_job_query(query)
+
+        if len(filters) == 0:
+            return list(self.jobs)
+
+        included = [self.get_rows(key, field_filter.includes) for key, field_filter in filters if field_filter.includes is not None]
+        excluded = [self.get_rows(key, field_filter.excludes) for key, field_filter in filters if field_filter.excludes is not None]
+
+        if len(included) > 0:
+            included.sort(key=len)
+            rows = included[0].intersection(*included[1:])
+        else:
+            rows = set(range(len(self.jobs)))
+
+        rows.difference_update(*excluded)
+
+        return [self.jobs[row] for row in sorted(rows)]
+
+
+def generate_node_filters(query):
+    for key, field_filter in compile_node_query(query):
+        if key == "cluster":
+            yield lambda node, field_filter=field_filter: field_filter.matches(node.cluster)
+        elif key == "partition":
+            yield lambda node, field_filter=field_filter: field_filter.matches_any(node.partitions)
+
+def select_jobs(snapshot: Snapshot, query, columnar: bool=False) -> List[JobState]:
+    """Returns the sorted jobs of `snapshot` matching the `query` filters."""
+    if columnar:
+        columns = snapshot.derive("job_columns", JobColumns.from_snapshot)
+        return columns.select(columns.query_mask(query, snapshot.jobs_by_node))
+
+    return snapshot.derive("job_index", JobIndex.from_snapshot).select(query)
@@ -0,0 +1,291 @@
+import bisect
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from nodestate import *
+from partitions import get_gpu_alloc_by_type, get_gpu_types, get_partition_summaries
+from query import compile_node_query
+from snapshot import Snapshot
+
+# node states in which Slurm does not start new jobs, on top of the ones of
+# `fail_states` (see `NodeState.up`)
+unschedulable_states = ("RESERVED", "MAINT", "REBOOT", "POWERING_DOWN")
+
+
+@dataclass(frozen=True)
+class ResourceRequest:
+    """Resources a job asks for on each of its `nodes` nodes, as with
+    `sbatch --nodes --cpus-per-task --mem --gpus-per-node --constraint`."""
+
+    cpus: int = 1
+    memory_mbytes: float = 0
+    gpus: int = 0
+
+    # `None` for any type
+    gpu_type: Optional[str] = None
+
+    # features that must all be active, each given by its alternatives, e.g.
+    # `avx512&a100|h100` is `({"avx512"}, {"a100", "h100"})`
+    features: Tuple[FrozenSet[str], ...] = ()
+
+    nodes: int = 1
+
+
+def parse_count(query, key: str, default: int, minimum: int=0) -> int:
+    try:
+        value = int(query.get(key) or default)
+    except ValueError:
+        raise ValueError(f"{key} must be an integer")
+
+    if value < minimum:
+        raise ValueError(f"{key} must be at least {minimum}")
+
+    return value
+
+
+def parse_resource_request(query) -> ResourceRequest:
+    """Parses the `cpus`, `memory` (e.g. `64G`), `gpus` (`2`, or `a100:2` like
+    `--gpus`), `gpu_type`, `features` (`--constraint` syntax, `&` or `,`
+    separating required features and `|` alternatives) and `nodes` query
+    parameters. Raises `ValueError` on invalid values."""
+    gpus = query.get("gpus") or "0"
+    gpu_type = query.get("gpu_type") or None
+
+    if ":" in gpus:
+        gpu_type, gpus = gpus.rsplit(":", 1)
+
+    try:
+        memory_mbytes = parse_size_mbytes(query.get("memory") or "0")
+    except ValueError:
+        raise ValueError("memory must be a size, e.g. 4000 (MB) or 64G")
+
+    features = tuple(
+        frozenset(term.split("|"))
+        for term in query.get("features", "").replace(",", "&").split("&")
+        if term != ""
+    )
+
+    return ResourceRequest(
+        cpus=parse_count(query, "cpus", 1, minimum=1),
+        memory_mbytes=max(memory_mbytes, 0),
+        gpus=parse_count({"gpus": gpus}, "gpus", 0),
+        gpu_type=gpu_type,
+        features=features,
+        nodes=parse_count(query, "nodes", 1, minimum=1),
+    )
+
+
+@dataclass
+class FreeResources:
+    """Unallocated resources of a node that can start jobs."""
+
+    node: NodeState
+
+    # position of the node in the snapshot, to list results in that order
+    order: int
+
+    cpus: int
+    memory_mbytes: float
+
+    # by GPU type, `gpu` for GPUs without a type
+    gpus: Dict[str, int]
+    gpu_total: int
+
+    features: FrozenSet[str]
+
+    def get_gpus(self, gpu_type: Optional[str]) -> int:
+        return self.gpu_total if gpu_type is None else self.gpus.get(gpu_type, 0)
+
+    def count_fits(self, request: ResourceRequest) -> int:
+        """How many jobs of `request` could start on the node at once, 0 if
+        none can."""
+        if not all(not alternatives.isdisjoint(self.features) for alternatives in request.features):
+            return 0
+
+        counts = [self.cpus // request.cpus]
+
+        if request.memory_mbytes > 0:
+            counts.append(int(self.memory_mbytes // request.memory_mbytes))
+
+        if request.gpus > 0:
+            counts.append(self.get_gpus(request.gpu_type) // request.gpus)
+
+        return min(counts)
+
+
+def get_free_resources(node: NodeState, order: int) -> FreeResources:
+    gpu_types = get_gpu_types(node)
+
+    if len(gpu_types) == 0 and "gres/gpu" in node.tres_total:
+        # e.g. the rest backend, whose nodes may only report GPUs as TRES
+        gpu_types = {"gpu": int(node.tres_total["gres/gpu"])}
+
+    gpu_alloc = get_gpu_alloc_by_type(node, gpu_types)
+    gpus = {gpu_type: max(count - gpu_alloc[gpu_type], 0) for gpu_type, count in gpu_types.items()}
+
+    memory_total = node.memory_total_mbytes
+    if memory_total is None and "mem" in node.tres_total:
+        memory_total = parse_size_mbytes(node.tres_total["mem"])
+
+    return FreeResources(
+        node=node,
+        order=order,
+        cpus=max(node.cpu_total - node.cpu_alloc, 0),
+        memory_mbytes=max((memory_total or 0) - (node.memory_alloc_mbytes or 0), 0),
+        gpus=gpus,
+        gpu_total=sum(gpus.values()),
+        features=frozenset(node.active_features or []),
+    )
+
+
+class SortedFree:
+    """Free resources sorted by a descending amount, so that the ones with
+    at least some amount are found by bisection."""
+
+    def __init__(self, entries: List[FreeResources], amount):
+        self.entries = sorted(entries, key=lambda entry: -amount(entry))
+        self.keys = [-amount(entry) for entry in self.entries]
+
+    def at_least(self, amount: float) -> List[FreeResources]:
+        return self.entries[:bisect.bisect_right(self.keys, -amount)]
+
+
+class FreeResourceIndex:
+    """Free resources of the nodes of a snapshot, indexed so that a request
+    only checks the nodes that have enough of its scarcest resource rather
+    than all nodes. Nodes that cannot start a job at all (down, drained,
+    reserved... or fully allocated) are left out. Meant to be built once per
+    snapshot, see `get_free_resource_index`."""
+
+    def __init__(self, snapshot: Snapshot):
+        entries = [
+            get_free_resources(node, order)
+            for order, node in enumerate(snapshot.nodes.values())
+            if node.up and not any(state in node.state for state in unschedulable_states)
+        ]
+        entries = [entry for entry in entries if entry.cpus > 0]
+
+        self.by_cpus = SortedFree(entries, lambda entry: entry.cpus)
+        self.by_memory = SortedFree(entries, lambda entry: entry.memory_mbytes)
+
+        # `None` for GPUs of any type
+        gpu_entries: Dict[Optional[str], List[FreeResources]] = {None: []}
+        for entry in entries:
+            if entry.gpu_total > 0:
+                gpu_entries[None].append(entry)
+
+            for gpu_type, count in entry.gpus.items():
+                if count > 0:
+                    gpu_entries.setdefault(gpu_type, []).append(entry)
+
+        self.by_gpus = {
+            gpu_type: SortedFree(gpu_list, lambda entry, gpu_type=gpu_type: entry.get_gpus(gpu_type))
+            for gpu_type, gpu_list in gpu_entries.items()
+        }
+
+        self.by_feature: Dict[str, List[FreeResources]] = {}
+        for entry in entries:
+            for feature in entry.features:
+                self.by_feature.setdefault(feature, []).append(entry)
+
+        # of all nodes, for forms to suggest them
+        self.gpu_types = sorted({gpu_type for summary in get_partition_summaries(snapshot).values() for gpu_type in summary.gpus})
+        self.features = sorted({feature for node in snapshot.nodes.values() for feature in node.active_features or []})
+
+    def get_candidates(self, request: ResourceRequest) -> List[FreeResources]:
+        """Smallest set of nodes known to have enough of one of the requested
+        resources, which the others still have to be checked on."""
+        candidate_lists = [self.by_cpus.at_least(request.cpus)]
+
+        if request.memory_mbytes > 0:
+            candidate_lists.append(self.by_memory.at_least(request.memory_mbytes))
+
+        if request.gpus > 0:
+            by_gpus = self.by_gpus.get(request.gpu_type)
+            candidate_lists.append(by_gpus.at_least(request.gpus) if by_gpus is not None else [])
+
+        for alternatives in request.features:
+            if len(alternatives) == 1:
+                (feature,) = alternatives
+                candidate_lists.append(self.by_feature.get(feature, []))
+
+        return min(candidate_lists, key=len)
+
+    def find(self, request: ResourceRequest) -> List[Tuple[FreeResources, int]]:
+        """Nodes where at least one job of `request` could start now, in the
+        order of the snapshot, with how many could."""
+        fits = []
+
+        for entry in self.get_candidates(request):
+            count = entry.count_fits(request)
+            if count > 0:
+                fits.append((entry, count))
+
+        fits.sort(key=lambda fit: fit[0].order)
+        return fits
+
+
+def get_free_resource_index(snapshot: Snapshot) -> FreeResourceIndex:
+    return snapshot.derive("free_resources", FreeResourceIndex)
+
+
+@dataclass
+class PartitionFit:
+    """Nodes of a partition where a request could start now."""
+
+    cluster: Optional[str]
+    name: str
+
+    # with how many jobs of the request could start on each
+    nodes: List[Tuple[FreeResources, int]] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return qualify(self.cluster, self.name)
+
+    def count_jobs(self, request: ResourceRequest) -> int:
+        """Jobs of `request` that could start at once. Each one needs
+        `request.nodes` distinct nodes, which can also run parts of others."""
+        counts = [count for _, count in self.nodes]
+
+        if request.nodes == 1:
+            return sum(counts)
+
+        # k jobs fit when the nodes can hold k * nodes parts, at most k each
+        low, high = 0, sum(counts) // request.nodes
+        while low < high:
+            middle = (low + high + 1) // 2
+
+            if sum(min(count, middle) for count in counts) >= middle * request.nodes:
+                low = middle
+            else:
+                high = middle - 1
+
+        return low
+
+    def fits(self, request: ResourceRequest) -> bool:
+        return len(self.nodes) >= request.nodes
+
+
+def find_fits(snapshot: Snapshot, request: ResourceRequest, query) -> List[PartitionFit]:
+    """Partitions where some nodes could start `request` now, in the order
+    of the partition summaries, restricted to the ones matching the
+    `cluster` and `partition` filters of `query`."""
+    filters = compile_node_query(query)
+    fits: Dict[str, PartitionFit] = {}
+
+    for entry, count in get_free_resource_index(snapshot).find(request):
+        node = entry.node
+
+        for partition in node.partitions:
+            if not all(field_filter.matches(node.cluster if key == "cluster" else partition) for key, field_filter in filters):
+                continue
+
+            key = qualify(node.cluster, partition)
+            fit = fits.get(key)
+            if fit is None:
+                fit = fits[key] = PartitionFit(node.cluster, partition)
+
+            fit.nodes.append((entry, count))
+
+    return [fits[key] for key in get_partition_summaries(snapshot) if key in fits]
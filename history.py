@@ -0,0 +1,371 @@
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from parsing import qualify
+from snapshot import Snapshot
+
+# resources recorded for each series, as columns of the sample tables
+resource_columns = (
+    "cpu_alloc", "cpu_total",
+    "memory_alloc_mbytes", "memory_total_mbytes",
+    "gpu_alloc", "gpu_total",
+)
+
+series_kinds = ("cluster", "partition", "node")
+
+match_duration = re.compile(r"^(\d+)([smhd])$")
+duration_units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(duration: str) -> int:
+    """Parses durations such as `90s`, `30m`, `24h` or `7d` to seconds."""
+    match = match_duration.match(duration)
+    if match is None:
+        raise ValueError(f"Invalid duration {duration!r}, expected e.g. 30m, 24h or 7d")
+
+    return int(match.group(1)) * duration_units[match.group(2)]
+
+
+@dataclass
+class Resolution:
+    name: str
+
+    # width of the buckets samples are averaged over, 0 for raw samples
+    seconds: int
+
+    # how long samples are kept, in seconds
+    retention: int
+
+    @property
+    def table(self) -> str:
+        return f"samples_{self.name}"
+
+
+def get_gpus(tres: Dict[str, str]) -> int:
+    return int(tres.get("gres/gpu", 0))
+
+def get_node_resources(node) -> Tuple[float, ...]:
+    """Allocated and total resources of `node`, in the order of `resource_columns`."""
+    return (
+        node.cpu_alloc, node.cpu_total,
+        node.memory_alloc_mbytes or 0, node.memory_total_mbytes or 0,
+        get_gpus(node.tres_alloc), get_gpus(node.tres_total),
+    )
+
+def sample_snapshot(snapshot: Snapshot) -> Dict[Tuple[str, str], Tuple[float, ...]]:
+    """Allocated and total resources of each node, partition and cluster, as
+    `(kind, name) -> values` in the order of `resource_columns`. Node and
+    partition names are qualified with their cluster (see `qualify`), and
+    the cluster is named `""` when monitoring a single one."""
+    samples = defaultdict(lambda: [0.0] * len(resource_columns))
+
+    for node in snapshot.nodes.values():
+        values = get_node_resources(node)
+
+        keys = [("cluster", node.cluster or ""), ("node", node.key)]
+        keys.extend(("partition", qualify(node.cluster, partition)) for partition in node.partitions or [])
+
+        for key in keys:
+            totals = samples[key]
+            for i, value in enumerate(values):
+                totals[i] += value
+
+    return {key: tuple(values) for key, values in samples.items()}
+
+
+@dataclass
+class HistorySeries:
+    kind: str
+    name: str
+
+    # bucket start times as epoch seconds
+    times: List[int] = field(default_factory=list)
+
+    # by resource column, averaged over each bucket
+    values: Dict[str, List[float]] = field(default_factory=lambda: {column: [] for column in resource_columns})
+
+
+@dataclass
+class HistoryQuery:
+    kind: str
+
+    # `None` for all the series of `kind`
+    names: Optional[List[str]]
+
+    # epoch seconds
+    start: int
+    end: int
+
+    resolution: Resolution
+
+    # e.g. `24h` when the range ends now
+    range_name: Optional[str]
+
+    def url_query(self, **changes: str) -> str:
+        query = {"kind": self.kind}
+
+        if self.names is not None:
+            query["name"] = ",".join(self.names)
+
+        if self.range_name is not None:
+            query["range"] = self.range_name
+        else:
+            query["start"] = str(self.start)
+            query["end"] = str(self.end)
+
+        if "range" in changes:
+            query.pop("start", None)
+            query.pop("end", None)
+
+        query.update(changes)
+        return urlencode(query, safe=",")
+
+
+class HistoryStore:
+    """On-disk time series of the resources allocated on each node, partition
+    and on the whole cluster, stored in SQLite.
+
+    Samples are first stored as is, then averaged into coarser `resolutions`
+    as their buckets complete, each resolution having its own retention.
+    Queries read from the coarsest resolution that still has enough points,
+    using the `(series, time)` primary key so that they never scan other
+    series or time ranges.
+
+    SQLite calls are blocking: the `*_async` methods run them on a dedicated
+    thread, which is also the only one to use the connection."""
+
+    def __init__(self, path: str, resolutions: Sequence[Resolution]):
+        self.path = path
+        self.resolutions = list(resolutions)
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+        self.connection: Optional["sqlite3.Connection"] = None
+        self.series_ids: Dict[Tuple[str, str], int] = {}
+
+        # by resolution name, end of the last bucket that was downsampled
+        self.downsampled_until: Dict[str, int] = {}
+
+    def open(self):
+        # only imported when the history is enabled, to start faster otherwise
+        import sqlite3
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS series ("
+                "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, name TEXT NOT NULL, UNIQUE (kind, name))"
+            )
+
+            for resolution in self.resolutions:
+                columns = ", ".join(f"{column} REAL NOT NULL" for column in resource_columns)
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {resolution.table} ("
+                    f"series INTEGER NOT NULL, time INTEGER NOT NULL, samples INTEGER NOT NULL, {columns}, "
+                    "PRIMARY KEY (series, time)) WITHOUT ROWID"
+                )
+
+        for series_id, kind, name in self.connection.execute("SELECT id, kind, name FROM series"):
+            self.series_ids[(kind, name)] = series_id
+
+        for resolution in self.resolutions[1:]:
+            (last_bucket,) = self.connection.execute(f"SELECT max(time) FROM {resolution.table}").fetchone()
+            self.downsampled_until[resolution.name] = last_bucket + resolution.seconds if last_bucket is not None else 0
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get_series_id(self, kind: str, name: str) -> int:
+        series_id = self.series_ids.get((kind, name))
+
+        if series_id is None:
+            series_id = self.connection.execute(
+                "INSERT INTO series (kind, name) VALUES (?, ?)", (kind, name)
+            ).lastrowid
+            self.series_ids[(kind, name)] = series_id
+
+        return series_id
+
+    def record(self, sample_time: int, samples: Dict[Tuple[str, str], Tuple[float, ...]]):
+        raw = self.resolutions[0]
+        placeholders = ", ".join("?" * (len(resource_columns) + 3))
+
+        with self.connection:
+            rows = [
+                (self.get_series_id(kind, name), sample_time, 1, *values)
+                for (kind, name), values in samples.items()
+            ]
+            self.connection.executemany(f"INSERT OR REPLACE INTO {raw.table} VALUES ({placeholders})", rows)
+
+            self.downsample(sample_time)
+
+    def downsample(self, now: int):
+        averages = ", ".join(f"sum({column} * samples) / sum(samples)" for column in resource_columns)
+
+        for source, target in zip(self.resolutions, self.resolutions[1:]):
+            start = self.downsampled_until[target.name]
+            end = now // target.seconds * target.seconds
+
+            if end <= start:
+                continue
+
+            # joined with series so that each series is read through the
+            # primary key rather than by scanning the whole table
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {target.table} "
+                f"SELECT s.id, t.time / {target.seconds} * {target.seconds}, sum(t.samples), {averages} "
+                f"FROM series s JOIN {source.table} t ON t.series = s.id AND t.time >= ? AND t.time < ? "
+                f"GROUP BY s.id, t.time / {target.seconds}",
+                (start, end)
+            )
+
+            self.downsampled_until[target.name] = end
+
+            if target is self.resolutions[-1]:
+                # once per coarsest bucket is often enough
+                self.enforce_retention(now)
+
+    def enforce_retention(self, now: int):
+        series_ids = [(series_id,) for series_id in self.series_ids.values()]
+
+        for resolution in self.resolutions:
+            self.connection.executemany(
+                f"DELETE FROM {resolution.table} WHERE series = ? AND time < {now - resolution.retention}",
+                series_ids
+            )
+
+    def pick_resolution(self, start: int, end: int, max_points: int, sample_interval: float) -> Resolution:
+        """Finest resolution that still covers `start` and returns at most
+        about `max_points` points per series."""
+        now = time.time()
+
+        for resolution in self.resolutions:
+            width = max(resolution.seconds, sample_interval)
+
+            if start >= now - resolution.retention and (end - start) / width <= max_points:
+                return resolution
+
+        return self.resolutions[-1]
+
+    def query(self, kind: str, names: Optional[List[str]], start: int, end: int, resolution: Resolution) -> List[HistorySeries]:
+        conditions = "s.kind = ?"
+        parameters = [kind]
+
+        if names is not None:
+            conditions += f" AND s.name IN ({', '.join('?' * len(names))})"
+            parameters.extend(names)
+
+        rows = self.connection.execute(
+            f"SELECT s.name, t.time, {', '.join(f't.{column}' for column in resource_columns)} "
+            f"FROM series s JOIN {resolution.table} t ON t.series = s.id AND t.time >= ? AND t.time < ? "
+            f"WHERE {conditions} ORDER BY s.name, t.time",
+            [start, end] + parameters
+        )
+
+        series = {}
+
+        for name, sample_time, *values in rows:
+            entry = series.get(name)
+            if entry is None:
+                entry = series[name] = HistorySeries(kind, name)
+
+            entry.times.append(sample_time)
+            for column, value in zip(resource_columns, values):
+                entry.values[column].append(value)
+
+        return list(series.values())
+
+    async def run_in_thread(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def query_async(self, kind: str, names: Optional[List[str]], start: int, end: int, resolution: Resolution) -> List[HistorySeries]:
+        return await self.run_in_thread(self.query, kind, names, start, end, resolution)
+
+
+class HistoryRecorder:
+    """Samples the latest snapshot of `poller` into `store` every
+    `interval` seconds. Reads `poller.snapshot` directly, so that recording
+    does not keep the poller from backing off when the server is idle."""
+
+    def __init__(self, store: HistoryStore, poller, interval: float=30):
+        self.store = store
+        self.poller = poller
+        self.interval = interval
+
+        self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            snapshot = self.poller.snapshot
+            if snapshot is None:
+                continue
+
+            try:
+                await self.store.run_in_thread(self.store.record, int(time.time()), sample_snapshot(snapshot))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Failed to record the utilization history")
+
+    async def cleanup_ctx(self, app):
+        await self.store.run_in_thread(self.store.open)
+        self.task = asyncio.create_task(self.run())
+
+        yield
+
+        self.task.cancel()
+
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        await self.store.run_in_thread(self.store.close)
+        self.store.executor.shutdown()
+
+
+def parse_history_query(query, store: HistoryStore, sample_interval: float, max_points: int=1500) -> HistoryQuery:
+    """Parses the `kind`, `name`, `range` (e.g. `24h`, up to now) or `start`
+    and `end` (epoch seconds), and `points` (maximum points per series)
+    query parameters. Raises `ValueError` on invalid parameters."""
+    kind = query.get("kind", "partition")
+    if kind not in series_kinds:
+        raise ValueError(f"kind must be one of {', '.join(series_kinds)}")
+
+    names = query["name"].split(",") if "name" in query else None
+
+    if "start" in query:
+        if not query["start"].isdigit() or not query.get("end", "0").isdigit():
+            raise ValueError("start and end must be epoch timestamps in seconds")
+
+        range_name = None
+        start = int(query["start"])
+        end = int(query["end"]) if "end" in query else int(time.time())
+    else:
+        range_name = query.get("range", "24h")
+        end = int(time.time())
+        start = end - parse_duration(range_name)
+
+    if end <= start:
+        raise ValueError("end must be after start")
+
+    if "points" in query:
+        if not query["points"].isdigit() or int(query["points"]) == 0:
+            raise ValueError("points must be a positive integer")
+
+        max_points = int(query["points"])
+
+    resolution = store.pick_resolution(start, end, max_points, sample_interval)
+    return HistoryQuery(kind, names, start, end, resolution, range_name)
@@ -0,0 +1,443 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from jobstate import *
+from columnar import get_job_gpus, get_job_memory_mbytes
+from query import FieldFilter, ValueSet, compile_job_query, get_all_values
+from pagination import JobPage, parse_page_query
+from history import parse_duration
+from scontrol import ScontrolRunner
+from metrics import job_history_records, slurm_query_seconds
+
+# requested from sacct, in the order of its output. JobName is last as it is
+# the only field that may contain the `|` delimiter.
+sacct_fields = (
+    "JobIDRaw", "JobID", "User", "UID", "Group", "GID", "Account", "QOS",
+    "Partition", "State", "Reason", "ExitCode",
+    "Submit", "Eligible", "Start", "End", "ElapsedRaw", "Timelimit",
+    "NNodes", "AllocCPUS", "ReqMem", "AllocTRES", "ReqTRES", "NodeList", "WorkDir",
+    "JobName",
+)
+
+# states of the jobs that ended, for `sacct --state`
+finished_states = "BF,CA,CD,DL,F,NF,OOM,PR,TO"
+
+# SQL expressions of the job filters of `query.job_filter_keys`, except `node`
+history_filter_columns = {
+    "cluster": "cluster",
+    "partition": "partition",
+    "state": "state",
+    "user": "user",
+    "array": "coalesce(array_key, '')",
+}
+
+# SQL expressions of the sortable columns of `pagination.job_sort_columns`
+history_sort_columns = {
+    "state": "state",
+    "id": "job_id",
+    "user": "user",
+    "name": "name",
+    "nodes": "node_count",
+    "cpus": "cpus",
+    "memory": "memory_mbytes",
+    "gpus": "gpus",
+    "time": "elapsed",
+}
+
+def format_sacct_time(t: float) -> str:
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%dT%H:%M:%S")
+
+def parse_sacct_output(stdout: bytes) -> List[Dict[str, str]]:
+    """Parses `sacct --parsable2 --noheader` output of `sacct_fields`."""
+    records = []
+
+    for line in stdout.decode("utf-8", errors="replace").splitlines():
+        values = line.split("|", len(sacct_fields) - 1)
+
+        if len(values) == len(sacct_fields):
+            records.append(dict(zip(sacct_fields, values)))
+
+    return records
+
+def sacct_job_fields(record: Dict[str, str]) -> Dict[str, str]:
+    """Fields of a job as `scontrol show jobs --oneliner` would report them,
+    from a `sacct` record, so that ended jobs are shown like the others.
+    What sacct does not know is reported as unset."""
+    tres = parse_trackable_resources(record["AllocTRES"] or record["ReqTRES"])
+    tres.setdefault("cpu", record["AllocCPUS"] or "0")
+    tres.setdefault("node", record["NNodes"] or "1")
+
+    fields = {
+        "JobId": record["JobIDRaw"],
+        "JobName": record["JobName"],
+        "UserId": f"{record['User']}({record['UID'] or 0})",
+        "GroupId": f"{record['Group']}({record['GID'] or 0})",
+        "Account": record["Account"] or "(null)",
+        "QOS": record["QOS"] or "(null)",
+        "Priority": "0",
+        "Nice": "0",
+        # e.g. `CANCELLED by 1234`
+        "JobState": record["State"].split(" ")[0],
+        "Reason": record["Reason"] or "None",
+        "Dependency": "(null)",
+        "Requeue": "0",
+        "Restarts": "0",
+        "BatchFlag": "1",
+        "Reboot": "0",
+        "ExitCode": record["ExitCode"] or "0:0",
+        "RunTime": as_slurm_timedelta(datetime.timedelta(seconds=int(record["ElapsedRaw"] or 0))),
+        "TimeLimit": record["Timelimit"] or "UNLIMITED",
+        "TimeMin": "N/A",
+        "SubmitTime": record["Submit"],
+        "EligibleTime": record["Eligible"],
+        "AccrueTime": "Unknown",
+        "StartTime": record["Start"],
+        "EndTime": record["End"],
+        "Deadline": "N/A",
+        "SuspendTime": "None",
+        "SecsPreSuspend": "0",
+        "LastSchedEval": "Unknown",
+        "Partition": record["Partition"],
+        "ReqNodeList": "(null)",
+        "ExcNodeList": "(null)",
+        "NodeList": record["NodeList"] if record["NodeList"] not in ("", "None assigned") else "(null)",
+        "NumNodes": tres["node"],
+        "NumCPUs": tres["cpu"],
+        "NumTasks": "1",
+        "CPUs/Task": "1",
+        "ReqB:S:C:T": "0:0:*:*",
+        "TRES": ",".join(f"{key}={value}" for key, value in tres.items()),
+        "Socks/Node": "*",
+        "NtasksPerN:B:S:C": "0:0:*:*",
+        "CoreSpec": "*",
+        "MinCPUsNode": "1",
+        "MinMemoryNode": record["ReqMem"],
+        "MinTmpDiskNode": "0",
+        "Features": "(null)",
+        "DelayBoot": "00:00:00",
+        "OverSubscribe": "OK",
+        "Contiguous": "0",
+        "Command": "(null)",
+        "WorkDir": record["WorkDir"],
+        "Power": "",
+        "MailUser": "(null)",
+        "MailType": "NONE",
+        "MCS_label": "N/A",
+    }
+
+    # `1234_5` for array tasks
+    array_job_id, _, array_task_id = record["JobID"].partition("_")
+    if array_task_id != "":
+        fields["ArrayJobId"] = array_job_id
+        fields["ArrayTaskId"] = array_task_id
+
+    return fields
+
+def get_sacct_time(value: str) -> Optional[int]:
+    t = parse_slurm_date(value)
+    return int(t.timestamp()) if t is not None else None
+
+def value_set_sql(expression: str, values: ValueSet) -> Tuple[str, List[str]]:
+    """SQL condition that `expression` is in `values`, and its parameters."""
+    terms = []
+    parameters = []
+
+    if len(values.exact) > 0:
+        terms.append(f"{expression} IN ({', '.join('?' * len(values.exact))})")
+        parameters.extend(sorted(values.exact))
+
+    # rather than LIKE, which ignores case unlike str.startswith
+    for prefix in values.prefixes:
+        terms.append(f"substr({expression}, 1, {len(prefix)}) = ?")
+        parameters.append(prefix)
+
+    return f"({' OR '.join(terms)})", parameters
+
+def filter_sql(key: str, field_filter: FieldFilter) -> Tuple[str, List[str]]:
+    """SQL condition of `field_filter` on the jobs table, and its parameters."""
+    conditions = []
+    parameters = []
+
+    for values, negate in ((field_filter.includes, False), (field_filter.excludes, True)):
+        if values is None:
+            continue
+
+        if key == "node":
+            condition, value_parameters = value_set_sql("n.node", values)
+            condition = f"EXISTS (SELECT 1 FROM job_nodes n WHERE n.cluster = jobs.cluster AND n.job_id = jobs.job_id AND {condition})"
+        else:
+            condition, value_parameters = value_set_sql(history_filter_columns[key], values)
+
+        conditions.append(f"NOT {condition}" if negate else condition)
+        parameters.extend(value_parameters)
+
+    return " AND ".join(conditions), parameters
+
+
+class JobHistoryStore:
+    """Jobs that ended, as reported by `sacct`, kept in SQLite for `retention`
+    seconds after they ended, so that /jobs can still list them once
+    slurmctld forgot them.
+
+    The columns that jobs are filtered and sorted by are indexed along with
+    the end time, and `record` keeps the sacct output to show the jobs.
+
+    SQLite calls are blocking: like `HistoryStore`, the store is only used from
+    its own thread, see `run_in_thread`."""
+
+    def __init__(self, path: str, retention: int):
+        self.path = path
+        self.retention = retention
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-history")
+        self.connection: Optional["sqlite3.Connection"] = None
+
+        # changes whenever jobs are added, for pages to be cached until then
+        self.version = 0
+
+    def open(self):
+        import sqlite3
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "cluster TEXT NOT NULL, job_id INTEGER NOT NULL, end_time INTEGER NOT NULL, "
+                "user TEXT NOT NULL, partition TEXT NOT NULL, state TEXT NOT NULL, array_key TEXT, name TEXT NOT NULL, "
+                "node_count INTEGER NOT NULL, cpus INTEGER NOT NULL, memory_mbytes REAL NOT NULL, gpus INTEGER NOT NULL, "
+                "elapsed INTEGER NOT NULL, record TEXT NOT NULL, "
+                "PRIMARY KEY (cluster, job_id))"
+            )
+
+            for columns in (("end_time",), ("user", "end_time"), ("partition", "end_time"), ("state", "end_time")):
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS jobs_{'_'.join(columns)} ON jobs ({', '.join(columns)})")
+
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_nodes ("
+                "node TEXT NOT NULL, cluster TEXT NOT NULL, job_id INTEGER NOT NULL, "
+                "PRIMARY KEY (node, cluster, job_id)) WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS job_nodes_job ON job_nodes (cluster, job_id)")
+
+            # high-water mark of the sacct queries of each cluster
+            self.connection.execute("CREATE TABLE IF NOT EXISTS polls (cluster TEXT PRIMARY KEY, polled_until INTEGER NOT NULL)")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get_polled_until(self, cluster: str) -> Optional[int]:
+        row = self.connection.execute("SELECT polled_until FROM polls WHERE cluster = ?", (cluster,)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, cluster: str, records: List[Dict[str, str]], polled_until: int):
+        """Adds or updates the jobs of `cluster` from their sacct `records`,
+        and records that its jobs ended until `polled_until` were added.
+        `cluster` is `""` when monitoring a single cluster."""
+        job_cluster = cluster or None
+
+        with self.connection:
+            for record in records:
+                end_time = get_sacct_time(record["End"])
+                if end_time is None or not record["JobIDRaw"].isdigit():
+                    continue
+
+                job = JobState(sacct_job_fields(record), job_cluster)
+
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        cluster, job.job_id, end_time,
+                        job.user_name, job.partition, job.job_state, job.array_key, job.job_name,
+                        job.get_node_count(), job.get_cpus(), get_job_memory_mbytes(job), get_job_gpus(job),
+                        int(record["ElapsedRaw"] or 0), json.dumps([record[field] for field in sacct_fields]),
+                    )
+                )
+
+                self.connection.execute("DELETE FROM job_nodes WHERE cluster = ? AND job_id = ?", (cluster, job.job_id))
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO job_nodes VALUES (?, ?, ?)",
+                    [(node, cluster, job.job_id) for node in job.node_keys or []]
+                )
+
+            self.connection.execute("INSERT OR REPLACE INTO polls VALUES (?, ?)", (cluster, polled_until))
+
+        if len(records) > 0:
+            self.version += 1
+
+    def enforce_retention(self, now: int):
+        oldest = now - self.retention
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM job_nodes WHERE (cluster, job_id) IN (SELECT cluster, job_id FROM jobs WHERE end_time < ?)",
+                (oldest,)
+            )
+            self.connection.execute("DELETE FROM jobs WHERE end_time < ?", (oldest,))
+
+    def query(self, filters: List[Tuple[str, FieldFilter]], since: int, sort: Optional[str], descending: bool, number: int, per_page: Optional[int]) -> Tuple[List[JobState], int, int]:
+        """Jobs that ended after `since` and match `filters`, most recent
+        first or sorted by a column of `history_sort_columns`. Returns the
+        jobs of page `number` (clamped to the last page), the number of
+        matching jobs and the page number."""
+        conditions = ["end_time >= ?"]
+        parameters = [since]
+
+        for key, field_filter in filters:
+            condition, filter_parameters = filter_sql(key, field_filter)
+            conditions.append(condition)
+            parameters.extend(filter_parameters)
+
+        where = " AND ".join(conditions)
+        (total,) = self.connection.execute(f"SELECT count(*) FROM jobs WHERE {where}", parameters).fetchone()
+
+        if sort is None:
+            order = "end_time DESC, job_id DESC" if not descending else "end_time, job_id"
+        else:
+            order = f"{history_sort_columns[sort]} {'DESC' if descending else 'ASC'}, end_time DESC, job_id DESC"
+
+        limit = ""
+        if per_page is not None:
+            number = min(number, max((total + per_page - 1) // per_page, 1))
+            limit = f" LIMIT {per_page} OFFSET {(number - 1) * per_page}"
+
+        rows = self.connection.execute(f"SELECT cluster, record FROM jobs WHERE {where} ORDER BY {order}{limit}", parameters)
+
+        jobs = [
+            JobState(sacct_job_fields(dict(zip(sacct_fields, json.loads(record)))), cluster or None)
+            for cluster, record in rows
+        ]
+
+        return jobs, total, number
+
+    def get(self, cluster: str, job_id: str) -> Optional[JobState]:
+        """Job `job_id` of `cluster` if it is in the store, `None` otherwise."""
+        if not job_id.isdigit():
+            return None
+
+        row = self.connection.execute("SELECT record FROM jobs WHERE cluster = ? AND job_id = ?", (cluster, int(job_id))).fetchone()
+        if row is None:
+            return None
+
+        return JobState(sacct_job_fields(dict(zip(sacct_fields, json.loads(row[0])))), cluster or None)
+
+    async def run_in_thread(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def query_async(self, query, since: int, sort: Optional[str], descending: bool, number: int, per_page: Optional[int]) -> Tuple[List[JobState], int, int]:
+        return await self.run_in_thread(self.query, compile_job_query(query), since, sort, descending, number, per_page)
+
+
+class JobHistoryPoller:
+    """Adds the jobs that ended on each cluster to `store`, querying `sacct`
+    through `runners` (by cluster, `""` for a single one) every `interval`
+    seconds.
+
+    Each query only asks for the jobs that ended since the end of the
+    previous one, its high-water mark kept in the store across restarts,
+    minus `overlap` seconds for the jobs that slurmdbd learns about late.
+    A query covers at most `max_window` seconds, so that filling the store
+    for the first time or after a long stop is done by several bounded
+    queries rather than one huge one."""
+
+    def __init__(self, store: JobHistoryStore, runners: Dict[str, ScontrolRunner], interval: float=60, overlap: int=300, max_window: int=86400):
+        self.store = store
+        self.runners = runners
+        self.interval = interval
+        self.overlap = overlap
+        self.max_window = max_window
+
+        self.task = None
+
+    async def poll(self, cluster: str, runner: ScontrolRunner) -> bool:
+        """Adds the jobs of the next window, returning whether it reached
+        the present."""
+        now = int(time.time())
+        polled_until = await self.store.run_in_thread(self.store.get_polled_until, cluster)
+
+        start = max((polled_until or 0) - self.overlap, now - self.store.retention)
+        end = min(start + self.max_window, now)
+
+        with slurm_query_seconds.labels("sacct", cluster, "history").time():
+            stdout = await runner.run(
+                "--allusers", "--allocations", "--parsable2", "--noheader",
+                f"--format={','.join(sacct_fields)}",
+                f"--state={finished_states}",
+                f"--starttime={format_sacct_time(start)}",
+                f"--endtime={format_sacct_time(end)}",
+            )
+
+        records = parse_sacct_output(stdout)
+        job_history_records.labels(cluster).inc(len(records))
+
+        await self.store.run_in_thread(self.store.add, cluster, records, end)
+        return end >= now
+
+    async def run(self):
+        while True:
+            caught_up = True
+
+            for cluster, runner in self.runners.items():
+                try:
+                    caught_up = await self.poll(cluster, runner) and caught_up
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logging.exception(f"Failed to query the job history{' of ' + cluster if cluster else ''}")
+
+            try:
+                await self.store.run_in_thread(self.store.enforce_retention, int(time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Failed to enforce the job history retention")
+
+            if caught_up:
+                await asyncio.sleep(self.interval)
+
+    async def cleanup_ctx(self, app):
+        await self.store.run_in_thread(self.store.open)
+        self.task = asyncio.create_task(self.run())
+
+        yield
+
+        self.task.cancel()
+
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        await self.store.run_in_thread(self.store.close)
+        self.store.executor.shutdown()
+
+
+async def paginate_job_history(store: JobHistoryStore, query, default_per_page: Optional[int]) -> JobPage:
+    """Page of the jobs that ended within the range of the `history` query
+    parameter (e.g. `24h`), filtered, sorted and paginated like
+    `paginate_jobs` would. Raises `ValueError` on invalid parameters."""
+    history = query["history"]
+    since = int(time.time()) - parse_duration(history)
+
+    sort, descending, per_page, number = parse_page_query(query, default_per_page)
+    jobs, total, number = await store.query_async(query, since, sort, descending, number, per_page)
+
+    return JobPage(
+        jobs=jobs,
+        number=number,
+        per_page=per_page,
+        total=total,
+        sort=sort,
+        descending=descending,
+        query=get_all_values(query),
+        history=history
+    )
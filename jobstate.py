@@ -1,243 +1,209 @@
 import asyncio
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from collections import defaultdict
+import functools
+import getpass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import datetime
 import pathlib
 import os
 
 from parsing import *
+from metrics import slurm_query_seconds
+from scontrol import ScontrolRunner
 
 
-@dataclass
-class JobState:
-    job_id: int
-
-    array_job_id: Optional[int]
-    array_task_id: Optional[str]
-    array_task_throttle: Optional[int]
-
-    job_name: str
-
-    user_name: str
-    user_id: int
-
-    group_name: str
-    group_id: int
-
-    mcs_label: str
-
-    priority: int
-
-    nice: int
-
-    account: str
-
-    qos: str # TODO: enum
-
-    job_state: str # TODO: enum
-    job_state_reasons: List[str] # TODO: enum?
-
-    dependency: str # TODO: ?
-
-    requeue: bool
-    restart_count: int
+@functools.lru_cache(maxsize=None)
+def get_login() -> str:
+    try:
+        return os.getlogin()
+    except OSError:
+        # no controlling terminal, e.g. when started from a service
+        return getpass.getuser()
 
-    was_run_using_sbatch: bool
+def parse_name_with_id(field: str) -> Tuple[str, int]:
+    """Parses `name(id)` fields such as `UserId` and `GroupId`."""
+    return (field[:field.index("(")], int(field[field.index("(")+1:field.index(")")]))
 
-    requested_node_reboot: bool
+def parse_exit_code(field: str) -> Tuple[int, int]:
+    code_str, signal_str = field.split(":")
+    return (int(code_str), int(signal_str))
 
-    exit_code: int
-    exit_signal: int
+def parse_count_fields(field: str) -> List[Optional[int]]:
+    """Parses colon-separated count fields such as `ReqB:S:C:T`."""
+    return [parse_count_field(count) for count in field.split(":")]
 
-    run_time: datetime.timedelta
-    min_time_limit: datetime.timedelta
-    max_time_limit: datetime.timedelta
 
-    submit_time: datetime.datetime
-    eligible_time: datetime.datetime
-    accrue_time: datetime.datetime
-    start_time: datetime.datetime
-    end_time: datetime.datetime
-    deadline: Optional[datetime.datetime]
-    suspend_time: Optional[datetime.datetime]
-
-    secs_pre_suspend: Optional[int]
-
-    last_sched_eval: datetime.datetime
-
-    partition: str
-
-    requested_nodes: List[str]
-    excluded_nodes: List[str]
-    nodes: List[str]
-
-    num_nodes: int
-    num_tasks: int
-
-    num_cpus: int
-    cpus_per_task: int
-
-    requested_baseboards: Optional[int]
-    requested_sockets_pre_baseboard: Optional[int]
-    requested_cores_per_socket: Optional[int]
-    requested_threads_per_core: Optional[int]
+class JobState:
+    """State of a job as reported by `scontrol show jobs`.
 
-    trackable_resources: List[Tuple[str, str]]
-    trackable_resources_per_node: List[Tuple[str, str]]
+    Only the raw fields are kept when constructed: each attribute is converted
+    on first access and memoized, so that the parsing cost and memory usage
+    scale with what is actually used by views."""
 
-    sockets_per_node: Optional[int]
+    __slots__ = ("fields", "values", "cluster")
 
-    tasks_per_node: Optional[int]
-    tasks_per_baseboard: Optional[int]
-    tasks_per_socket: Optional[int]
-    tasks_per_core: Optional[int]
+    job_id: int = lazy_field(lambda j: int(j["JobId"]))
 
-    system_reserved_cores: Optional[int]
+    # only set for the tasks of job arrays; `array_task_id` may stand for
+    # several pending tasks, e.g. `5-5000`
+    array_job_id: Optional[int] = lazy_field(lambda j: int(j["ArrayJobId"]) if "ArrayJobId" in j else None)
+    array_task_id: Optional[str] = lazy_field(lambda j: j.get("ArrayTaskId"))
+    array_task_throttle: Optional[int] = lazy_field(lambda j: int(j["ArrayTaskThrottle"]) if "ArrayTaskThrottle" in j else None)
 
-    min_cpus_per_node: Optional[int]
-    min_ram_per_node: Optional[str] # TODO: as bytes
-    min_tmp_disk_per_node: str
+    job_name: str = lazy_field(lambda j: j["JobName"])
 
-    stdout_path: Optional[pathlib.Path]
-    stderr_path: Optional[pathlib.Path]
+    user_name: str = lazy_field(lambda j: parse_name_with_id(j["UserId"])[0])
+    user_id: int = lazy_field(lambda j: parse_name_with_id(j["UserId"])[1])
 
-    features: Optional[str]
-    delay_boot: datetime.timedelta
+    group_name: str = lazy_field(lambda j: parse_name_with_id(j["GroupId"])[0])
+    group_id: int = lazy_field(lambda j: parse_name_with_id(j["GroupId"])[1])
 
-    over_subscribe: bool
+    mcs_label: str = lazy_field(lambda j: j["MCS_label"])
 
-    require_contiguous_nodes: bool
+    priority: int = lazy_field(lambda j: int(j["Priority"]))
 
-    command: str
+    nice: int = lazy_field(lambda j: int(j["Nice"]))
 
-    workdir: pathlib.Path
+    account: str = lazy_field(lambda j: j["Account"])
 
-    power: str
+    qos: str = lazy_field(lambda j: j["QOS"]) # TODO: enum
 
-    mail_user: str
-    mail_type: str # TODO: enum (list of enum?)?
+    job_state: str = lazy_field(lambda j: j["JobState"]) # TODO: enum
+    job_state_reasons: List[str] = lazy_field(lambda j: j["Reason"].split(",")) # TODO: enum?
 
-    def __init__(self, job_state_dict: Dict[str, str]):
-        j = job_state_dict
+    dependency: str = lazy_field(lambda j: j["Dependency"]) # TODO: ?
 
-        self.job_id = int(j["JobId"])
+    requeue: bool = lazy_field(lambda j: int(j["Requeue"]) != 0)
+    restart_count: int = lazy_field(lambda j: int(j["Restarts"]))
 
-        self.array_job_id = None
-        self.array_task_id = None
-        self.array_task_throttle = None
+    was_run_using_sbatch: bool = lazy_field(lambda j: int(j["BatchFlag"]) != 0)
 
-        self.job_name = j["JobName"]
+    requested_node_reboot: bool = lazy_field(lambda j: int(j["Reboot"]) != 0)
 
-        user_field = j["UserId"]
-        self.user_name = user_field[:user_field.index("(")]
-        self.user_id = int(user_field[user_field.index("(")+1:user_field.index(")")])
+    exit_code: int = lazy_field(lambda j: parse_exit_code(j["ExitCode"])[0])
+    exit_signal: int = lazy_field(lambda j: parse_exit_code(j["ExitCode"])[1])
 
-        group_field = j["GroupId"]
-        self.group_name = group_field[:group_field.index("(")]
-        self.group_id = int(group_field[group_field.index("(")+1:group_field.index(")")])
+    run_time: datetime.timedelta = lazy_field(lambda j: parse_slurm_timedelta(j["RunTime"]))
+    min_time_limit: datetime.timedelta = lazy_field(lambda j: parse_slurm_timedelta(j["TimeMin"]))
+    max_time_limit: datetime.timedelta = lazy_field(lambda j: parse_slurm_timedelta(j["TimeLimit"]))
 
-        self.mcs_label = j["MCS_label"]
+    submit_time: datetime.datetime = lazy_field(lambda j: parse_slurm_date(j["SubmitTime"]))
+    eligible_time: datetime.datetime = lazy_field(lambda j: parse_slurm_date(j["EligibleTime"]))
+    accrue_time: datetime.datetime = lazy_field(lambda j: parse_slurm_date(j["AccrueTime"]))
+    start_time: datetime.datetime = lazy_field(lambda j: parse_slurm_date(j["StartTime"]))
+    end_time: datetime.datetime = lazy_field(lambda j: parse_slurm_date(j["EndTime"]))
+    deadline: Optional[datetime.datetime] = lazy_field(lambda j: parse_slurm_date(j["Deadline"]))
+    suspend_time: Optional[datetime.datetime] = lazy_field(lambda j: parse_slurm_date(j["SuspendTime"]))
 
-        self.priority = int(j["Priority"])
+    secs_pre_suspend: Optional[int] = lazy_field(lambda j: int(j["SecsPreSuspend"]))
 
-        self.nice = int(j["Nice"])
+    last_sched_eval: datetime.datetime = lazy_field(lambda j: parse_slurm_date(j["LastSchedEval"]))
 
-        self.account = j["Account"]
+    partition: str = lazy_field(lambda j: j["Partition"])
 
-        self.qos = j["QOS"]
+    requested_nodes: List[str] = lazy_field(lambda j: parse_nullable_hostlist(j["ReqNodeList"]))
+    excluded_nodes: List[str] = lazy_field(lambda j: parse_nullable_hostlist(j["ExcNodeList"]))
+    nodes: List[str] = lazy_field(lambda j: parse_nullable_hostlist(j["NodeList"]))
+    nodes_compact: Optional[str] = lazy_field(lambda j: j["NodeList"] if j["NodeList"] not in ("(null)", "") else None)
 
-        self.job_state = j["JobState"]
-        self.job_state_reasons = j["Reason"].split(",")
+    # TODO: BatchHost
 
-        self.dependency = j["Dependency"]
+    num_nodes: int = lazy_field(lambda j: 0) # int(j["NumNodes"]) # TODO: can be 1-1 etc
+    num_tasks: int = lazy_field(lambda j: int(j["NumTasks"]))
 
-        self.requeue = int(j["Requeue"]) != 0
-        self.restart_count = int(j["Restarts"])
+    num_cpus: int = lazy_field(lambda j: int(j["NumCPUs"]))
+    cpus_per_task: int = lazy_field(lambda j: int(j["CPUs/Task"]))
 
-        self.was_run_using_sbatch = int(j["BatchFlag"]) != 0
+    requested_baseboards: Optional[int] = lazy_field(lambda j: parse_count_fields(j["ReqB:S:C:T"])[0])
+    requested_sockets_pre_baseboard: Optional[int] = lazy_field(lambda j: parse_count_fields(j["ReqB:S:C:T"])[1])
+    requested_cores_per_socket: Optional[int] = lazy_field(lambda j: parse_count_fields(j["ReqB:S:C:T"])[2])
+    requested_threads_per_core: Optional[int] = lazy_field(lambda j: parse_count_fields(j["ReqB:S:C:T"])[3])
 
-        self.requested_node_reboot = int(j["Reboot"]) != 0
+    trackable_resources: List[Tuple[str, str]] = lazy_field(lambda j: parse_trackable_resources(j["TRES"]))
+    trackable_resources_per_node: List[Tuple[str, str]] = lazy_field(
+        lambda j: parse_trackable_resources(j["TresPerNode"]) if "TresPerNode" in j else [])
 
-        code_str, signal_str = j["ExitCode"].split(":")
-        self.exit_code = int(code_str)
-        self.exit_signal = int(signal_str)
+    sockets_per_node: Optional[int] = lazy_field(lambda j: parse_count_field(j["Socks/Node"]))
 
-        self.run_time = parse_slurm_timedelta(j["RunTime"])
-        self.min_time_limit = parse_slurm_timedelta(j["TimeMin"])
-        self.max_time_limit = parse_slurm_timedelta(j["TimeLimit"])
+    tasks_per_node: Optional[int] = lazy_field(lambda j: parse_count_fields(j["NtasksPerN:B:S:C"])[0])
+    tasks_per_baseboard: Optional[int] = lazy_field(lambda j: parse_count_fields(j["NtasksPerN:B:S:C"])[1])
+    tasks_per_socket: Optional[int] = lazy_field(lambda j: parse_count_fields(j["NtasksPerN:B:S:C"])[2])
+    tasks_per_core: Optional[int] = lazy_field(lambda j: parse_count_fields(j["NtasksPerN:B:S:C"])[3])
 
-        self.submit_time = parse_slurm_date(j["SubmitTime"])
-        self.eligible_time = parse_slurm_date(j["EligibleTime"])
-        self.accrue_time = parse_slurm_date(j["AccrueTime"])
-        self.start_time = parse_slurm_date(j["StartTime"])
-        self.end_time = parse_slurm_date(j["EndTime"])
-        self.deadline = parse_slurm_date(j["Deadline"])
-        self.suspend_time = parse_slurm_date(j["SuspendTime"])
+    system_reserved_cores: Optional[int] = lazy_field(lambda j: parse_count_field(j["CoreSpec"]))
 
-        self.secs_pre_suspend = int(j["SecsPreSuspend"])
+    min_cpus_per_node: Optional[int] = lazy_field(lambda j: j["MinCPUsNode"])
+    min_ram_per_node: Optional[str] = lazy_field(lambda j: j.get("MinMemoryNode", None)) # TODO: as bytes
+    min_tmp_disk_per_node: str = lazy_field(lambda j: int(j["MinTmpDiskNode"]))
 
-        self.last_sched_eval = parse_slurm_date(j["LastSchedEval"])
+    stdout_path: Optional[pathlib.Path] = lazy_field(lambda j: j.get("StdOut", None))
+    stderr_path: Optional[pathlib.Path] = lazy_field(lambda j: j.get("StdErr", None))
 
-        self.partition = j["Partition"]
+    features: Optional[str] = lazy_field(lambda j: j["Features"])
+    delay_boot: datetime.timedelta = lazy_field(lambda j: parse_slurm_timedelta(j["DelayBoot"]))
 
-        self.requested_nodes = parse_nullable_list(j["ReqNodeList"])
-        self.excluded_nodes = parse_nullable_list(j["ExcNodeList"])
-        self.nodes = parse_nullable_list(j["NodeList"])
+    over_subscribe: bool = lazy_field(lambda j: j["OverSubscribe"] == "OK")
 
-        # TODO: BatchHost
+    require_contiguous_nodes: bool = lazy_field(lambda j: int(j["Contiguous"]) != 0)
 
-        self.num_nodes = 0 # int(j["NumNodes"]) # TODO: can be 1-1 etc
-        self.num_tasks = int(j["NumTasks"])
+    command: str = lazy_field(lambda j: j["Command"])
 
-        self.num_cpus = int(j["NumCPUs"])
-        self.cpus_per_task = int(j["CPUs/Task"])
+    workdir: pathlib.Path = lazy_field(lambda j: pathlib.Path(j["WorkDir"]))
 
-        req_b, req_s, req_c, req_t = j["ReqB:S:C:T"].split(":")
-        self.requested_baseboards = parse_count_field(req_b)
-        self.requested_sockets_pre_baseboard = parse_count_field(req_s)
-        self.requested_cores_per_socket = parse_count_field(req_c)
-        self.requested_threads_per_core = parse_count_field(req_t)
+    power: str = lazy_field(lambda j: j["Power"])
 
-        self.trackable_resources = parse_trackable_resources(j["TRES"])
+    mail_user: str = lazy_field(lambda j: j["MailUser"])
+    mail_type: str = lazy_field(lambda j: j["MailType"]) # TODO: enum (list of enum?)?
 
-        if "TresPerNode" in j:
-            self.trackable_resources_per_node = parse_trackable_resources(j["TresPerNode"])
-        else:
-            self.trackable_resources_per_node = []
+    def __init__(self, job_state_dict: Dict[str, str], cluster: Optional[str]=None):
+        self.fields = job_state_dict
+        self.values = {}
 
-        self.sockets_per_node = parse_count_field(j["Socks/Node"])
+        # `None` when monitoring a single cluster
+        self.cluster = cluster
 
-        task_n, task_b, task_s, task_c = j["NtasksPerN:B:S:C"].split(":")
-        self.tasks_per_node = parse_count_field(task_n)
-        self.tasks_per_baseboard = parse_count_field(task_b)
-        self.tasks_per_socket = parse_count_field(task_s)
-        self.tasks_per_core = parse_count_field(task_c)
+    def __repr__(self):
+        return f"JobState(job_id={self.job_id}, job_name={self.job_name!r}, user_name={self.user_name!r}, job_state={self.job_state!r})"
 
-        self.system_reserved_cores = parse_count_field(j["CoreSpec"])
+    @property
+    def key(self) -> str:
+        """Key of the job in snapshots, see `qualify`."""
+        return qualify(self.cluster, self.fields["JobId"])
 
-        self.min_cpus_per_node = j["MinCPUsNode"]
-        self.min_ram_per_node = j.get("MinMemoryNode", None) # TODO: as bytes
-        self.min_tmp_disk_per_node = int(j["MinTmpDiskNode"])
+    @property
+    def node_keys(self) -> Optional[List[str]]:
+        """Keys of the allocated nodes in snapshots, see `qualify`."""
+        if self.cluster is None or self.nodes is None:
+            return self.nodes
 
-        self.stdout_path = j.get("StdOut", None)
-        self.stderr_path = j.get("StdErr", None)
+        return [qualify(self.cluster, node) for node in self.nodes]
 
-        self.features = j["Features"]
-        self.delay_boot = parse_slurm_timedelta(j["DelayBoot"])
+    @property
+    def array_key(self) -> Optional[str]:
+        """Key of the job array of the job in snapshots, `None` if the job is
+        not part of an array."""
+        if "ArrayJobId" not in self.fields:
+            return None
 
-        self.over_subscribe = j["OverSubscribe"] == "OK"
+        return qualify(self.cluster, self.fields["ArrayJobId"])
 
-        self.require_contiguous_nodes = int(j["Contiguous"]) != 0
+    @property
+    def array_task_count(self) -> int:
+        """Number of array tasks the job stands for, 1 if not an array."""
+        if self.array_task_id is None:
+            return 1
 
-        self.command = j["Command"]
+        return count_array_tasks(self.array_task_id)
 
-        self.workdir = pathlib.Path(j["WorkDir"])
+    @property
+    def display_id(self) -> str:
+        """The job ID as users know it, e.g. `1234_5` for array tasks."""
+        if self.array_job_id is None:
+            return str(self.job_id)
 
-        self.power = j["Power"]
+        task_id = self.array_task_id
+        return f"{self.array_job_id}_{task_id if task_id.isdigit() else f'[{task_id}]'}"
 
-        self.mail_user = j["MailUser"]
-        self.mail_type = j["MailType"]
-    
     def get_node_count(self):
         return int(self.trackable_resources["node"])
     
@@ -266,7 +232,7 @@ class JobState:
         return "-"
 
     def is_mine(self) -> bool:
-        return self.user_name == os.getlogin()
+        return self.user_name == get_login()
 
 def parse_job_list(job_list: List[str]) -> dict:
     jobs = {}
@@ -277,27 +243,71 @@ def parse_job_list(job_list: List[str]) -> dict:
     
     return jobs
 
-async def query_jobs() -> Dict[str, JobState]:
-    proc = await asyncio.create_subprocess_exec(
-        "scontrol", "show", "jobs", "--oneliner", "--quiet",
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE)
-    
-    stdout, stderr = await proc.communicate()
+job_state_ranks = {
+    "CANCELLED": 0,
+    "NODE_FAIL": 1,
+    "FAILED": 2,
+    "TIMEOUT": 3,
+    "OUT_OF_MEMORY": 4,
+    "COMPLETING": 5,
+    "RUNNING": 10,
+    "COMPLETED": 20
+}
+
+def get_state_rank(state: str):
+    return job_state_ranks.get(state, -1)
+
+def make_job_sort_key():
+    def job_sorter(job: JobState):
+        return (
+            -job.is_mine(),
+            get_state_rank(job.job_state),
+            job.partition,
+            -job.job_id
+        )
+
+    return job_sorter
+
+def get_job_sort_string(job: JobState) -> str:
+    """Returns `make_job_sort_key()(job)` as a string that sorts the same way,
+    for use by client-side code."""
+    mine, rank, partition, negated_job_id = make_job_sort_key()(job)
+    return f"{mine + 1}{rank + 1:02}{partition}\t{10**12 + negated_job_id:012}"
+
+def index_jobs_by_node(jobs: Iterable[JobState]) -> Dict[str, List[JobState]]:
+    """Builds a node key -> jobs allocated on it index.
+    The order of `jobs` is preserved within each node's list."""
+    jobs_by_node = defaultdict(list)
+
+    for job in jobs:
+        if job.nodes is None:
+            continue
+
+        for node in job.node_keys:
+            jobs_by_node[node].append(job)
+
+    return dict(jobs_by_node)
+
+job_parser = IncrementalParser("JobId", JobState, "jobs")
+
+async def query_jobs(runner: ScontrolRunner, parser: IncrementalParser=job_parser) -> Tuple[Dict[str, JobState], ParseDiff]:
+    """Queries all jobs through `runner`; `parser` keeps the states of the
+    previous query. Failures raise rather than returning no job, so that the
+    previous snapshot is kept."""
+    with slurm_query_seconds.labels("text", parser.cluster or "", "jobs").time():
+        stdout = await runner.run("show", "jobs", "--oneliner", "--quiet")
+
     output = stdout.decode("utf-8").splitlines()
-    return parse_job_list(output)
+    return parser.parse(output)
 
-async def query_job(job_id: str) -> JobState:
+async def query_job(job_id: str, runner: ScontrolRunner, cluster: Optional[str]=None) -> JobState:
     if not match_jobid.match(job_id):
         raise ValueError("Invalid slurm JobID received")
     
-    proc = await asyncio.create_subprocess_exec(
-        "scontrol", "show", "job", job_id, "--oneliner", "--quiet",
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE)
-    
-    stdout, stderr = await proc.communicate()
+    with slurm_query_seconds.labels("text", cluster or "", "job").time():
+        # fails for unknown jobs, which says nothing about the controller
+        stdout = await runner.run("show", "job", job_id, "--oneliner", "--quiet", count_errors=False)
 
     output = stdout.decode("utf-8")
 
-    return JobState(parse_info_line(output))
\ No newline at end of file
+    return JobState(parse_info_line(output), cluster)
@@ -0,0 +1,123 @@
+"""Lean job tables: rather than rendering a row per job, lean pages send the
+jobs of all their tables once, as compact JSON that assets/leanrows.js
+expands into the rows that `make_job_row` (include/jobutil.html) renders.
+Columns with few distinct values, e.g. users, partitions or states, are sent
+as indexes into a table of their values."""
+
+import json
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+from jobstate import *
+
+# values are rendered as `make_job_row` shows them, i.e. as `str` would
+lean_job_columns: Tuple[Tuple[str, bool, Callable[[JobState], Any]], ...] = (
+    # (name, whether values are indexes into a table, value of a job)
+    ("key", False, lambda job: job.key),
+    ("job_id", False, lambda job: job.fields["JobId"]),
+    ("display_id", False, lambda job: job.display_id),
+    ("cluster", True, lambda job: job.cluster),
+    ("sort", False, get_job_sort_string),
+    ("state", True, lambda job: job.job_state),
+    ("reasons", True, lambda job: ", ".join(job.job_state_reasons)),
+    ("exit_code", True, lambda job: str(job.exit_code)),
+    ("exit_signal", True, lambda job: str(job.exit_signal)),
+    ("partition", True, lambda job: job.partition),
+    ("user", True, lambda job: job.user_name),
+    ("name", True, lambda job: job.job_name),
+    ("command", True, lambda job: str(job.command)),
+    ("workdir", True, lambda job: str(job.workdir)),
+    ("stdout", True, lambda job: str(job.stdout_path)),
+    ("stderr", True, lambda job: str(job.stderr_path)),
+    ("mail_user", True, lambda job: str(job.mail_user)),
+    ("mail_type", True, lambda job: str(job.mail_type)),
+    ("sbatch", True, lambda job: str(job.was_run_using_sbatch)),
+    ("features", True, lambda job: str(job.features)),
+    ("node_count", False, lambda job: job.get_node_count()),
+    ("requested_nodes", True, lambda job: str(job.requested_nodes)),
+    ("excluded_nodes", True, lambda job: str(job.excluded_nodes)),
+    ("nodes", True, lambda job: f"{len(job.nodes)}: {job.nodes_compact}" if job.nodes is not None else str(job.get_node_count())),
+    ("nodes_compact", True, lambda job: str(job.nodes_compact)),
+    ("layout", True, lambda job: [str(value) for value in (
+        job.sockets_per_node, job.tasks_per_node, job.tasks_per_baseboard, job.tasks_per_socket, job.tasks_per_core
+    )]),
+    ("cpus", False, lambda job: job.get_cpus()),
+    ("memory", True, lambda job: job.get_ram()),
+    ("gpus", True, lambda job: job.get_gpus()),
+    ("gpus_compact", True, lambda job: job.get_gpus(True)),
+    ("submit_time", False, lambda job: str(job.submit_time)),
+    ("eligible_time", False, lambda job: str(job.eligible_time)),
+    ("accrue_time", True, lambda job: str(job.accrue_time)),
+    ("start_time", False, lambda job: str(job.start_time)),
+    ("end_time", False, lambda job: str(job.end_time)),
+    ("deadline", True, lambda job: str(job.deadline)),
+    ("suspend_time", True, lambda job: str(job.suspend_time)),
+    ("run_time", False, lambda job: as_slurm_timedelta(job.run_time)),
+)
+
+
+def wants_lean_html(query, default: bool) -> bool:
+    """Whether to render the page in lean mode: `lean=1` or `lean=0`,
+    `default` (see --lean-html) otherwise."""
+    if "lean" in query:
+        return query["lean"] == "1"
+
+    return default
+
+
+class LeanJobRows:
+    """Jobs of the tables of a lean page being rendered: each table gets the
+    index of its rows from `add_rows`, and the page ends with `encode()`.
+    Jobs shown in several tables, e.g. in the table of their partition and in
+    the card of their node, are only sent once."""
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[Any, int]] = {name: {} for name, in_table, _ in lean_job_columns if in_table}
+
+        self.jobs: List[List[Any]] = []
+        self.job_indexes: Dict[str, int] = {}
+
+        # rows of each table, each a job index or the HTML of a row rendered
+        # by the server, e.g. of a job array
+        self.row_lists: List[List[Union[int, str]]] = []
+
+    def add_job(self, job: JobState) -> int:
+        index = self.job_indexes.get(job.key)
+        if index is not None:
+            return index
+
+        row = []
+        for name, in_table, get_value in lean_job_columns:
+            value = get_value(job)
+
+            if in_table:
+                table = self.tables[name]
+                # lists are not hashable
+                table_key = tuple(value) if isinstance(value, list) else value
+                value = table.setdefault(table_key, len(table))
+
+            row.append(value)
+
+        index = self.job_indexes[job.key] = len(self.jobs)
+        self.jobs.append(row)
+        return index
+
+    def add_rows(self, rows: Iterable[Union[JobState, str]]) -> int:
+        """Adds the rows of a table, either jobs or rendered rows, returning
+        the index of the list of rows that the table refers to."""
+        self.row_lists.append([row if isinstance(row, str) else self.add_job(row) for row in rows])
+        return len(self.row_lists) - 1
+
+    def get_values(self, name: str) -> List[Any]:
+        """Values of the column `name` among the added jobs."""
+        return list(self.tables[name])
+
+    def encode(self, **extra: Any) -> str:
+        """JSON of the rows, to be embedded in a `<script>` element, with the
+        `extra` values the rows need."""
+        return json.dumps({
+            "columns": [name for name, _, _ in lean_job_columns],
+            "tables": {name: list(table) for name, table in self.tables.items()},
+            "jobs": self.jobs,
+            "rows": self.row_lists,
+            **extra,
+        }, separators=(",", ":")).replace("</", "<\\/")
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import re
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web
+from mako.lookup import TemplateLookup
+
+from jobstate import *
+from arrays import index_jobs_by_array
+from metrics import template_render_seconds
+from snapshot import Snapshot
+
+match_tooltip_id = re.compile(r'data-title-id="(\d+)"')
+
+
+def get_job_metadata(job: JobState) -> dict:
+    """Fields the client needs to tell which tables a job belongs to."""
+    return {
+        "id": job.key,
+        "cluster": job.cluster,
+        "partition": job.partition,
+        "state": job.job_state,
+        "user": job.user_name,
+        "nodes": job.node_keys if job.nodes is not None else [],
+        "array": job.array_key,
+    }
+
+
+def get_array_metadata(array_key: str, cluster: Optional[str], tasks: List[JobState]) -> dict:
+    """Fields the client needs to tell which tables a job array belongs to,
+    given its current tasks."""
+    return {
+        "id": array_key,
+        "cluster": cluster,
+        "partitions": sorted({task.partition for task in tasks}),
+        "states": sorted({task.job_state for task in tasks}),
+        "users": sorted({task.user_name for task in tasks}),
+        "nodes": sorted({node for task in tasks if task.nodes is not None for node in task.node_keys}),
+    }
+
+
+def only_run_time_changed(old: JobState, new: JobState) -> bool:
+    return (
+        old.fields.keys() == new.fields.keys()
+        and all(value == new.fields[key] for key, value in old.fields.items() if key != "RunTime")
+    )
+
+
+class LiveUpdates:
+    """Pushes the changes of each snapshot refresh to the pages subscribed to
+    `/events`, as server-sent events.
+
+    The update message is built once per refresh and shared by all
+    subscribers. It only contains the rows of jobs that changed (or just their
+    new run time when that is all that changed) and the node cards whose
+    contents changed. Pages showing job arrays as a single row are told which
+    arrays changed and fetch their new row themselves, as it depends on the
+    filters of each table.
+
+    `poller` is either a `SnapshotPoller` or a `MultiClusterPoller`."""
+
+    def __init__(self, lookup: TemplateLookup, poller, heartbeat_interval: float=15, max_queued_updates: int=16):
+        self.lookup = lookup
+        self.poller = poller
+        self.heartbeat_interval = heartbeat_interval
+        self.max_queued_updates = max_queued_updates
+
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.previous: Optional[Snapshot] = None
+
+        # last rendered card of each node, to only send cards that changed
+        self.node_cards: Dict[str, str] = {}
+
+    def render_job_row(self, job: JobState) -> str:
+        with template_render_seconds.labels("include/jobutil.html#make_job_row").time():
+            return self.lookup.get_template("include/jobutil.html").get_def("make_job_row").render(job=job, compact=False)
+
+    def render_node_card(self, snapshot: Snapshot, name: str) -> str:
+        with template_render_seconds.labels("nodelist.html#make_node").time():
+            return self.lookup.get_template("nodelist.html").get_def("make_node").render(
+                node=snapshot.nodes[name],
+                jobs_by_node=snapshot.jobs_by_node,
+                job_filter=lambda job: True
+            )
+
+    def get_tooltip_titles(self, fragments: List[str]) -> Dict[str, str]:
+        title_ids = {
+            int(title_id)
+            for fragment in fragments
+            for title_id in match_tooltip_id.findall(fragment)
+        }
+
+        return self.lookup.get_template("include/tooltip.html").module.get_tooltip_titles(title_ids)
+
+    def make_update(self, previous: Snapshot, snapshot: Snapshot) -> dict:
+        jobs = []
+        run_times = {}
+        changed_nodes = set(snapshot.node_diff.added | snapshot.node_diff.changed)
+
+        # by array key, the cluster of each job array that changed
+        changed_arrays = {}
+
+        for job_id in snapshot.job_diff.added | snapshot.job_diff.changed:
+            job = snapshot.jobs[job_id]
+            old_job = previous.jobs.get(job_id)
+
+            if old_job is not None and only_run_time_changed(old_job, job):
+                run_times[job_id] = as_slurm_timedelta(job.run_time)
+                continue
+
+            jobs.append(dict(get_job_metadata(job), row=self.render_job_row(job)))
+
+            for state in (old_job, job):
+                if state is not None and state.nodes is not None:
+                    changed_nodes.update(state.node_keys)
+
+                if state is not None and state.array_key is not None:
+                    changed_arrays[state.array_key] = state.cluster
+
+        for job_id in snapshot.job_diff.removed:
+            old_job = previous.jobs[job_id]
+            if old_job.nodes is not None:
+                changed_nodes.update(old_job.node_keys)
+
+            if old_job.array_key is not None:
+                changed_arrays[old_job.array_key] = old_job.cluster
+
+        arrays = []
+
+        if len(changed_arrays) > 0:
+            jobs_by_array = snapshot.derive("jobs_by_array", lambda snapshot: index_jobs_by_array(snapshot.sorted_jobs))
+
+            arrays = [
+                get_array_metadata(array_key, cluster, jobs_by_array.get(array_key, []))
+                for array_key, cluster in changed_arrays.items()
+            ]
+
+        nodes = []
+
+        for name in changed_nodes:
+            if name not in snapshot.nodes:
+                continue
+
+            card = self.render_node_card(snapshot, name)
+            if self.node_cards.get(name) == card:
+                continue
+
+            self.node_cards[name] = card
+            nodes.append({
+                "name": name,
+                "card": card,
+                "jobs": [get_job_metadata(job) for job in snapshot.jobs_by_node.get(name, [])],
+            })
+
+        for name in snapshot.node_diff.removed:
+            self.node_cards.pop(name, None)
+
+        fragments = [job["row"] for job in jobs] + [node["card"] for node in nodes]
+
+        return {
+            "from": previous.version,
+            "to": snapshot.version,
+            "jobs": jobs,
+            "removed_jobs": list(snapshot.job_diff.removed),
+            "arrays": arrays,
+            "run_times": run_times,
+            "nodes": nodes,
+            "removed_nodes": list(snapshot.node_diff.removed),
+            "tooltips": self.get_tooltip_titles(fragments),
+        }
+
+    def on_snapshot(self, snapshot: Snapshot):
+        previous = self.previous
+        self.previous = snapshot
+
+        if len(self.subscribers) == 0:
+            # pages loaded from now on will have up to date cards
+            self.node_cards.clear()
+            return
+
+        if previous is None:
+            return
+
+        update = self.make_update(previous, snapshot)
+        message = f"event: update\ndata: {json.dumps(update, separators=(',', ':'))}\n\n".encode("utf-8")
+
+        for queue in list(self.subscribers):
+            if queue.qsize() >= self.max_queued_updates:
+                # too slow to keep up: disconnect it, it will reconnect and reload
+                self.subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(message)
+
+    async def handle_events(self, request: web.Request) -> web.StreamResponse:
+        await self.poller.get()
+
+        # subscribed before any other await, so that no update gets missed
+        # between the hello and the first update
+        queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        hello = {"version": self.poller.snapshot.version}
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        })
+
+        try:
+            await response.prepare(request)
+            await response.write(f"event: hello\ndata: {json.dumps(hello)}\n\n".encode("utf-8"))
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    # keeps the connection open and the poller from idling
+                    await self.poller.get()
+                    await response.write(b": heartbeat\n\n")
+                    continue
+
+                if message is None:
+                    break
+
+                await response.write(message)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.subscribers.discard(queue)
+
+        return response
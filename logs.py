@@ -0,0 +1,104 @@
+"""Reading of job logs, which may be several GB large: nothing here reads a
+log whole. Ranges are read from their start offset, tails from the end of the
+file, and followed logs only from where the previous read stopped. Files are
+accessed from the default executor since logs often are on network
+filesystems."""
+
+import asyncio
+import os
+import stat
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Optional, Tuple
+
+from jobstate import JobState
+
+log_streams = ("stdout", "stderr")
+
+# end of the log shown first, and loaded again by each "earlier" of the viewer
+default_tail_bytes = 64 * 1024
+
+# read at once from the file
+chunk_bytes = 256 * 1024
+
+def get_log_path(job: JobState, stream: str) -> Optional[Path]:
+    """Path of the `stream` (`stdout` or `stderr`) log of `job`, `None` if
+    it has none. Relative paths are relative to the job's working directory."""
+    raw_path = job.stdout_path if stream == "stdout" else job.stderr_path
+
+    if raw_path is None or raw_path in ("", "(null)"):
+        return None
+
+    path = Path(raw_path)
+    return path if path.is_absolute() else job.workdir / path
+
+def open_log(path: Path) -> Tuple[BinaryIO, int]:
+    """Opens the log at `path`, returning it with its current size. Raises
+    `OSError` if it cannot be read or is not a regular file, e.g. /dev/null."""
+    log_file = open(path, "rb")
+
+    try:
+        status = os.fstat(log_file.fileno())
+
+        if not stat.S_ISREG(status.st_mode):
+            raise IsADirectoryError(f"{path} is not a regular file")
+    except OSError:
+        log_file.close()
+        raise
+
+    return log_file, status.st_size
+
+def resolve_range(start: Optional[int], stop: Optional[int], size: int) -> Optional[Tuple[int, int]]:
+    """Offsets `(start, end)` of a byte range as parsed by `Request.http_range`
+    in a file of `size` bytes, a negative `start` counting from the end of the
+    file. `None` when the range is not satisfiable."""
+    if start is None:
+        start = 0
+    elif start < 0:
+        start = max(size + start, 0)
+
+    end = size if stop is None else min(stop, size)
+
+    if start >= end:
+        return None
+
+    return start, end
+
+async def read_chunks(log_file: BinaryIO, start: int, end: int) -> AsyncIterator[bytes]:
+    """Reads `[start, end)` from `log_file` by chunks. Stops early if the
+    file was truncated meanwhile."""
+    loop = asyncio.get_running_loop()
+    offset = start
+
+    while offset < end:
+        chunk = await loop.run_in_executor(None, os.pread, log_file.fileno(), min(chunk_bytes, end - offset), offset)
+
+        if len(chunk) == 0:
+            return
+
+        offset += len(chunk)
+        yield chunk
+
+async def follow_log(log_file: BinaryIO, offset: int, is_done: Callable[[], Awaitable[bool]], poll_interval: float=1) -> AsyncIterator[bytes]:
+    """Reads what gets appended to `log_file` from `offset` on, checking its
+    size every `poll_interval` seconds. Stops when nothing was appended and
+    `is_done()`, e.g. when the job ended, or when the file got truncated,
+    e.g. by a requeued job."""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        size = (await loop.run_in_executor(None, os.fstat, log_file.fileno())).st_size
+
+        if size < offset:
+            return
+
+        if size > offset:
+            async for chunk in read_chunks(log_file, offset, size):
+                offset += len(chunk)
+                yield chunk
+
+            continue
+
+        if await is_done():
+            return
+
+        await asyncio.sleep(poll_interval)
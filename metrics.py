@@ -0,0 +1,315 @@
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# latency buckets, in seconds
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# size buckets, in bytes
+size_buckets = tuple(2 ** i for i in range(10, 28, 2))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if len(names) == 0:
+        return ""
+
+    return "{" + ",".join(f'{name}="{escape_label_value(str(value))}"' for name, value in zip(names, values)) + "}"
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float=1):
+        self.value += amount
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float=1):
+        self.value += amount
+
+
+class HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Metric(ABC):
+    """Metric in the Prometheus text exposition format, with one value per
+    combination of label values.
+
+    Metrics without labels can be used directly, e.g. `counter.inc()`, the
+    other ones through `labels`, e.g. `counter.labels("jobs").inc()`."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], object] = {}
+
+    @abstractmethod
+    def make_value(self):
+        """New value for a combination of label values."""
+
+    def labels(self, *label_values: str):
+        value = self.values.get(label_values)
+
+        if value is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+
+            value = self.make_value()
+            self.values[label_values] = value
+
+        return value
+
+    def __getattr__(self, name: str):
+        # methods of unlabelled metrics' single value
+        if name in ("inc", "set", "observe", "time"):
+            return getattr(self.labels(), name)
+
+        raise AttributeError(name)
+
+    def format_samples(self) -> Iterable[str]:
+        for label_values, value in self.values.items():
+            yield f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value.value)}"
+
+    def format(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        yield from self.format_samples()
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def make_value(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def make_value(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]=(), buckets: Sequence[float]=default_buckets):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+
+    def make_value(self):
+        return HistogramValue(self.buckets)
+
+    def format_samples(self) -> Iterable[str]:
+        names = self.label_names + ("le",)
+
+        for label_values, value in self.values.items():
+            cumulative = 0
+            for bound, count in zip(value.buckets, value.counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(names, label_values + (format_value(bound),))} {cumulative}"
+
+            yield f"{self.name}_bucket{format_labels(names, label_values + ('+Inf',))} {value.count}"
+
+            labels = format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {format_value(value.sum)}"
+            yield f"{self.name}_count{labels} {value.count}"
+
+
+class Registry:
+    """Metrics exported by `/metrics`. `collectors` are called on each scrape
+    and return metrics computed at that time, e.g. from the latest snapshot."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self.metrics:
+            lines.extend(metric.format())
+
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.format())
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+slurm_query_seconds = registry.register(Histogram(
+    "swatch_slurm_query_seconds",
+    "Time spent waiting for Slurm (scontrol or sacct subprocess, or slurmrestd request)",
+    ["backend", "cluster", "entity"]
+))
+
+job_history_records = registry.register(Counter(
+    "swatch_job_history_records_total",
+    "Ended jobs received from sacct, including the ones received again by overlapping queries",
+    ["cluster"]
+))
+
+parse_seconds = registry.register(Histogram(
+    "swatch_parse_seconds",
+    "Time spent turning a Slurm output into states",
+    ["entity"]
+))
+
+parsed_entries = registry.register(Counter(
+    "swatch_parsed_entries_total",
+    "Jobs or nodes read from Slurm outputs",
+    ["entity"]
+))
+
+reparsed_entries = registry.register(Counter(
+    "swatch_reparsed_entries_total",
+    "Jobs or nodes that were added or changed, and thus parsed again",
+    ["entity"]
+))
+
+snapshot_refresh_seconds = registry.register(Histogram(
+    "swatch_snapshot_refresh_seconds",
+    "Duration of snapshot refreshes, including queries to Slurm",
+    ["cluster"]
+))
+
+snapshot_refresh_failures = registry.register(Counter(
+    "swatch_snapshot_refresh_failures_total",
+    "Snapshot refreshes that failed",
+    ["cluster"]
+))
+
+snapshot_refresh_timestamp = registry.register(Gauge(
+    "swatch_snapshot_last_refresh_timestamp_seconds",
+    "Time of the last successful snapshot refresh, even if the cluster state did not change",
+    ["cluster"]
+))
+
+snapshot_wait_seconds = registry.register(Histogram(
+    "swatch_snapshot_wait_seconds",
+    "Time requests waited for a snapshot to be available"
+))
+
+page_cache_requests = registry.register(Counter(
+    "swatch_page_cache_requests_total",
+    "Rendered page cache lookups",
+    ["result"]
+))
+
+page_cache_evictions = registry.register(Counter(
+    "swatch_page_cache_evictions_total",
+    "Pages evicted from the rendered page cache"
+))
+
+job_lookups = registry.register(Counter(
+    "swatch_job_lookups_total",
+    "Lookups of single jobs, served from the job cache (hit), by Slurm (miss) or by a concurrent lookup of the same job (coalesced)",
+    ["result"]
+))
+
+log_followers = registry.register(Gauge(
+    "swatch_log_followers",
+    "Job logs currently followed by pages"
+))
+
+template_render_seconds = registry.register(Histogram(
+    "swatch_template_render_seconds",
+    "Mako rendering time",
+    ["template"]
+))
+
+page_body_bytes = registry.register(Histogram(
+    "swatch_page_body_bytes",
+    "Size of rendered pages, uncompressed (identity) and compressed",
+    ["encoding"],
+    buckets=size_buckets
+))
+
+sent_page_bytes = registry.register(Counter(
+    "swatch_sent_page_bytes_total",
+    "Bytes of cached page bodies sent, by content encoding",
+    ["encoding"]
+))
+
+api_body_bytes = registry.register(Histogram(
+    "swatch_api_body_bytes",
+    "Size of JSON API bodies, before compression",
+    ["route"],
+    buckets=size_buckets
+))
+
+scontrol_processes = registry.register(Gauge(
+    "swatch_scontrol_processes",
+    "scontrol processes currently running"
+))
+
+scontrol_slot_wait_seconds = registry.register(Histogram(
+    "swatch_scontrol_slot_wait_seconds",
+    "Time scontrol commands waited for another one to finish, see --scontrol-concurrency"
+))
+
+scontrol_timeouts = registry.register(Counter(
+    "swatch_scontrol_timeouts_total",
+    "scontrol commands killed after --slurm-timeout seconds",
+    ["cluster"]
+))
+
+slurm_circuit_open = registry.register(Gauge(
+    "swatch_slurm_circuit_open",
+    "1 while queries to a cluster are suspended after repeated failures",
+    ["cluster"]
+))
+
+startup_seconds = registry.register(Gauge(
+    "swatch_startup_seconds",
+    "Time spent starting the server, by phase: imports, templates (compiled or loaded from --template-cache), first snapshot and total",
+    ["phase"]
+))
@@ -1,8 +1,10 @@
 import asyncio
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from parsing import *
+from metrics import slurm_query_seconds
+from scontrol import ScontrolRunner
 
 fail_states = ("DOWN", "NODE_FAIL", "DRAIN")
 
@@ -77,10 +79,18 @@ class NodeState:
     ext_sensors_watts: str # TODO
     ext_sensors_temp: str # TODO
 
-    def __init__(self, node_state_dict: Dict[str, str]):
+    # `None` when monitoring a single cluster
+    cluster: Optional[str]
+
+    # as parsed, e.g. to be published by `SnapshotPublisher`
+    fields: Dict[str, str] = field(repr=False, compare=False)
+
+    def __init__(self, node_state_dict: Dict[str, str], cluster: Optional[str]=None):
         n = node_state_dict
 
+        self.fields = n
         self.name = n["NodeName"]
+        self.cluster = cluster
         self.arch = n.get("Arch", None)
         self.cores_per_socket = get_and_transform(n, "CoresPerSocket", transform=int, default=None)
 
@@ -131,6 +141,12 @@ class NodeState:
         self.ext_sensors_temp = None
 
 
+    @property
+    def key(self) -> str:
+        """Key of the node in snapshots, see `qualify`."""
+        return qualify(self.cluster, self.name)
+
+
 def parse_node_list(node_list: List[str]) -> dict:
     jobs = {}
 
@@ -141,12 +157,13 @@ def parse_node_list(node_list: List[str]) -> dict:
     return jobs
 
 
-async def query_nodes() -> Dict[str, NodeState]:
-    proc = await asyncio.create_subprocess_exec(
-        "scontrol", "show", "nodes", "--oneliner", "--quiet",
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE)
+node_parser = IncrementalParser("NodeName", NodeState, "nodes")
+
+
+async def query_nodes(runner: ScontrolRunner, parser: IncrementalParser=node_parser) -> Tuple[Dict[str, NodeState], ParseDiff]:
+    """Queries all nodes, see `query_jobs`."""
+    with slurm_query_seconds.labels("text", parser.cluster or "", "nodes").time():
+        stdout = await runner.run("show", "nodes", "--oneliner", "--quiet")
 
-    stdout, stderr = await proc.communicate()
     output = stdout.decode("utf-8").splitlines()
-    return parse_node_list(output)
+    return parser.parse(output)
@@ -0,0 +1,191 @@
+import datetime
+import math
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlencode
+
+from jobstate import *
+from snapshot import Snapshot
+from columnar import get_job_gpus, get_job_memory_mbytes
+from arrays import JobArray, group_job_arrays
+from query import get_all_values
+
+# columns of the job table that can be sorted by, see `sort_jobs`
+job_sort_columns: Dict[str, Callable[[JobState], Any]] = {
+    "state": lambda job: (get_state_rank(job.job_state), job.job_state),
+    "id": lambda job: job.job_id,
+    "user": lambda job: job.user_name,
+    "name": lambda job: job.job_name,
+    "nodes": lambda job: job.get_node_count(),
+    "cpus": lambda job: job.get_cpus(),
+    "memory": get_job_memory_mbytes,
+    "gpus": get_job_gpus,
+    "time": lambda job: job.run_time if job.run_time is not None else datetime.timedelta(),
+}
+
+# query parameters handled by pagination rather than by the job filters
+page_query_keys = ("page", "per_page", "sort", "order", "arrays", "history")
+
+
+def sort_jobs(snapshot: Snapshot, jobs: List[JobState], column: Optional[str], descending: bool) -> List[JobState]:
+    """Sorts `jobs`, a selection of `snapshot.sorted_jobs` in the same order, by
+    a column of `job_sort_columns`, or in the default order when `column` is
+    `None`. Jobs that compare equal stay in the default order.
+
+    All the snapshot's jobs are sorted once per column and order, so that
+    sorting a selection is a linear filtering pass."""
+    if column is None and not descending:
+        return jobs
+
+    def build(snapshot: Snapshot) -> List[JobState]:
+        if column is None:
+            return snapshot.sorted_jobs[::-1]
+
+        return sorted(snapshot.sorted_jobs, key=job_sort_columns[column], reverse=descending)
+
+    ordered = snapshot.derive(f"jobs_sorted_by/{column}/{descending}", build)
+
+    if len(jobs) == len(ordered):
+        return ordered
+
+    selected = {job.key for job in jobs}
+    return [job for job in ordered if job.key in selected]
+
+
+@dataclass
+class JobPage:
+    """Page of a sorted job selection, along with what is needed to link to
+    the other pages and sort orders."""
+
+    # with the tasks of each job array grouped as a `JobArray` when grouping
+    jobs: List[Union[JobState, JobArray]]
+
+    # 1-based
+    number: int
+
+    # `None` when all jobs are on one page
+    per_page: Optional[int]
+
+    total: int
+
+    sort: Optional[str]
+    descending: bool
+
+    # all the values of each parameter, as filters can be repeated
+    query: Dict[str, List[str]]
+
+    # range of the ended jobs listed from the job history, e.g. `24h`, `None`
+    # when listing the jobs of the snapshot
+    history: Optional[str] = None
+
+    @property
+    def page_count(self) -> int:
+        if self.per_page is None or self.total == 0:
+            return 1
+
+        return math.ceil(self.total / self.per_page)
+
+    @property
+    def first_index(self) -> int:
+        """1-based index of the first job of the page among the selection."""
+        if self.per_page is None:
+            return 1
+
+        return (self.number - 1) * self.per_page + 1
+
+    @property
+    def is_static_order(self) -> bool:
+        """Whether live updates must leave the set and order of rows alone,
+        as they cannot tell where new jobs would go."""
+        return self.sort is not None or self.descending or self.page_count > 1 or self.history is not None
+
+    def url(self, **changes: Any) -> str:
+        """Link to the same selection with the given query parameters changed,
+        or removed when `None`."""
+        query = dict(self.query)
+
+        for key, value in changes.items():
+            if value is None:
+                query.pop(key, None)
+            else:
+                query[key] = [str(value)]
+
+        return "?" + urlencode(query, doseq=True, safe=",")
+
+    def page_url(self, number: int) -> str:
+        return self.url(page=number if number != 1 else None)
+
+    def sort_url(self, column: str) -> str:
+        if self.sort == column and not self.descending:
+            return self.url(sort=column, order="desc", page=None)
+
+        return self.url(sort=column, order=None, page=None)
+
+    def nearby_pages(self, radius: int = 2) -> List[int]:
+        """Page numbers to link to: the first and last pages, and the pages
+        around the current one."""
+        pages = {1, self.page_count}
+        pages.update(range(max(self.number - radius, 1), min(self.number + radius, self.page_count) + 1))
+        return sorted(pages)
+
+
+def parse_positive_int(query, key: str, default: Optional[int]) -> Optional[int]:
+    if key not in query:
+        return default
+
+    value = query[key]
+    if not value.isdigit() or int(value) == 0:
+        raise ValueError(f"{key} must be a positive integer")
+
+    return int(value)
+
+
+def parse_page_query(query, default_per_page: Optional[int]) -> Tuple[Optional[str], bool, Optional[int], int]:
+    """Parses the `sort`, `order`, `per_page` and `page` query parameters,
+    see `paginate_jobs`. Raises `ValueError` on invalid parameters."""
+    sort = query.get("sort")
+    if sort is not None and sort not in job_sort_columns:
+        raise ValueError(f"sort must be one of {', '.join(job_sort_columns)}")
+
+    order = query.get("order", "asc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+
+    per_page = None if query.get("per_page") == "all" else parse_positive_int(query, "per_page", default_per_page)
+    number = parse_positive_int(query, "page", 1)
+
+    return sort, order == "desc", per_page, number
+
+
+def paginate_jobs(snapshot: Snapshot, jobs: List[JobState], query, default_per_page: Optional[int], group_arrays: bool=False) -> JobPage:
+    """Sorts and paginates `jobs` according to the `page`, `per_page`
+    (`all` for no pagination), `sort` and `order` (`asc`/`desc`) query
+    parameters. Raises `ValueError` on invalid parameters. Out of range pages
+    are clamped to the last page.
+
+    With `group_arrays`, each job array takes a single row, sorted where its
+    first task would be, so that pages count arrays rather than tasks."""
+    sort, descending, per_page, number = parse_page_query(query, default_per_page)
+
+    jobs = sort_jobs(snapshot, jobs, sort, descending)
+
+    if group_arrays:
+        jobs = group_job_arrays(jobs)
+
+    page = JobPage(
+        jobs=jobs,
+        number=number,
+        per_page=per_page,
+        total=len(jobs),
+        sort=sort,
+        descending=descending,
+        query=get_all_values(query)
+    )
+
+    page.number = min(page.number, page.page_count)
+
+    if per_page is not None:
+        start = page.first_index - 1
+        page.jobs = jobs[start:start + per_page]
+
+    return page
@@ -1,11 +1,19 @@
 import datetime
 import re
-from typing import Optional, List, Tuple
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional, List, Set, Tuple
 
-missing_date_identifiers = ["N/A", "Unknown", "None"]
+from metrics import parse_seconds, parsed_entries, reparsed_entries
+
+missing_date_identifiers = ["N/A", "Unknown", "None", "UNLIMITED"]
 
 match_jobid = re.compile("^[.0-9]+$")
 
+def qualify(cluster: Optional[str], name: str) -> str:
+    """Key of a job or node of `cluster`, as ids and names are only unique
+    within a cluster. Unchanged when monitoring a single cluster."""
+    return name if cluster is None else f"{cluster}/{name}"
+
 def as_slurm_timedelta(t: datetime.timedelta) -> str:
     hours, rem = divmod(t.seconds, 3600)
     minutes, seconds = divmod(rem, 60)
@@ -39,6 +47,15 @@ def parse_count_field(field: str) -> Optional[int]:
     
     return int(field)
 
+size_units_mbytes = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024, "P": 1024 * 1024 * 1024}
+
+def parse_size_mbytes(size: str) -> float:
+    """Parses a Slurm memory size (e.g. `64G`) to megabytes, the default unit."""
+    if len(size) > 0 and size[-1] in size_units_mbytes:
+        return float(size[:-1]) * size_units_mbytes[size[-1]]
+
+    return float(size)
+
 def parse_trackable_resource(tres: str):
     if "=" in tres:
         return (tres[:tres.index("=")], tres[tres.index("=")+1:])
@@ -62,16 +79,231 @@ def parse_nullable_list(l: str) -> Optional[List[str]]:
     
     return l.split(",")
 
+def split_hostlist(hostlist: str) -> List[str]:
+    """Splits a hostlist on the commas that are not within a bracketed range."""
+    entries = []
+    depth = 0
+    start = 0
+
+    for i, c in enumerate(hostlist):
+        if c == "[":
+            depth += 1
+        elif c == "]":
+            depth -= 1
+        elif c == "," and depth == 0:
+            entries.append(hostlist[start:i])
+            start = i + 1
+
+    entries.append(hostlist[start:])
+    return [entry for entry in entries if len(entry) > 0]
+
+def expand_hostlist_ranges(ranges: str) -> List[str]:
+    """Expands the contents of a bracketed range, e.g. `001-003,007`."""
+    values = []
+
+    for entry in ranges.split(","):
+        if "-" not in entry:
+            values.append(entry)
+            continue
+
+        low, high = entry.split("-", 1)
+        width = len(low)
+        values.extend(f"{i:0{width}}" for i in range(int(low), int(high) + 1))
+
+    return values
+
+def expand_hostlist_entry(entry: str) -> List[str]:
+    if "[" not in entry:
+        return [entry]
+
+    open_index = entry.index("[")
+    close_index = entry.index("]", open_index)
+
+    prefix = entry[:open_index]
+    suffixes = expand_hostlist_entry(entry[close_index+1:])
+
+    return [
+        f"{prefix}{value}{suffix}"
+        for value in expand_hostlist_ranges(entry[open_index+1:close_index])
+        for suffix in suffixes
+    ]
+
+def expand_hostlist(hostlist: str) -> List[str]:
+    """Expands a Slurm hostlist expression, e.g. `gpu[001-003,007],cpu01` into
+    the list of every host name it refers to."""
+    return [
+        host
+        for entry in split_hostlist(hostlist)
+        for host in expand_hostlist_entry(entry)
+    ]
+
+def count_array_tasks(task_ids: str) -> int:
+    """Number of tasks in a job array task ID expression, e.g. `5`,
+    `1-100%10`, `1,3,5-9` or `0-99:2` (every other task)."""
+    task_ids = task_ids.strip("[]").split("%")[0]
+    count = 0
+
+    for entry in task_ids.split(","):
+        if "-" not in entry:
+            count += 1
+            continue
+
+        bounds, _, step = entry.partition(":")
+        low, high = bounds.split("-", 1)
+        count += (int(high) - int(low)) // int(step or 1) + 1
+
+    return count
+
+def parse_nullable_hostlist(l: str) -> Optional[List[str]]:
+    if l in ("(null)", ""):
+        return None
+
+    return expand_hostlist(l)
+
+class lazy_field:
+    """Attribute computed from the raw `fields` of its instance on first
+    access, then memoized in the `values` dict of the instance."""
+
+    def __init__(self, parse: Callable[[Dict[str, str]], Any]):
+        self.parse = parse
+        self.name = None
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        try:
+            return instance.values[self.name]
+        except KeyError:
+            value = self.parse(instance.fields)
+            instance.values[self.name] = value
+            return value
+
+# a field key is a word, i.e. preceded by a space, up to its first `=`
+match_field_key = re.compile(" ([^ =]*)=")
+
 def parse_info_line(job_line: str) -> dict:
-    fields = {}
-    last_field = None
-
-    for word in job_line.split(" "):
-        if "=" in word:
-            eq_index = word.index("=")
-            last_field = word[:eq_index]
-            fields[last_field] = word[eq_index+1:]
-        elif last_field is not None:
-            fields[last_field] += f" {word}"
-
-    return {k: v.strip() for k, v in fields.items()}
\ No newline at end of file
+    """Parses a `Key=Value Key=Value ...` line as output by `scontrol --oneliner`.
+    Values may contain spaces (e.g. `Command`, `Reason`, `WorkDir`): any word
+    that is not of the form `Key=...` belongs to the value of the last key."""
+    # [prefix, key, value, key, value, ...]
+    tokens = match_field_key.split(" " + job_line)
+    return dict(zip(tokens[1::2], map(str.strip, tokens[2::2])))
+
+
+@dataclass
+class ParseDiff:
+    """Keys of the entries that appeared, changed or disappeared between two
+    consecutive `IncrementalParser.parse` calls."""
+    added: Set[str] = field(default_factory=set)
+    changed: Set[str] = field(default_factory=set)
+    removed: Set[str] = field(default_factory=set)
+
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.changed) == 0 and len(self.removed) == 0
+
+class IncrementalParser:
+    """Parses `scontrol show ... --oneliner` outputs into state objects.
+
+    Between two polls, most lines are byte-identical. The state built for each
+    line is kept until the next call, so that only the lines that differ
+    are parsed again; state objects are thus shared between consecutive
+    results and must not be modified. Entries that disappeared are evicted.
+
+    `entity` (e.g. `jobs`) labels the parsing metrics. States are keyed by
+    `qualify(cluster, fields[key_field])`."""
+
+    def __init__(self, key_field: str, make_state: Callable[[Dict[str, str]], Any], entity: str, cluster: Optional[str]=None):
+        self.key_field = key_field
+        self.make_state = make_state
+        self.entity = entity
+        self.cluster = cluster
+
+        self.line_cache: Dict[str, Tuple[str, Any]] = {}
+
+    def parse(self, lines: Iterable[str]) -> Tuple[Dict[str, Any], ParseDiff]:
+        with parse_seconds.labels(self.entity).time():
+            states, diff = self.parse_lines(lines)
+
+        parsed_entries.labels(self.entity).inc(len(states))
+        reparsed_entries.labels(self.entity).inc(len(diff.added) + len(diff.changed))
+
+        return states, diff
+
+    def parse_lines(self, lines: Iterable[str]) -> Tuple[Dict[str, Any], ParseDiff]:
+        previous_cache = self.line_cache
+        line_cache = {}
+
+        states = {}
+        parsed_keys = set()
+
+        for line in lines:
+            entry = previous_cache.get(line)
+
+            if entry is None:
+                fields = parse_info_line(line)
+                entry = (qualify(self.cluster, fields[self.key_field]), self.make_state(fields))
+                parsed_keys.add(entry[0])
+
+            line_cache[line] = entry
+            states[entry[0]] = entry[1]
+
+        previous_keys = {key for key, _ in previous_cache.values()}
+
+        diff = ParseDiff(
+            added=parsed_keys - previous_keys,
+            changed=parsed_keys & previous_keys,
+            removed=previous_keys - states.keys()
+        )
+
+        self.line_cache = line_cache
+
+        return states, diff
+
+
+class IncrementalBuilder:
+    """Builds state objects from field dicts, like `IncrementalParser` does
+    from lines: the previous state of an entry is reused when its fields did
+    not change."""
+
+    def __init__(self, key_field: str, make_state: Callable[[Dict[str, str]], Any], entity: str, cluster: Optional[str]=None):
+        self.key_field = key_field
+        self.make_state = make_state
+        self.entity = entity
+        self.cluster = cluster
+
+        self.entries: Dict[str, Tuple[Dict[str, str], Any]] = {}
+
+    def build(self, fields_list: Iterable[Dict[str, str]]) -> Tuple[Dict[str, Any], ParseDiff]:
+        with parse_seconds.labels(self.entity).time():
+            states, diff = self.build_states(fields_list)
+
+        parsed_entries.labels(self.entity).inc(len(states))
+        reparsed_entries.labels(self.entity).inc(len(diff.added) + len(diff.changed))
+
+        return states, diff
+
+    def build_states(self, fields_list: Iterable[Dict[str, str]]) -> Tuple[Dict[str, Any], ParseDiff]:
+        previous_entries = self.entries
+        entries = {}
+
+        diff = ParseDiff()
+
+        for fields in fields_list:
+            key = qualify(self.cluster, fields[self.key_field])
+            entry = previous_entries.get(key)
+
+            if entry is None or entry[0] != fields:
+                entry = (fields, self.make_state(fields))
+                (diff.added if key not in previous_entries else diff.changed).add(key)
+
+            entries[key] = entry
+
+        diff.removed = previous_entries.keys() - entries.keys()
+
+        self.entries = entries
+
+        return {key: state for key, (_, state) in entries.items()}, diff
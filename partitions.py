@@ -0,0 +1,175 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from jobstate import *
+from nodestate import *
+from snapshot import Snapshot
+
+# job states listed in the job table of each partition
+table_states = ("RUNNING", "PENDING", "COMPLETING")
+
+# e.g. `gpu:a100:4(S:0-1)` or `gpu:4` when the GPUs have no type
+match_gpu_gres = re.compile(r"(?:^|,)gpu(?::([^:(,]+))?:(\d+)")
+
+
+def get_gpu_types(node: NodeState) -> Dict[str, int]:
+    """GPUs of `node` by type, from its raw `Gres`. `node.gres` cannot be used
+    as it only keeps one entry per resource name."""
+    types = {}
+
+    for match in match_gpu_gres.finditer(node.fields.get("Gres", "")):
+        gpu_type = match.group(1) or "gpu"
+        types[gpu_type] = types.get(gpu_type, 0) + int(match.group(2))
+
+    return types
+
+
+def get_gpu_alloc_by_type(node: NodeState, types: Dict[str, int]) -> Dict[str, int]:
+    """Allocated GPUs of `node` by type. Slurm only reports typed allocations
+    (e.g. `gres/gpu:a100`) when they are listed in `AccountingStorageTRES`:
+    otherwise, the allocation of nodes with several GPU types is attributed to
+    the types in the order of their `Gres`."""
+    remaining = int(node.tres_alloc.get("gres/gpu", 0))
+    alloc = {}
+
+    for gpu_type, count in types.items():
+        typed = node.tres_alloc.get(f"gres/gpu:{gpu_type}")
+        alloc[gpu_type] = int(typed) if typed is not None else min(count, remaining)
+        remaining = max(remaining - alloc[gpu_type], 0)
+
+    return alloc
+
+
+@dataclass
+class GpuUsage:
+    alloc: int = 0
+    total: int = 0
+
+    # only counts the GPUs of nodes that are up
+    free: int = 0
+
+
+@dataclass
+class PartitionSummary:
+    """Resources and jobs of a partition, summed over its nodes. Free
+    resources only count nodes that are up, while totals count all of them."""
+
+    cluster: Optional[str]
+    name: str
+
+    nodes: List[NodeState] = field(default_factory=list)
+    nodes_up: int = 0
+
+    cpu_alloc: int = 0
+    cpu_total: int = 0
+    cpu_free: int = 0
+
+    memory_alloc_mbytes: float = 0
+    memory_total_mbytes: float = 0
+    memory_free_mbytes: float = 0
+
+    # by GPU type, `gpu` for GPUs without a type
+    gpus: Dict[str, GpuUsage] = field(default_factory=dict)
+
+    job_states: Dict[str, int] = field(default_factory=dict)
+
+    # in `table_states`, in the order of `Snapshot.sorted_jobs`
+    jobs: List[JobState] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return qualify(self.cluster, self.name)
+
+    @property
+    def nodes_down(self) -> int:
+        return len(self.nodes) - self.nodes_up
+
+    @property
+    def gpu_alloc(self) -> int:
+        return sum(usage.alloc for usage in self.gpus.values())
+
+    @property
+    def gpu_total(self) -> int:
+        return sum(usage.total for usage in self.gpus.values())
+
+    @property
+    def gpu_free(self) -> int:
+        return sum(usage.free for usage in self.gpus.values())
+
+    @property
+    def running_jobs(self) -> int:
+        return self.job_states.get("RUNNING", 0)
+
+    @property
+    def pending_jobs(self) -> int:
+        return self.job_states.get("PENDING", 0)
+
+    def add_node(self, node: NodeState, gpu_types: Dict[str, int], gpu_alloc: Dict[str, int]):
+        self.nodes.append(node)
+        self.nodes_up += node.up
+
+        self.cpu_alloc += node.cpu_alloc
+        self.cpu_total += node.cpu_total
+
+        memory_alloc = node.memory_alloc_mbytes or 0
+        memory_total = node.memory_total_mbytes or 0
+        self.memory_alloc_mbytes += memory_alloc
+        self.memory_total_mbytes += memory_total
+
+        if node.up:
+            self.cpu_free += max(node.cpu_total - node.cpu_alloc, 0)
+            self.memory_free_mbytes += max(memory_total - memory_alloc, 0)
+
+        for gpu_type, count in gpu_types.items():
+            usage = self.gpus.setdefault(gpu_type, GpuUsage())
+            usage.alloc += gpu_alloc[gpu_type]
+            usage.total += count
+
+            if node.up:
+                usage.free += max(count - gpu_alloc[gpu_type], 0)
+
+
+def summarize_partitions(snapshot: Snapshot) -> Dict[str, PartitionSummary]:
+    """Summaries of the partitions of `snapshot` by qualified name (see
+    `qualify`). Clusters come in the order of their nodes in the snapshot,
+    and partitions are sorted by descending name within each cluster, which
+    conveniently puts `gpu` before `cpu`. Meant to be computed once per
+    snapshot with `Snapshot.derive`."""
+    summaries: Dict[str, PartitionSummary] = {}
+
+    for node in snapshot.nodes.values():
+        gpu_types = get_gpu_types(node)
+        gpu_alloc = get_gpu_alloc_by_type(node, gpu_types)
+
+        for partition in node.partitions:
+            key = qualify(node.cluster, partition)
+
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = PartitionSummary(node.cluster, partition)
+
+            summary.add_node(node, gpu_types, gpu_alloc)
+
+    for job in snapshot.sorted_jobs:
+        summary = summaries.get(qualify(job.cluster, job.partition))
+        if summary is None:
+            continue
+
+        summary.job_states[job.job_state] = summary.job_states.get(job.job_state, 0) + 1
+
+        if job.job_state in table_states:
+            summary.jobs.append(job)
+
+    cluster_order = {}
+    for summary in summaries.values():
+        cluster_order.setdefault(summary.cluster, len(cluster_order))
+
+    ordered = sorted(summaries.values(), key=lambda summary: summary.name, reverse=True)
+    ordered.sort(key=lambda summary: cluster_order[summary.cluster])
+
+    return {summary.key: summary for summary in ordered}
+
+
+def get_partition_summaries(snapshot: Snapshot) -> Dict[str, PartitionSummary]:
+    return snapshot.derive("partitions", summarize_partitions)
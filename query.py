@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ValueSet:
+    """Values given exactly, or by a prefix such as `gpu*`."""
+
+    exact: FrozenSet[str]
+    prefixes: Tuple[str, ...]
+
+    def contains(self, value: Optional[str]) -> bool:
+        if value is None:
+            return False
+
+        return value in self.exact or any(value.startswith(prefix) for prefix in self.prefixes)
+
+    def select(self, values: Iterable[str]) -> List[str]:
+        """The `values` in the set. Without prefixes, exact values are looked
+        up in `values` rather than scanning it, e.g. in the keys of an index."""
+        if len(self.prefixes) == 0 and isinstance(values, (dict, set, frozenset)):
+            return [value for value in self.exact if value in values]
+
+        return [value for value in values if self.contains(value)]
+
+
+@dataclass(frozen=True)
+class FieldFilter:
+    """Compiled value of a filter query parameter, such as `user=alice,bob`.
+    Values starting with `!` exclude jobs (`state=!PENDING`) and values
+    ending with `*` match by prefix (`partition=gpu*`).
+
+    A job matches when it has one of the included values, if any are given,
+    and none of the excluded ones. For fields with several values per job,
+    e.g. its nodes, any of them counts."""
+
+    # `None` when only exclusions are given
+    includes: Optional[ValueSet]
+    excludes: Optional[ValueSet]
+
+    def matches(self, value: Optional[str]) -> bool:
+        return (
+            (self.includes is None or self.includes.contains(value))
+            and (self.excludes is None or not self.excludes.contains(value))
+        )
+
+    def matches_any(self, values: Iterable[str]) -> bool:
+        values = list(values)
+
+        return (
+            (self.includes is None or any(self.includes.contains(value) for value in values))
+            and (self.excludes is None or not any(self.excludes.contains(value) for value in values))
+        )
+
+
+def make_value_set(values: List[str]) -> Optional[ValueSet]:
+    if len(values) == 0:
+        return None
+
+    return ValueSet(
+        exact=frozenset(value for value in values if not value.endswith("*")),
+        prefixes=tuple(value[:-1] for value in values if value.endswith("*"))
+    )
+
+
+def compile_filter(expression: str) -> FieldFilter:
+    """Compiles a comma-separated filter, see `FieldFilter`."""
+    terms = expression.split(",")
+
+    return FieldFilter(
+        includes=make_value_set([term for term in terms if not term.startswith("!")]),
+        excludes=make_value_set([term[1:] for term in terms if term.startswith("!")])
+    )
+
+
+# query parameters filtering jobs
+job_filter_keys = ("cluster", "partition", "state", "node", "user", "array")
+
+# query parameters filtering nodes
+node_filter_keys = ("cluster", "partition")
+
+
+def get_all(query, key: str) -> List[str]:
+    """All the values of `key` in `query`, which is either a dict or a
+    multidict when parsed from a URL (e.g. `state=!PENDING&state=RUN*`)."""
+    if hasattr(query, "getall"):
+        return query.getall(key, [])
+
+    return [query[key]] if key in query else []
+
+
+def get_all_values(query) -> Dict[str, List[str]]:
+    """All the values of each key of `query`, see `get_all`."""
+    return {key: get_all(query, key) for key in query}
+
+
+def compile_query(query, keys: Iterable[str]) -> List[Tuple[str, FieldFilter]]:
+    """Compiles the filters of `query` on `keys`, in the order of `keys`.
+    A parameter given several times must match each time."""
+    return [
+        (key, compile_filter(expression))
+        for key in keys
+        for expression in get_all(query, key)
+    ]
+
+
+def compile_job_query(query) -> List[Tuple[str, FieldFilter]]:
+    return compile_query(query, job_filter_keys)
+
+
+def compile_node_query(query) -> List[Tuple[str, FieldFilter]]:
+    return compile_query(query, node_filter_keys)
+
+
+def get_filters(filters: List[Tuple[str, FieldFilter]], key: str) -> List[FieldFilter]:
+    return [field_filter for filter_key, field_filter in filters if filter_key == key]
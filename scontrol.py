@@ -0,0 +1,178 @@
+import asyncio
+import datetime
+import os
+import signal
+import time
+from typing import Optional, Sequence
+
+from metrics import scontrol_processes, scontrol_slot_wait_seconds, scontrol_timeouts, slurm_circuit_open
+
+
+class SlurmUnavailableError(Exception):
+    """Slurm could not be queried: a command failed or timed out, or queries
+    are suspended by a `CircuitBreaker`."""
+    pass
+
+
+class CircuitOpenError(SlurmUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """Stops querying a slurmctld that keeps failing or timing out, rather than
+    adding load to an already struggling controller.
+
+    After `failure_threshold` consecutive failures, calls fail immediately with
+    `CircuitOpenError` for `base_backoff` seconds, doubling after each further
+    failure up to `max_backoff`. Once the delay elapsed, calls go through
+    again: a success closes the circuit, a failure opens it again.
+
+    `name` is the cluster the breaker protects, for `/metrics`."""
+
+    def __init__(self, name: str="", failure_threshold: int=3, base_backoff: float=5, max_backoff: float=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.failures = 0
+        self.open_until = 0.0
+
+        # why the circuit opened, repeated by `CircuitOpenError`
+        self.last_error: Optional[str] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.failure_threshold
+
+    def before_call(self):
+        """Raises `CircuitOpenError` if the call must not be made."""
+        remaining = self.open_until - time.monotonic()
+
+        if self.is_open and remaining > 0:
+            retry_time = datetime.datetime.now() + datetime.timedelta(seconds=remaining)
+            raise CircuitOpenError(f"{self.last_error}; next attempt at {retry_time:%H:%M:%S}")
+
+    def record_success(self):
+        self.failures = 0
+        slurm_circuit_open.labels(self.name).set(0)
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+
+        if self.is_open:
+            backoff = min(self.base_backoff * 2 ** (self.failures - self.failure_threshold), self.max_backoff)
+            self.open_until = time.monotonic() + backoff
+            slurm_circuit_open.labels(self.name).set(1)
+
+
+class ProcessSlots:
+    """Caps the number of Slurm commands running at once, across all clusters
+    and callers. The semaphore is created on first use so that it belongs to
+    the server's event loop."""
+
+    def __init__(self, limit: int=4):
+        self.limit = limit
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+
+        return self.semaphore
+
+
+def kill_process_group(proc: asyncio.subprocess.Process):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# shared by all runners unless given their own
+default_slots = ProcessSlots()
+
+
+class ScontrolRunner:
+    """Runs `scontrol` commands with a bounded concurrency (`slots`) and a
+    `timeout` in seconds, after which the process is killed.
+
+    Timeouts and, unless the caller says otherwise, nonzero exit codes are
+    reported to `breaker`, which suspends further commands while the
+    controller is unhealthy. `args` are passed before each command, e.g. `-M`
+    to select a cluster."""
+
+    def __init__(
+        self,
+        scontrol: str="scontrol",
+        args: Sequence[str]=(),
+        timeout: float=30,
+        slots: Optional[ProcessSlots]=None,
+        breaker: Optional[CircuitBreaker]=None
+    ):
+        self.scontrol = scontrol
+        self.args = list(args)
+        self.timeout = timeout
+        self.slots = slots if slots is not None else default_slots
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+    async def run(self, *command: str, count_errors: bool=True) -> bytes:
+        """Runs `scontrol <args> <command>` and returns its standard output.
+        Raises `SlurmUnavailableError` when the command cannot be started,
+        fails, times out or when the circuit is open. `count_errors=False` is meant for commands
+        that can fail because of their arguments, e.g. an unknown job ID."""
+        self.breaker.before_call()
+        semaphore = self.slots.get_semaphore()
+
+        try:
+            with scontrol_slot_wait_seconds.time():
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # the controller is not necessarily at fault, other commands are
+            raise SlurmUnavailableError(f"Too many scontrol commands running, gave up after {self.timeout:g}s")
+
+        try:
+            scontrol_processes.inc()
+            proc = await asyncio.create_subprocess_exec(
+                self.scontrol, *self.args, *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # own process group, so that wrapper scripts are killed with
+                # their children, which would otherwise keep the pipes open
+                start_new_session=True)
+
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=self.timeout)
+            except BaseException:
+                # also on cancellation, so that no scontrol outlives its caller
+                kill_process_group(proc)
+                await proc.wait()
+                raise
+        except asyncio.TimeoutError:
+            scontrol_timeouts.labels(self.breaker.name).inc()
+            error = f"scontrol {' '.join(command)} timed out after {self.timeout:g}s"
+            self.breaker.record_failure(error)
+            raise SlurmUnavailableError(error)
+        except OSError as e:
+            # e.g. a wrong --scontrol-path, or fork failing under load
+            error = f"{self.scontrol} could not be run: {e}"
+            self.breaker.record_failure(error)
+            raise SlurmUnavailableError(error)
+        finally:
+            scontrol_processes.inc(-1)
+            semaphore.release()
+
+        if proc.returncode != 0:
+            message = stderr.decode("utf-8", errors="replace").strip().splitlines()
+            detail = f": {message[-1]}" if len(message) > 0 else ""
+            error = f"scontrol exited with code {proc.returncode}{detail}"
+
+            if count_errors:
+                self.breaker.record_failure(error)
+
+            raise SlurmUnavailableError(error)
+
+        self.breaker.record_success()
+        return stdout
@@ -1,35 +1,435 @@
 import asyncio
-from collections import defaultdict
+from collections import OrderedDict
 import datetime
+import functools
+import gzip
+import logging
+import time
 from dataclasses import dataclass
-from typing import Dict, Callable, Any
+from typing import Awaitable, Dict, Callable, Any, Hashable, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from snapshot import merge_snapshots
+from metrics import (
+    job_lookups, page_body_bytes, page_cache_evictions, page_cache_requests, sent_page_bytes,
+    snapshot_refresh_failures, snapshot_refresh_seconds, snapshot_refresh_timestamp, snapshot_wait_seconds
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 @dataclass
-class CacheEntry:
-    t: datetime.datetime
-    contents: Any
-
-    def is_obsolete(self, current_time, timeout: int):
-        return current_time > self.t + datetime.timedelta(seconds=timeout)
-
-cache_contents: Dict[Callable[[], Any], CacheEntry] = {}
-cache_locks = defaultdict(lambda: asyncio.Lock())
-
-async def cache_force_add(function, current_time):
-    contents = await function()
-    cache_contents[function] = CacheEntry(current_time, contents)
-    return contents
-
-async def simple_cache(function, timeout: int=3):
-    # if one job is currently executing the function, wait for it to finish
-    async with cache_locks[function]:
-        current_time = datetime.datetime.now()
-        if function not in cache_contents.keys():
-            return await cache_force_add(function, current_time)
-
-        cache_entry = cache_contents[function]
-        
-        if cache_entry.is_obsolete(current_time, timeout):
-            return await cache_force_add(function, current_time)
-
-        return cache_entry.contents
\ No newline at end of file
+class LookupEntry:
+    expires: float
+    value: Any
+
+
+class LookupCache:
+    """LRU cache of the results of `lookup(key)`, each kept for `ttl` seconds,
+    holding at most `max_entries` results.
+
+    Concurrent `get`s of a key that is not cached share a single call to
+    `lookup`, e.g. when many pages of the same job are opened at once. Failed
+    lookups are not cached, but their concurrent callers all get the error."""
+
+    def __init__(self, lookup: Callable[[Hashable], Awaitable[Any]], ttl: float=10, max_entries: int=256):
+        self.lookup = lookup
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.entries: "OrderedDict[Hashable, LookupEntry]" = OrderedDict()
+        self.pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, key: Hashable) -> Any:
+        entry = self.entries.get(key)
+
+        if entry is not None and entry.expires > time.monotonic():
+            self.entries.move_to_end(key)
+            job_lookups.labels("hit").inc()
+            return entry.value
+
+        future = self.pending.get(key)
+
+        if future is None:
+            job_lookups.labels("miss").inc()
+            future = self.pending[key] = asyncio.ensure_future(self.lookup(key))
+            future.add_done_callback(functools.partial(self.on_lookup_done, key))
+        else:
+            job_lookups.labels("coalesced").inc()
+
+        # a caller giving up, e.g. a closed page, must not cancel the others
+        return await asyncio.shield(future)
+
+    def on_lookup_done(self, key: Hashable, future: asyncio.Future):
+        del self.pending[key]
+
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        self.entries.pop(key, None)
+        self.entries[key] = LookupEntry(time.monotonic() + self.ttl, future.result())
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+def no_snapshot_error(error: str) -> web.HTTPServiceUnavailable:
+    return web.HTTPServiceUnavailable(
+        text=f"Slurm could not be queried yet: {error}",
+        headers={"Retry-After": "30"}
+    )
+
+class SnapshotPoller:
+    """Keeps the result of `query` up to date from a background task.
+    `query` is passed the previous snapshot, or `None` for the first one.
+
+    `get` always returns the latest snapshot immediately, even while a refresh
+    is in progress. When no request was made for `idle_timeout` seconds, the
+    polling interval doubles up to `idle_interval` to avoid loading slurmctld
+    for nothing; the next request gets the (stale) latest snapshot and wakes
+    the poller up for an immediate refresh.
+
+    When a refresh fails, e.g. while slurmctld is unresponsive, the previous
+    snapshot is kept and `last_error` tells pages that it is stale.
+
+    `name` is the name of the polled cluster when monitoring several ones."""
+
+    def __init__(self, query: Callable[[Any], Any], interval: float=3, idle_interval: float=60, idle_timeout: float=120, name: str=""):
+        self.query = query
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.idle_timeout = idle_timeout
+        self.name = name
+
+        self.snapshot = None
+        self.listeners: List[Callable[[Any], None]] = []
+        self.current_interval = interval
+        self.last_access = datetime.datetime.now()
+
+        # outcome of the last refresh, shown to users when it failed
+        self.last_error: Optional[str] = None
+        self.last_refresh_time: Optional[datetime.datetime] = None
+        self.last_refresh_seconds: Optional[float] = None
+
+        # set once the first refresh ended, whether it succeeded or failed
+        self.attempted = None
+        self.wakeup = None
+        self.task = None
+
+    def is_idle(self, current_time) -> bool:
+        return current_time > self.last_access + datetime.timedelta(seconds=self.idle_timeout)
+
+    def touch(self):
+        """Marks the snapshot as used, waking the poller up if it was idle."""
+        self.last_access = datetime.datetime.now()
+
+        if self.current_interval > self.interval:
+            self.current_interval = self.interval
+            self.wakeup.set()
+
+    async def get(self):
+        self.touch()
+
+        if self.snapshot is None:
+            if self.last_error is None:
+                with snapshot_wait_seconds.time():
+                    await self.attempted.wait()
+
+            if self.snapshot is None:
+                # rather than holding requests until Slurm recovers
+                raise no_snapshot_error(self.last_error)
+
+        return self.snapshot
+
+    async def wait_first_refresh(self):
+        """Waits until the first refresh succeeded or failed."""
+        await self.attempted.wait()
+
+    async def refresh(self):
+        previous = self.snapshot
+        start = time.perf_counter()
+
+        self.snapshot = await self.query(previous)
+
+        self.last_refresh_seconds = time.perf_counter() - start
+        self.last_refresh_time = datetime.datetime.now()
+        self.last_error = None
+
+        snapshot_refresh_seconds.labels(self.name).observe(self.last_refresh_seconds)
+        snapshot_refresh_timestamp.labels(self.name).set(time.time())
+
+        if self.snapshot is not previous:
+            for listener in self.listeners:
+                listener(self.snapshot)
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                snapshot_refresh_failures.labels(self.name).inc()
+
+                # a controller that is down fails every refresh the same way
+                message = f"Snapshot refresh failed{' for ' + self.name if self.name else ''}, keeping the previous snapshot"
+                if error != self.last_error:
+                    logging.exception(message)
+                else:
+                    logging.warning(f"{message}: {error}")
+
+                self.last_error = error
+
+            self.attempted.set()
+
+            if self.is_idle(datetime.datetime.now()):
+                self.current_interval = min(self.current_interval * 2, self.idle_interval)
+            else:
+                self.current_interval = self.interval
+
+            self.wakeup.clear()
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.current_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def cleanup_ctx(self, app):
+        # created here to be bound to the server's event loop
+        self.attempted = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+        yield
+
+        self.task.cancel()
+
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class MultiClusterPoller:
+    """Merges the snapshots of one `SnapshotPoller` per cluster, and exposes
+    the merged snapshot like a single `SnapshotPoller` would.
+
+    Clusters are polled independently: a failing cluster keeps its last
+    snapshot and a slow one does not delay the others. Only the first
+    requests wait, up to `startup_timeout` seconds, for all clusters to
+    answer; afterwards, clusters without any snapshot yet are left out."""
+
+    def __init__(self, pollers: List[SnapshotPoller], startup_timeout: float=10):
+        self.pollers = pollers
+        self.startup_timeout = startup_timeout
+
+        self.snapshot = None
+        self.listeners: List[Callable[[Any], None]] = []
+        self.started = None
+
+        for poller in pollers:
+            poller.listeners.append(self.on_cluster_snapshot)
+
+    def on_cluster_snapshot(self, changed):
+        version = self.snapshot.version + 1 if self.snapshot is not None else 1
+        snapshots = [poller.snapshot for poller in self.pollers if poller.snapshot is not None]
+
+        self.snapshot = merge_snapshots(version, snapshots, changed)
+
+        for listener in self.listeners:
+            listener(self.snapshot)
+
+    async def get(self):
+        for poller in self.pollers:
+            poller.touch()
+
+        # clusters whose first refresh is still running
+        starting = [poller for poller in self.pollers if poller.snapshot is None and poller.last_error is None]
+        remaining = self.started + self.startup_timeout - time.monotonic()
+
+        if len(starting) > 0 and (self.snapshot is None or remaining > 0):
+            with snapshot_wait_seconds.time():
+                pending = {asyncio.ensure_future(poller.attempted.wait()) for poller in starting}
+
+                try:
+                    if remaining > 0:
+                        _, pending = await asyncio.wait(pending, timeout=remaining)
+
+                    # all clusters are slower than the startup timeout: the
+                    # first one answering is enough, unless they all fail
+                    while self.snapshot is None and len(pending) > 0:
+                        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in pending:
+                        task.cancel()
+
+        if self.snapshot is None:
+            errors = [poller.last_error for poller in self.pollers if poller.last_error is not None]
+            raise no_snapshot_error(errors[0] if len(errors) > 0 else "no cluster answered")
+
+        return self.snapshot
+
+    async def wait_first_refresh(self):
+        await asyncio.gather(*(poller.wait_first_refresh() for poller in self.pollers))
+
+    async def cleanup_ctx(self, app):
+        self.started = time.monotonic()
+        yield
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Whether `etag` matches the `If-None-Match` header of `request`."""
+    if request.if_none_match is None:
+        return False
+
+    return any(tag.value in (etag, "*") for tag in request.if_none_match)
+
+
+
+def normalize_query(query) -> Tuple[Tuple[str, str], ...]:
+    """Normalizes query parameters so that equivalent filters, e.g.
+    `state=RUNNING,PENDING` and `state=PENDING,RUNNING`, compare equal."""
+    return tuple(sorted(
+        (key, ",".join(sorted(set(value.split(",")))))
+        for key, value in query.items()
+    ))
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """The quality value of each content encoding of an `Accept-Encoding`
+    header, e.g. `{"br": 0.0, "gzip": 1.0}` for `br;q=0, gzip`."""
+    qualities = {}
+
+    for item in header.split(","):
+        encoding, *parameters = item.split(";")
+        encoding = encoding.strip().lower()
+
+        if not encoding:
+            continue
+
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    # ignore malformed quality values rather than guessing
+                    quality = 0.0
+
+        qualities[encoding] = quality
+
+    return qualities
+
+
+@dataclass
+class CachedPage:
+    content_type: str
+
+    # by content encoding, "identity" being the uncompressed body
+    bodies: Dict[str, bytes]
+
+    @staticmethod
+    def compress(content_type: str, body: bytes) -> "CachedPage":
+        bodies = {
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=6)
+        }
+
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, quality=5)
+
+        for encoding, encoded in bodies.items():
+            page_body_bytes.labels(encoding).observe(len(encoded))
+
+        return CachedPage(content_type, bodies)
+
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def response(self, request) -> web.Response:
+        qualities = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+
+        def quality(encoding: str) -> float:
+            # "*" stands for the encodings the client does not list
+            return qualities.get(encoding, qualities.get("*", 0.0))
+
+        # the preferred encoding of the client, brotli on ties, q=0 refusing one
+        encoding = max(
+            (encoding for encoding in ("br", "gzip") if encoding in self.bodies and quality(encoding) > 0),
+            key=quality, default="identity"
+        )
+
+        response = web.Response(content_type=self.content_type, body=self.bodies[encoding])
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+
+        sent_page_bytes.labels(encoding).inc(len(self.bodies[encoding]))
+
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class PageCache:
+    """LRU cache of rendered pages, bounded by the total size of their bodies."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.pages: "OrderedDict[Hashable, CachedPage]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CachedPage]:
+        page = self.pages.get(key)
+
+        if page is not None:
+            self.pages.move_to_end(key)
+
+        page_cache_requests.labels("hit" if page is not None else "miss").inc()
+        return page
+
+    def put(self, key: Hashable, page: CachedPage):
+        if key in self.pages:
+            self.total_bytes -= self.pages.pop(key).size()
+
+        self.pages[key] = page
+        self.total_bytes += page.size()
+
+        while self.total_bytes > self.max_bytes and len(self.pages) > 0:
+            _, evicted = self.pages.popitem(last=False)
+            self.total_bytes -= evicted.size()
+            page_cache_evictions.inc()
+
+    def render(self, key: Hashable, content_type: str, render: Callable[[], str]) -> CachedPage:
+        page = CachedPage.compress(content_type, render().encode("utf-8"))
+        self.put(key, page)
+        return page
+
+    def get_or_render(self, key: Hashable, content_type: str, render: Callable[[], str]) -> CachedPage:
+        page = self.get(key)
+
+        if page is None:
+            page = self.render(key, content_type, render)
+
+        return page
+
+
+async def stream_response(request, content_type: str, chunks: Iterable[str]) -> web.StreamResponse:
+    """Sends `chunks` as a chunked response as they are produced, rather than
+    building the whole body in memory first. The event loop gets to run
+    between chunks."""
+    response = web.StreamResponse(headers={
+        "Content-Type": f"{content_type}; charset=utf-8",
+        "Vary": "Accept-Encoding",
+    })
+    response.enable_chunked_encoding()
+    response.enable_compression()
+    await response.prepare(request)
+
+    for chunk in chunks:
+        await response.write(chunk.encode("utf-8"))
+
+    await response.write_eof()
+    return response
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from api import encode_json
+
+# bumped on incompatible changes of the document layout
+store_format = 1
+
+
+class SnapshotPublisher:
+    """Publishes the snapshots of `pollers` to the file `path`, so that other
+    swatch instances on the same machine can read them with the `shared`
+    backend instead of querying Slurm themselves.
+
+    The document is JSON, never pickle, so that readers do not have to trust
+    the publisher. It holds the raw fields of each job and node, which readers
+    turn into states like the other backends do. Each write goes to a
+    temporary file that then replaces `path`, so readers always see a complete
+    document. A refresh that changed nothing only updates the modification
+    time of `path`, which readers use to tell that the publisher is alive.
+
+    Encoding and writing run on a dedicated thread. Jobs and nodes whose state
+    did not change since the previous write reuse their encoded JSON."""
+
+    def __init__(self, path: str, pollers: List[Any], interval: float=3, stale_after: float=60):
+        self.path = path
+        self.pollers = pollers
+        self.interval = interval
+        self.stale_after = stale_after
+
+        self.version = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publisher")
+
+        # by (cluster, entity), then by key: the state and its encoded fields
+        self.fragments: Dict[Tuple[str, str], Dict[str, Tuple[Any, bytes]]] = {}
+
+        # per poller, what was last written and when it was last refreshed
+        self.published: List[Tuple[Any, Optional[str]]] = []
+        self.refresh_times: List[Any] = []
+
+        self.changed = None
+        self.task = None
+
+        for poller in pollers:
+            poller.listeners.append(self.on_snapshot)
+
+    def on_snapshot(self, snapshot):
+        if self.changed is not None:
+            self.changed.set()
+
+    def encode_states(self, cluster: str, entity: str, states: Dict[str, Any]) -> bytes:
+        previous = self.fragments.get((cluster, entity), {})
+        fragments = {}
+
+        for key, state in states.items():
+            entry = previous.get(key)
+
+            if entry is None or entry[0] is not state:
+                entry = (state, encode_json(dict(state.fields)))
+
+            fragments[key] = entry
+
+        self.fragments[(cluster, entity)] = fragments
+        return b"[" + b",".join(fragment for _, fragment in fragments.values()) + b"]"
+
+    def encode(self, status: List[Tuple[Any, Optional[str]]]) -> bytes:
+        clusters = []
+
+        for poller, (snapshot, error) in zip(self.pollers, status):
+            if snapshot is None:
+                continue
+
+            clusters.append(b"".join([
+                b'{"name":', encode_json(poller.name or None),
+                b',"time":', encode_json(snapshot.time.timestamp()),
+                b',"error":', encode_json(error),
+                b',"jobs":', self.encode_states(poller.name, "jobs", snapshot.jobs),
+                b',"nodes":', self.encode_states(poller.name, "nodes", snapshot.nodes),
+                b"}"
+            ]))
+
+        return b"".join([
+            b'{"format":', str(store_format).encode(),
+            b',"version":', str(self.version).encode(),
+            b',"stale_after":', encode_json(self.stale_after),
+            b',"clusters":[', b",".join(clusters), b"]}"
+        ])
+
+    def write(self, status: List[Tuple[Any, Optional[str]]]):
+        # only needed by publishers, see `SharedStoreReader` for the others
+        import tempfile
+
+        body = self.encode(status)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".swatch-", suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+
+            # readable by the other users' instances
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    async def publish(self):
+        status = [(poller.snapshot, poller.last_error) for poller in self.pollers]
+        refresh_times = [poller.last_refresh_time for poller in self.pollers]
+        loop = asyncio.get_running_loop()
+
+        changed = len(status) != len(self.published) or any(
+            snapshot is not published_snapshot or error != published_error
+            for (snapshot, error), (published_snapshot, published_error) in zip(status, self.published)
+        )
+
+        if changed:
+            self.version += 1
+            await loop.run_in_executor(self.executor, self.write, status)
+            self.published = status
+        elif refresh_times != self.refresh_times:
+            await loop.run_in_executor(self.executor, os.utime, self.path)
+
+        self.refresh_times = refresh_times
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.changed.clear()
+
+            if all(poller.snapshot is None for poller in self.pollers):
+                continue
+
+            try:
+                await self.publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f"Failed to publish the snapshot to {self.path}")
+
+    async def cleanup_ctx(self, app):
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+        yield
+
+        self.task.cancel()
+
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        self.executor.shutdown()
+
+
+class SharedStoreReader:
+    """Reads the document written by a `SnapshotPublisher`. The file is only
+    read again once replaced by a newer version, i.e. when its inode changed,
+    and concurrent readers share the same read.
+
+    The last read file is kept open: otherwise, its inode could be reused by
+    a later version, which would then go unnoticed."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self.file = None
+        self.inode = None
+        self.document: Optional[Dict[str, Any]] = None
+        self.lock = None
+
+    def load(self) -> Tuple[Any, Dict[str, Any]]:
+        f = open(self.path, "rb")
+
+        try:
+            document = json.load(f)
+        except BaseException:
+            f.close()
+            raise
+
+        if document.get("format") != store_format:
+            f.close()
+            raise ValueError(f"{self.path} uses format {document.get('format')}, expected {store_format}")
+
+        return f, document
+
+    async def read(self) -> Tuple[int, Dict[str, Any], float]:
+        """Returns the inode of the current document, the document, and how
+        many seconds ago it was last written or confirmed by the publisher."""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            stat = os.stat(self.path)
+
+            if stat.st_ino != self.inode:
+                f, self.document = await asyncio.get_running_loop().run_in_executor(None, self.load)
+
+                if self.file is not None:
+                    self.file.close()
+
+                self.file = f
+                self.inode = os.fstat(f.fileno()).st_ino
+
+            return self.inode, self.document, time.time() - stat.st_mtime
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
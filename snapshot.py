@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import heapq
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from jobstate import *
+from nodestate import *
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Consistent view of the cluster state at a given time.
+    Snapshots are never modified once built: a refresh produces a new one with
+    a greater `version`."""
+
+    version: int
+    time: datetime.datetime
+
+    jobs: Dict[str, JobState]
+    nodes: Dict[str, NodeState]
+
+    # sorted with `make_job_sort_key`
+    sorted_jobs: List[JobState]
+    jobs_by_node: Dict[str, List[JobState]]
+
+    # changes since the previous snapshot, by job id/node name
+    job_diff: ParseDiff
+    node_diff: ParseDiff
+
+    derived: Dict[str, Any] = field(default_factory=dict, compare=False, repr=False)
+
+    def derive(self, key: str, build: Callable[["Snapshot"], Any]) -> Any:
+        """Returns `build(self)`, only computed on the first call for `key`.
+        Use this for data that is expensive to compute from the snapshot and
+        that can be shared by all requests using it."""
+        try:
+            return self.derived[key]
+        except KeyError:
+            value = build(self)
+            self.derived[key] = value
+            return value
+
+
+def build_snapshot(
+    version: int,
+    time: datetime.datetime,
+    jobs: Dict[str, JobState],
+    nodes: Dict[str, NodeState],
+    job_diff: ParseDiff,
+    node_diff: ParseDiff
+) -> Snapshot:
+    sorted_jobs = sorted(jobs.values(), key=make_job_sort_key())
+
+    return Snapshot(
+        version=version,
+        time=time,
+        jobs=jobs,
+        nodes=nodes,
+        sorted_jobs=sorted_jobs,
+        jobs_by_node=index_jobs_by_node(sorted_jobs),
+        job_diff=job_diff,
+        node_diff=node_diff
+    )
+
+
+async def query_snapshot(backend, previous: Optional[Snapshot]) -> Snapshot:
+    """Queries the current cluster state from `backend` (see `backends.py`).
+    When nothing changed since `previous`, `previous` is returned as is."""
+    time = datetime.datetime.now()
+
+    (nodes, node_diff), (jobs, job_diff) = await asyncio.gather(
+        backend.query_nodes(),
+        backend.query_jobs()
+    )
+
+    if previous is not None and job_diff.is_empty() and node_diff.is_empty():
+        return previous
+
+    version = previous.version + 1 if previous is not None else 1
+
+    return build_snapshot(version, time, jobs, nodes, job_diff, node_diff)
+
+
+def merge_snapshots(version: int, snapshots: List[Snapshot], changed: Snapshot) -> Snapshot:
+    """Merges the latest snapshots of several clusters, whose keys never
+    collide (see `qualify`). `changed` is the one that was just refreshed:
+    the merged diffs are its diffs, as the other clusters did not change
+    since the previous merge."""
+    jobs = {}
+    nodes = {}
+    jobs_by_node = {}
+
+    for snapshot in snapshots:
+        jobs.update(snapshot.jobs)
+        nodes.update(snapshot.nodes)
+        jobs_by_node.update(snapshot.jobs_by_node)
+
+    return Snapshot(
+        version=version,
+        time=max(snapshot.time for snapshot in snapshots),
+        jobs=jobs,
+        nodes=nodes,
+        sorted_jobs=list(heapq.merge(*(snapshot.sorted_jobs for snapshot in snapshots), key=make_job_sort_key())),
+        jobs_by_node=jobs_by_node,
+        job_diff=changed.job_diff,
+        node_diff=changed.node_diff
+    )
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import time
+
+# startup phases are measured from here, see prewarm
+startup_time = time.perf_counter()
+
 import logging
-from typing import Any, Callable
+from typing import Any, Callable, Dict, List, Optional
 
 logging.basicConfig(
     level=logging.INFO, 
@@ -18,16 +23,94 @@ from mako.lookup import TemplateLookup
 
 from jobstate import *
 from nodestate import *
-from serverutil import simple_cache
-
+from snapshot import *
+from filters import *
+from serverutil import SnapshotPoller, MultiClusterPoller, LookupCache, PageCache, etag_matches, normalize_query, stream_response
+from api import *
+from live import LiveUpdates
+from pagination import JobPage, paginate_jobs
+from arrays import group_job_arrays, wants_grouped_arrays
+from partitions import get_partition_summaries
+from fit import find_fits, get_free_resource_index, parse_resource_request
+from leanrows import LeanJobRows, wants_lean_html
+from query import compile_node_query
+from history import HistoryStore, HistoryRecorder, Resolution, parse_duration, parse_history_query
+from jobhistory import JobHistoryStore, JobHistoryPoller, paginate_job_history
+from backends import BackendError, backend_names, make_backend, parse_clusters
+from scontrol import CircuitBreaker, ProcessSlots, ScontrolRunner, SlurmUnavailableError
+from logs import default_tail_bytes, follow_log, get_log_path, log_streams, open_log, read_chunks, resolve_range
+from sharedstore import SharedStoreReader, SnapshotPublisher
+from metrics import registry, startup_seconds, template_render_seconds, api_body_bytes, log_followers
+
+import asyncio
+import functools
 import logging
+import signal
 import stat
 from pathlib import Path
 
+startup_seconds.labels("imports").set(time.perf_counter() - startup_time)
+logging.info(f"Imported libraries in {time.perf_counter() - startup_time:.2f}s")
+
 parser = ArgumentParser()
 parser.add_argument("--port", type=int, default=51024)
+parser.add_argument("--refresh-interval", type=float, default=3, help="Seconds between two Slurm state refreshes")
+parser.add_argument("--idle-refresh-interval", type=float, default=60, help="Maximum seconds between two refreshes when nobody is using the server")
+parser.add_argument("--page-cache-size", type=float, default=64, help="Maximum size in MB of the rendered page cache")
+parser.add_argument("--job-cache-ttl", type=float, default=10, help="Seconds a job looked up by /job/<id> is reused before querying Slurm again")
+parser.add_argument("--job-cache-size", type=int, default=256, help="Maximum jobs kept by the /job/<id> lookup cache")
+parser.add_argument("--columnar", action="store_true", help="Filter jobs using a columnar copy of each snapshot, faster on large clusters")
+parser.add_argument("--idle-timeout", type=float, default=120, help="Seconds without requests after which refreshes start backing off")
+parser.add_argument("--jobs-per-page", type=int, default=1000, help="Jobs per page of the job list by default, 0 for no pagination")
+parser.add_argument("--lean-html", action="store_true", help="Send the rows of job tables as compact JSON rendered by the browser, for much smaller pages on large clusters. Pages can also be asked for with ?lean=1 or ?lean=0")
+parser.add_argument("--stream-threshold", type=int, default=2000, help="Job list pages with more rows than this are streamed as they are rendered instead of cached")
+parser.add_argument("--history-db", default="", help="SQLite database storing the utilization history, e.g. history.db. Disabled by default")
+parser.add_argument("--history-interval", type=float, default=30, help="Seconds between two utilization history samples")
+parser.add_argument("--history-retention", default="6h,3d,365d", help="How long to keep raw samples, 1 minute and 1 hour averages of the utilization history")
+parser.add_argument("--job-history-db", default="", help="SQLite database keeping the jobs that ended, as reported by sacct, for /jobs?history=24h. Disabled by default")
+parser.add_argument("--job-history-interval", type=float, default=60, help="Seconds between two sacct queries for the jobs that ended")
+parser.add_argument("--job-history-retention", default="7d", help="How long to keep the jobs that ended in the job history")
+parser.add_argument("--sacct-path", default="sacct", help="sacct executable used by the job history")
+parser.add_argument("--backend", choices=backend_names, default="text", help="How to query Slurm: scontrol text output, scontrol JSON output (Slurm 21.08+) or slurmrestd")
+parser.add_argument("--scontrol-path", default="scontrol", help="scontrol executable used by the text and json backends")
+parser.add_argument("--slurmrestd-url", help="slurmrestd URL for the rest backend, e.g. http://localhost:6820 or unix:/path/to/slurmrestd.socket")
+parser.add_argument("--slurmrestd-api-version", default="v0.0.39", help="slurmrestd OpenAPI plugin version to use")
+parser.add_argument("-M", "--clusters", help="Comma-separated clusters to monitor together. Each is NAME (queried with scontrol -M NAME), NAME=SCONTROL (queried with its own scontrol command, e.g. a wrapper setting SLURM_CONF) or, with the rest backend, NAME=URL of its slurmrestd")
+parser.add_argument("--cluster-startup-timeout", type=float, default=10, help="Seconds the first requests wait for slow clusters before showing the other ones")
+parser.add_argument("--slurm-timeout", type=float, default=30, help="Seconds after which scontrol is killed, or a slurmrestd request abandoned")
+parser.add_argument("--scontrol-concurrency", type=int, default=4, help="Maximum scontrol processes running at once, across all clusters")
+parser.add_argument("--max-backoff", type=float, default=300, help="Maximum seconds between two attempts to query a cluster whose controller keeps failing or timing out")
+parser.add_argument("--publish", metavar="PATH", help="Also write each snapshot to PATH, for the other swatch instances of this machine started with --backend shared --shared-store PATH")
+parser.add_argument("--collect-only", action="store_true", help="With --publish, only query Slurm and publish snapshots, without serving pages")
+parser.add_argument("--shared-store", metavar="PATH", help="Snapshot file read by the shared backend, written by another instance's --publish")
+parser.add_argument("--template-cache", default=".template-cache", help="Directory keeping the compiled templates between restarts, empty to compile them on each start")
 args = parser.parse_args()
 
+try:
+    clusters = parse_clusters(args.clusters) if args.clusters is not None else []
+except ValueError as e:
+    parser.error(str(e))
+
+if args.scontrol_concurrency < 1 or args.slurm_timeout <= 0:
+    parser.error("--scontrol-concurrency and --slurm-timeout must be positive")
+
+if args.backend == "shared":
+    if args.shared_store is None:
+        parser.error("--backend shared requires --shared-store")
+
+    if args.publish is not None:
+        parser.error("--publish cannot republish a shared store")
+
+if args.collect_only and args.publish is None:
+    parser.error("--collect-only requires --publish")
+
+if args.backend == "rest":
+    if len(clusters) == 0 and args.slurmrestd_url is None:
+        parser.error("--backend rest requires --slurmrestd-url")
+
+    if any(target is None for _, target in clusters):
+        parser.error("--backend rest requires a slurmrestd URL for each cluster, e.g. -M name=http://host:6820")
+
 class PasswordDefinitionException(Exception):
     pass
 
@@ -54,110 +137,677 @@ def get_auth_secret() -> str:
 
     return auth_secret
 
-auth_secret = get_auth_secret()
+# collectors do not serve pages
+auth_secret = get_auth_secret() if not args.collect_only else None
 
 lookup = TemplateLookup(
     directories=["html/"],
-    default_filters=["h"]
+    default_filters=["h"],
+    # compiled templates are reused as long as their source did not change
+    module_directory=args.template_cache or None
 )
 
-def combine_filters(filters):
-    return lambda x: all(fn(x) for fn in filters)
+def compile_templates():
+    for path in sorted(Path("html").rglob("*.html")):
+        lookup.get_template(path.relative_to("html").as_posix())
+
+page_cache = PageCache(max_bytes=int(args.page_cache_size * 1024 * 1024))
+
+def get_page_key(view: str, snapshot: Snapshot, request: web.Request):
+    # pages show which clusters are failing, which does not change the snapshot
+    cluster_health = tuple((poller.snapshot is not None, poller.last_error is None) for poller in status_pollers)
+    return (view, snapshot.version, normalize_query(request.query), cluster_health, get_login())
+
+async def get_snapshot(request: web.Request) -> Snapshot:
+    """Latest snapshot of the cluster selected by the `cluster` query
+    parameter when it selects a single one, merged snapshot otherwise."""
+    if "cluster" not in request.query:
+        return await poller.get()
 
-def get_state_rank(state: str):
+    names = request.query["cluster"].split(",")
+    unknown = [name for name in names if name not in cluster_pollers_by_name]
+
+    if len(unknown) > 0:
+        raise web.HTTPBadRequest(text=f"Unknown cluster {unknown[0]!r}")
+
+    if len(names) == 1:
+        return await cluster_pollers_by_name[names[0]].get()
+
+    return await poller.get()
+
+def get_page_kwargs(request: web.Request) -> Dict[str, Any]:
+    """Template arguments used by all pages."""
     return {
-        "CANCELLED": 0,
-        "NODE_FAIL": 1,
-        "FAILED": 2,
-        "TIMEOUT": 3,
-        "OUT_OF_MEMORY": 4,
-        "COMPLETING": 5,
-        "RUNNING": 10,
-        "COMPLETED": 20
-    }.get(state, -1)
-
-def make_job_sort_key():
-    def job_sorter(job: JobState):
-        return (
-            -job.is_mine(),
-            get_state_rank(job.job_state),
-            job.partition,
-            -job.job_id
+        "clusters": cluster_pollers,
+        "stale_pollers": [poller for poller in status_pollers if poller.snapshot is not None and poller.last_error is not None],
+        "history_enabled": history_store is not None,
+        "job_history_enabled": job_history_store is not None,
+        "request_query": request.query,
+        # titles of the tooltips used by the page by id, see tooltip.html
+        "page_tooltips": {},
+        # rows of job tables, sent as JSON rather than rendered, see leanrows.py
+        "lean_rows": LeanJobRows() if wants_lean_html(request.query, args.lean_html) else None,
+    }
+
+def render_template(name: str, def_name: Optional[str]=None, **kwargs) -> str:
+    """Renders a template, or one of its defs, timing it for `/metrics`."""
+    template = lookup.get_template(name)
+
+    with template_render_seconds.labels(name if def_name is None else f"{name}#{def_name}").time():
+        if def_name is not None:
+            return template.get_def(def_name).render(**kwargs)
+
+        return template.render(**kwargs)
+
+def render_job_page_chunks(page: JobPage, snapshot_version: int, page_kwargs: Dict[str, Any], rows_per_chunk: int=500):
+    """Renders the job page in chunks of `rows_per_chunk` rows, as
+    `joblist.html` would render it as a whole."""
+    yield render_template("joblist.html", "page_start", page=page, **page_kwargs)
+
+    for start in range(0, len(page.jobs), rows_per_chunk):
+        yield render_template("include/jobutil.html", "make_job_rows", jobs=page.jobs[start:start + rows_per_chunk], page_tooltips=page_kwargs["page_tooltips"])
+
+    yield render_template("joblist.html", "page_end", page=page, snapshot_version=snapshot_version, **page_kwargs)
+
+def get_queried_partitions(snapshot: Snapshot, query) -> List[Any]:
+    """Summaries of the partitions selected by the `partition` and `cluster`
+    query parameters, none if no partition was selected."""
+    if "partition" not in query:
+        return []
+
+    filters = compile_node_query(query)
+
+    return [
+        partition for partition in get_partition_summaries(snapshot).values()
+        if all(field_filter.matches(partition.cluster if key == "cluster" else partition.name) for key, field_filter in filters)
+    ]
+
+async def list_jobs(request: web.Request):
+    """Jobs of the snapshot, or with `history`, the jobs that ended within
+    that range, e.g. `24h`, as recorded by the job history."""
+    snapshot = await get_snapshot(request)
+    history = "history" in request.query
+
+    if history and job_history_store is None:
+        raise web.HTTPNotFound(text="The job history is disabled (see --job-history-db)")
+
+    # the job history changes independently of the snapshots
+    key = get_page_key("jobs" if not history else f"jobs/history/{job_history_store.version}", snapshot, request)
+
+    cached_page = page_cache.get(key)
+    if cached_page is not None:
+        return cached_page.response(request)
+
+    try:
+        if history:
+            page = await paginate_job_history(job_history_store, request.query, default_per_page=args.jobs_per_page or None)
+        else:
+            jobs = select_jobs(snapshot, request.query, columnar=args.columnar)
+            page = paginate_jobs(
+                snapshot, jobs, request.query,
+                default_per_page=args.jobs_per_page or None,
+                group_arrays=wants_grouped_arrays(request.query)
+            )
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+    page_kwargs = dict(get_page_kwargs(request), partitions=get_queried_partitions(snapshot, request.query))
+
+    if len(page.jobs) > args.stream_threshold and page_kwargs["lean_rows"] is None:
+        # too large to be worth caching: send rows as they are rendered. Lean
+        # pages are much smaller, and only send their rows at the end
+        return await stream_response(request, "text/html", render_job_page_chunks(page, snapshot.version, page_kwargs))
+
+    def render():
+        return render_template("joblist.html", page=page, snapshot_version=snapshot.version, **page_kwargs)
+
+    # the lookup above already missed
+    return page_cache.render(key, "text/html", render).response(request)
+
+async def list_nodes(request: web.Request):
+    snapshot = await get_snapshot(request)
+
+    def render():
+        node_filters = list(generate_node_filters(request.query))
+        partitions = list(get_partition_summaries(snapshot).values())
+        node_keys = None
+
+        if len(node_filters) > 0:
+            node_filter = combine_filters(node_filters)
+            node_keys = {node.key for node in snapshot.nodes.values() if node_filter(node)}
+            partitions = [partition for partition in partitions if any(node.key in node_keys for node in partition.nodes)]
+
+        jobs = select_jobs(snapshot, request.query, columnar=args.columnar)
+
+        job_keys = {job.key for job in jobs}
+        job_filter = lambda job: job.key in job_keys
+
+        return render_template(
+            "nodelist.html",
+            partitions=partitions,
+            node_keys=node_keys,
+            group_arrays=wants_grouped_arrays(request.query),
+            jobs_by_node=snapshot.jobs_by_node,
+            job_filter=job_filter,
+            snapshot_version=snapshot.version,
+            **get_page_kwargs(request)
         )
 
-    return job_sorter
+    page = page_cache.get_or_render(get_page_key("nodes", snapshot, request), "text/html", render)
+    return page.response(request)
 
-def generate_job_filters(query):
-    if "partition" in query:
-        yield lambda job: job.partition in query["partition"].split(",")
+async def list_array_rows(request: web.Request):
+    """Row of the job array selected by `array`, or the rows of its tasks
+    with `tasks=1`, for pages to expand arrays and to follow their changes.
+    The other query parameters filter the tasks like on `/jobs`."""
+    snapshot = await get_snapshot(request)
 
-    if "state" in query:
-        yield lambda job: job.job_state in query["state"].split(",")
+    if "array" not in request.query:
+        raise web.HTTPBadRequest(text="array is required")
 
-    if "node" in query:
-        yield lambda job: job.nodes is not None and not set(query["node"].split(",")).isdisjoint(job.nodes)
+    def render():
+        jobs = select_jobs(snapshot, request.query, columnar=args.columnar)
+        rows = jobs if request.query.get("tasks") == "1" else group_job_arrays(jobs)
+        html = render_template("include/jobutil.html", "make_job_rows", jobs=rows)
 
-    if "user" in query:
-        yield lambda job: job.user_name in query["user"].split(",")
+        return encode_json({"rows": html, "tooltips": live_updates.get_tooltip_titles([html])}).decode("utf-8")
 
-async def list_jobs(request: web.Request):
-    job_filter = combine_filters(list(generate_job_filters(request.query)))
+    page = page_cache.get_or_render(get_page_key("array-rows", snapshot, request), "application/json", render)
+    return page.response(request)
+
+# distinguishes snapshot versions of different server processes
+process_tag = f"{int(time.time()):x}"
 
-    jobs = await simple_cache(query_jobs)
-    jobs = jobs.values()
-    jobs = list(filter(job_filter, jobs))
-    jobs = sorted(jobs, key=make_job_sort_key())
+async def api_response(request: web.Request, encode: Callable[[Snapshot], bytes]):
+    snapshot = await get_snapshot(request)
 
-    table_template = lookup.get_template("joblist.html")
+    # versions of different clusters and of the merged snapshot are unrelated
+    etag = f"{process_tag}-{request.query.get('cluster', '')}-{snapshot.version}"
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers={"ETag": f'"{etag}"'})
 
-    response = web.Response(content_type="text/html", body=table_template.render(jobs=jobs))
+    body = encode(snapshot)
+    api_body_bytes.labels(request.path).observe(len(body))
+
+    response = web.Response(content_type="application/json", body=body)
+    response.etag = etag
+    response.headers["Cache-Control"] = "no-cache"
     response.enable_compression()
     return response
 
-def generate_node_filters(query):
-    if "partition" in query:
-        yield lambda node: not set(query["partition"].split(",")).isdisjoint(node.partitions)
+async def api_list_jobs(request: web.Request):
+    return await api_response(
+        request,
+        lambda snapshot: encode_jobs(snapshot, select_jobs(snapshot, request.query, columnar=args.columnar))
+    )
 
-async def list_nodes(request: web.Request):
+async def api_list_nodes(request: web.Request):
     node_filter = combine_filters(list(generate_node_filters(request.query)))
-    job_filter = combine_filters(list(generate_job_filters(request.query)))
 
-    nodes, jobs = await asyncio.gather(
-        simple_cache(query_nodes),
-        simple_cache(query_jobs)
+    return await api_response(
+        request,
+        lambda snapshot: encode_nodes(snapshot, list(filter(node_filter, snapshot.nodes.values())))
     )
 
-    nodes = nodes.values()
-    nodes = list(filter(node_filter, nodes))
+async def api_list_partitions(request: web.Request):
+    partition_names = request.query["partition"].split(",") if "partition" in request.query else None
 
-    jobs = jobs.values()
-    jobs = filter(job_filter, jobs)
-    jobs = sorted(jobs, key=make_job_sort_key())
-    jobs = list(jobs)
+    return await api_response(
+        request,
+        lambda snapshot: encode_partitions(snapshot, partition_names)
+    )
+
+# query parameters of a resource request, see `parse_resource_request`
+resource_request_keys = ("cpus", "memory", "gpus", "gpu_type", "features", "nodes")
+
+async def show_fit(request: web.Request):
+    """Form asking for the resources of a job, and the partitions and nodes
+    where it could start now once submitted."""
+    snapshot = await get_snapshot(request)
+
+    try:
+        resource_request = parse_resource_request(request.query)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+    # the form alone until something is asked for
+    submitted = any(key in request.query for key in resource_request_keys)
+
+    def render():
+        return render_template(
+            "fit.html",
+            resource_request=resource_request,
+            fits=find_fits(snapshot, resource_request, request.query) if submitted else None,
+            index=get_free_resource_index(snapshot),
+            **get_page_kwargs(request)
+        )
+
+    page = page_cache.get_or_render(get_page_key("fit", snapshot, request), "text/html", render)
+    return page.response(request)
+
+async def api_fit(request: web.Request):
+    try:
+        resource_request = parse_resource_request(request.query)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+    return await api_response(
+        request,
+        lambda snapshot: encode_fits(snapshot, resource_request, find_fits(snapshot, resource_request, request.query))
+    )
+
+async def history_response(request: web.Request, respond: Callable[[Any, list], web.Response]):
+    if history_store is None:
+        raise web.HTTPNotFound(text="The utilization history is disabled (see --history-db)")
+
+    try:
+        query = parse_history_query(request.query, history_store, args.history_interval)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+    series_list = await history_store.query_async(query.kind, query.names, query.start, query.end, query.resolution)
+    return respond(query, series_list)
+
+async def show_history(request: web.Request):
+    def respond(query, series_list):
+        body = render_template("history.html", query=query, series_list=series_list, sample_interval=args.history_interval)
+
+        response = web.Response(content_type="text/html", text=body)
+        response.enable_compression()
+        return response
+
+    return await history_response(request, respond)
 
-    table_template = lookup.get_template("nodelist.html")
+async def api_history(request: web.Request):
+    def respond(query, series_list):
+        body = encode_history(query, series_list)
+        api_body_bytes.labels(request.path).observe(len(body))
 
-    response = web.Response(content_type="text/html", body=table_template.render(nodes=nodes, jobs=jobs))
+        response = web.Response(content_type="application/json", body=body)
+        response.enable_compression()
+        return response
+
+    return await history_response(request, respond)
+
+async def lookup_job(key):
+    cluster, job_id = key
+    return await backends_by_cluster[cluster].query_job(job_id)
+
+job_cache = LookupCache(lookup_job, ttl=args.job_cache_ttl, max_entries=args.job_cache_size)
+
+async def get_job(request: web.Request) -> JobState:
+    """Job of the URL, on the cluster of the `cluster` query parameter when
+    monitoring several clusters. Looked up through `job_cache`, or taken from
+    the latest snapshot or the job history if Slurm cannot tell about it."""
+    job_id = request.match_info["job_id"]
+    cluster = request.query.get("cluster")
+
+    if cluster not in backends_by_cluster:
+        raise web.HTTPBadRequest(text="cluster is required when monitoring several clusters" if cluster is None else f"Unknown cluster {cluster!r}")
+
+    try:
+        return await job_cache.get((cluster, job_id))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    except (BackendError, SlurmUnavailableError) as e:
+        snapshot = cluster_pollers_by_name[cluster].snapshot if cluster is not None else poller.snapshot
+        job = snapshot.jobs.get(qualify(cluster, job_id)) if snapshot is not None else None
+
+        if job is None and job_history_store is not None:
+            job = await job_history_store.run_in_thread(job_history_store.get, cluster or "", job_id)
+
+        if job is None:
+            raise web.HTTPNotFound(text=str(e))
+
+        return job
+
+async def show_job(request: web.Request):
+    job = await get_job(request)
+    log_paths = {stream: get_log_path(job, stream) for stream in log_streams}
+
+    body = render_template("job.html", job=job, log_paths=log_paths, tail_bytes=default_tail_bytes, **get_page_kwargs(request))
+
+    response = web.Response(content_type="text/html", text=body)
     response.enable_compression()
     return response
 
-# async def read_log_file(request: web.Request):
-#     job_id = request.query["jobId"]
-#     job = await query_job(job_id)
-#     return web.FileResponse(headers={"Content-Type": "text/plain"}, path=job.stdout_path)
+async def api_show_job(request: web.Request):
+    job = await get_job(request)
+
+    body = encode_json(job_as_json(job))
+    api_body_bytes.labels("/api/job").observe(len(body))
+
+    response = web.Response(content_type="application/json", body=body)
+    response.enable_compression()
+    return response
+
+def get_int_query(request: web.Request, key: str, default: int) -> int:
+    try:
+        value = int(request.query.get(key, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{key} must be an integer")
+
+    if value < 0:
+        raise web.HTTPBadRequest(text=f"{key} must be positive")
+
+    return value
+
+async def read_job_log(request: web.Request):
+    """Log of a job, without reading it whole: the part selected by a Range
+    header, the last `tail` bytes, or the whole log sent by chunks. With
+    `follow=1`, sends the bytes appended from `offset` on (by default, the
+    last `tail` bytes) as they are written, until the job ends."""
+    job = await get_job(request)
+    stream = request.match_info["stream"]
+    path = get_log_path(job, stream)
+
+    if path is None:
+        raise web.HTTPNotFound(text=f"Job {job.job_id} has no {stream} log")
+
+    try:
+        log_file, size = await asyncio.get_running_loop().run_in_executor(None, open_log, path)
+    except OSError as e:
+        raise web.HTTPNotFound(text=f"Cannot read {path}: {e.strerror or e}")
+
+    headers = {
+        "Content-Type": "text/plain; charset=utf-8",
+        "Cache-Control": "no-cache",
+        "Accept-Ranges": "bytes",
+        "X-Log-Size": str(size),
+    }
+
+    try:
+        if request.query.get("follow") == "1":
+            offset = get_int_query(request, "offset", max(size - get_int_query(request, "tail", default_tail_bytes), 0))
+            return await follow_job_log(request, job, log_file, min(offset, size), headers)
+
+        if "Range" in request.headers:
+            try:
+                http_range = request.http_range
+            except ValueError:
+                http_range = None
+
+            byte_range = resolve_range(http_range.start, http_range.stop, size) if http_range is not None else None
+            if byte_range is None:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+
+            status = 206
+            headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1] - 1}/{size}"
+        else:
+            tail = get_int_query(request, "tail", size)
+            status = 200
+            byte_range = (max(size - tail, 0), size)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = byte_range[1] - byte_range[0]
+        await response.prepare(request)
+
+        async for chunk in read_chunks(log_file, *byte_range):
+            await response.write(chunk)
+
+        await response.write_eof()
+        return response
+    finally:
+        log_file.close()
+
+async def follow_job_log(request: web.Request, job: JobState, log_file, offset: int, headers: Dict[str, str]) -> web.StreamResponse:
+    async def is_done():
+        if request.transport is None or request.transport.is_closing():
+            return True
+
+        try:
+            current = await get_job(request)
+        except web.HTTPException:
+            return True
+
+        return current.job_state not in ("PENDING", "CONFIGURING", "RUNNING", "SUSPENDED", "COMPLETING", "REQUEUED", "RESIZING")
+
+    response = web.StreamResponse(headers=dict(headers, **{"X-Log-Offset": str(offset)}))
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    log_followers.inc()
+
+    try:
+        # the job is looked up again through job_cache, at most once per
+        # --job-cache-ttl however many pages follow it
+        async for chunk in follow_log(log_file, offset, is_done):
+            await response.write(chunk)
+
+        await response.write_eof()
+    except ConnectionResetError:
+        pass
+    finally:
+        log_followers.inc(-1)
+
+    return response
+
+def collect_snapshot_metrics():
+    # reads the latest snapshot directly, so that scrapes do not keep the
+    # poller from backing off when nobody is looking at the pages
+    snapshot = poller.snapshot
+    if snapshot is None:
+        return []
+
+    return snapshot.derive("metrics", snapshot_metrics)
+
+async def show_metrics(request: web.Request):
+    response = web.Response(
+        body=registry.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+    response.enable_compression()
+    return response
+
+def make_poller(backend, name: str="") -> SnapshotPoller:
+    return SnapshotPoller(
+        functools.partial(query_snapshot, backend),
+        interval=args.refresh_interval,
+        # instances reading the published snapshots are not seen as activity
+        idle_interval=args.idle_refresh_interval if args.publish is None else args.refresh_interval,
+        idle_timeout=args.idle_timeout,
+        name=name
+    )
+
+# bounds the scontrol processes of all clusters together
+scontrol_slots = ProcessSlots(args.scontrol_concurrency)
+
+backend_options = {
+    "api_version": args.slurmrestd_api_version,
+    "timeout": args.slurm_timeout,
+    "slots": scontrol_slots,
+    "max_backoff": args.max_backoff,
+    "shared_store": SharedStoreReader(args.shared_store) if args.shared_store is not None else None,
+}
+
+if len(clusters) == 0:
+    backends = [make_backend(
+        args.backend,
+        scontrol=args.scontrol_path,
+        slurmrestd_url=args.slurmrestd_url,
+        **backend_options
+    )]
+
+    # empty when monitoring a single cluster
+    cluster_pollers = []
+    poller = make_poller(backends[0])
+else:
+    backends = [
+        make_backend(
+            args.backend,
+            scontrol=target or args.scontrol_path,
+            slurmrestd_url=target,
+            cluster=name,
+            scontrol_args=["-M", name] if target is None else [],
+            **backend_options
+        )
+        for name, target in clusters
+    ]
+
+    cluster_pollers = [make_poller(backend, backend.cluster) for backend in backends]
+    poller = MultiClusterPoller(cluster_pollers, startup_timeout=args.cluster_startup_timeout)
+
+cluster_pollers_by_name = {cluster_poller.name: cluster_poller for cluster_poller in cluster_pollers}
+
+# the cluster is `None` when monitoring a single cluster
+backends_by_cluster = {backend.cluster: backend for backend in backends}
+
+# pollers whose failures are shown on pages
+status_pollers = cluster_pollers or [poller]
+
+async def close_backends(app: web.Application):
+    for backend in backends:
+        await backend.close()
+
+history_store = None
+
+if args.history_db != "":
+    raw_retention, minute_retention, hour_retention = map(parse_duration, args.history_retention.split(","))
+
+    history_store = HistoryStore(args.history_db, [
+        Resolution("raw", 0, raw_retention),
+        Resolution("1m", 60, minute_retention),
+        Resolution("1h", 3600, hour_retention),
+    ])
+
+job_history_store = None
+
+if args.job_history_db != "":
+    job_history_store = JobHistoryStore(args.job_history_db, parse_duration(args.job_history_retention))
+
+registry.collectors.append(collect_snapshot_metrics)
+
+# tooltip titles only stay known while pages use them, see tooltip.html
+poller.listeners.append(lambda snapshot: lookup.get_template("include/tooltip.html").module.forget_old_tooltips())
+
+live_updates = LiveUpdates(lookup, poller)
+poller.listeners.append(live_updates.on_snapshot)
+
+# pages of a single cluster follow that cluster's snapshots, see get_snapshot
+cluster_live_updates = {}
+
+for cluster_poller in cluster_pollers:
+    cluster_live_updates[cluster_poller.name] = LiveUpdates(lookup, cluster_poller)
+    cluster_poller.listeners.append(cluster_live_updates[cluster_poller.name].on_snapshot)
+
+async def handle_events(request: web.Request):
+    updates = cluster_live_updates.get(request.query.get("cluster"), live_updates)
+    return await updates.handle_events(request)
 
 auth = BasicAuthMiddleware(username="swatch", password=auth_secret)
 app = web.Application(middlewares=[auth])
 
+for cluster_poller in cluster_pollers:
+    app.cleanup_ctx.append(cluster_poller.cleanup_ctx)
+
+app.cleanup_ctx.append(poller.cleanup_ctx)
+app.on_cleanup.append(close_backends)
+
+if history_store is not None:
+    app.cleanup_ctx.append(HistoryRecorder(history_store, poller, interval=args.history_interval).cleanup_ctx)
+
+if job_history_store is not None:
+    # sacct asks slurmdbd rather than slurmctld, hence its own breakers
+    sacct_runners = {
+        name or "": ScontrolRunner(
+            args.sacct_path,
+            args=["-M", name] if name is not None else [],
+            timeout=args.slurm_timeout,
+            slots=scontrol_slots,
+            breaker=CircuitBreaker(f"{name or ''}/sacct", max_backoff=args.max_backoff)
+        )
+        for name in ([name for name, _ in clusters] or [None])
+    }
+
+    app.cleanup_ctx.append(JobHistoryPoller(job_history_store, sacct_runners, interval=args.job_history_interval).cleanup_ctx)
+
+async def prewarm(app: web.Application):
+    """Compiles the templates while the first snapshot is queried, so that
+    the server only starts listening once neither would slow down the first
+    requests. Slurm is waited for at most --slurm-timeout seconds, or
+    --cluster-startup-timeout with several clusters."""
+    loop = asyncio.get_running_loop()
+    snapshot_timeout = args.cluster_startup_timeout if len(clusters) > 0 else args.slurm_timeout
+
+    async def compile_timed():
+        start = time.perf_counter()
+        await loop.run_in_executor(None, compile_templates)
+        startup_seconds.labels("templates").set(time.perf_counter() - start)
+
+    async def wait_snapshot():
+        start = time.perf_counter()
+
+        try:
+            await asyncio.wait_for(poller.wait_first_refresh(), timeout=snapshot_timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        if poller.snapshot is None:
+            logging.warning("No snapshot yet, starting anyway")
+            return
+
+        startup_seconds.labels("snapshot").set(time.perf_counter() - start)
+
+    await asyncio.gather(wait_snapshot(), *([compile_timed()] if not args.collect_only else []))
+
+    total = time.perf_counter() - startup_time
+    startup_seconds.labels("total").set(total)
+    logging.info(f"Started in {total:.2f}s")
+
+app.on_startup.append(prewarm)
+
+if args.publish is not None:
+    app.cleanup_ctx.append(SnapshotPublisher(
+        args.publish,
+        status_pollers,
+        interval=args.refresh_interval,
+        stale_after=3 * args.refresh_interval + args.slurm_timeout
+    ).cleanup_ctx)
+
 app.add_routes([
     web.get("/", list_nodes),
     web.get("/nodes", list_nodes),
     web.get("/jobs", list_jobs),
+    web.get("/array-rows", list_array_rows),
+    web.get("/fit", show_fit),
+    web.get("/job/{job_id}", show_job),
+    web.get("/job/{job_id}/{stream:stdout|stderr}", read_job_log),
+
+    web.get("/events", handle_events),
+
+    web.get("/api/jobs", api_list_jobs),
+    web.get("/api/nodes", api_list_nodes),
+    web.get("/api/partitions", api_list_partitions),
+    web.get("/api/job/{job_id}", api_show_job),
+    web.get("/api/fit", api_fit),
+
+    web.get("/history", show_history),
+    web.get("/api/history", api_history),
+
+    web.get("/metrics", show_metrics),
 
     web.static("/vendor/", "vendor/"),
     web.static("/assets/", "assets/")
 ])
 
-logging.info(f"Server running and listening on localhost:{args.port}")
-logging.info(f"If you followed the README, go to: http://localhost:51024")
-web.run_app(app, host="localhost", port=args.port, print=False)
\ No newline at end of file
+async def collect():
+    """Runs the pollers and the publisher of `app` without serving it."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signal_number, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+if args.collect_only:
+    logging.info(f"Collecting snapshots to {args.publish}")
+    asyncio.run(collect())
+else:
+    logging.info(f"Server running and listening on localhost:{args.port}")
+    logging.info(f"If you followed the README, go to: http://localhost:51024")
+    web.run_app(app, host="localhost", port=args.port, print=False)
\ No newline at end of file
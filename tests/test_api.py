@@ -0,0 +1,69 @@
+"""Checks the JSON API on a snapshot merged from two clusters that report the
+same job ids and node names, from `benchmarks/fixtures.py`.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import datetime
+import functools
+import json
+import sys
+import unittest
+from pathlib import Path
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+sys.path.insert(0, str(repository_path / "benchmarks"))
+
+from fixtures import make_job_lines, make_node_lines
+from api import encode_jobs, encode_nodes, job_as_json, node_as_json
+from snapshot import build_snapshot, merge_snapshots
+from jobstate import *
+from nodestate import *
+
+clusters = ("a", "b")
+
+
+def make_cluster_snapshot(cluster: str, job_lines, node_lines):
+    jobs, job_diff = IncrementalParser("JobId", functools.partial(JobState, cluster=cluster), "jobs", cluster).parse(job_lines)
+    nodes, node_diff = IncrementalParser("NodeName", functools.partial(NodeState, cluster=cluster), "nodes", cluster).parse(node_lines)
+    return build_snapshot(1, datetime.datetime.now(), jobs, nodes, job_diff, node_diff)
+
+
+def decode(entry):
+    return json.loads(json.dumps(entry))
+
+
+class MergedSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        # both clusters run the same jobs on nodes of the same names, in
+        # different states so that mixing them up shows in the documents
+        snapshots = [
+            make_cluster_snapshot(cluster, make_job_lines(200, seed, 40), make_node_lines(40, seed))
+            for seed, cluster in enumerate(clusters)
+        ]
+        self.snapshot = merge_snapshots(2, snapshots, snapshots[-1])
+
+    def test_jobs(self):
+        jobs = self.snapshot.sorted_jobs
+        self.assertEqual(len(jobs), 400)
+
+        # a first request fills the cache that the second one reads
+        for _ in range(2):
+            document = json.loads(encode_jobs(self.snapshot, jobs))
+
+            self.assertEqual([entry["cluster"] for entry in document["jobs"]], [job.cluster for job in jobs])
+            self.assertEqual(document["jobs"], [decode(job_as_json(job)) for job in jobs])
+
+    def test_nodes(self):
+        nodes = list(self.snapshot.nodes.values())
+        self.assertEqual(len(nodes), 80)
+
+        for _ in range(2):
+            document = json.loads(encode_nodes(self.snapshot, nodes))
+
+            self.assertEqual(sorted(entry["cluster"] for entry in document["nodes"]), ["a"] * 40 + ["b"] * 40)
+            self.assertEqual(document["nodes"], [decode(node_as_json(node)) for node in nodes])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,259 @@
+"""Checks that the text, json and rest backends build the same jobs and nodes
+from the same synthetic cluster: `benchmarks/fake_scontrol.py` stands in for
+`scontrol` and `benchmarks/fake_slurmrestd.py`, run as a server, for
+slurmrestd.
+
+Run from the repository root: `python -m pytest tests`"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from typing import Tuple
+
+repository_path = Path(__file__).absolute().parent.parent
+benchmarks_path = repository_path / "benchmarks"
+sys.path.insert(0, str(repository_path))
+sys.path.insert(0, str(benchmarks_path))
+
+from fixtures import make_job_lines, make_node_lines
+from fake_slurmrestd import make_jobs_document, make_nodes_document
+from backends import *
+from scontrol import CircuitOpenError, SlurmUnavailableError
+
+job_count = 300
+node_count = 60
+seed = 3
+
+# what every backend must agree on, by name
+job_values = {
+    "job_id": lambda job: job.job_id,
+    "array": lambda job: (job.array_job_id, job.array_task_id),
+    "name": lambda job: job.job_name,
+    "user": lambda job: (job.user_name, job.user_id),
+    "state": lambda job: (job.job_state, job.job_state_reasons),
+    "partition": lambda job: job.partition,
+    "nodes": lambda job: (job.nodes, job.nodes_compact),
+    "requested_nodes": lambda job: (job.requested_nodes, job.excluded_nodes),
+    "tres": lambda job: job.trackable_resources,
+    "resources": lambda job: (job.get_node_count(), job.get_cpus(), job.get_ram(), job.get_gpus()),
+    "times": lambda job: (job.submit_time, job.start_time, job.end_time, job.max_time_limit),
+    # the fixtures are in the past, so running jobs keep running in JSON
+    "pending_run_time": lambda job: job.run_time if job.job_state == "PENDING" else None,
+}
+
+node_values = {
+    "name": lambda node: node.name,
+    "state": lambda node: (node.state, node.up),
+    "cpus": lambda node: (node.cpu_total, node.cpu_alloc),
+    "memory": lambda node: (node.memory_total_mbytes, node.memory_alloc_mbytes),
+    "gres": lambda node: node.gres,
+    "tres": lambda node: (node.tres_total, node.tres_alloc),
+    "partitions": lambda node: node.partitions,
+    "features": lambda node: node.active_features,
+}
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError("fake_slurmrestd did not start")
+
+
+def start_fake_slurmrestd(*args: str) -> Tuple[subprocess.Popen, int]:
+    """Runs `benchmarks/fake_slurmrestd.py` on a free port."""
+    port = get_free_port()
+    server = subprocess.Popen(
+        [sys.executable, str(benchmarks_path / "fake_slurmrestd.py"), "--port", str(port), *args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        server.terminate()
+        server.wait()
+        raise
+
+    return server, port
+
+
+class BackendTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fixtures_dir = tempfile.TemporaryDirectory()
+        fixtures_path = Path(cls.fixtures_dir.name)
+
+        job_lines = make_job_lines(job_count, seed, node_count)
+        node_lines = make_node_lines(node_count, seed)
+        (fixtures_path / "jobs.txt").write_text("\n".join(job_lines) + "\n")
+        (fixtures_path / "nodes.txt").write_text("\n".join(node_lines) + "\n")
+        (fixtures_path / "jobs.json").write_text(json.dumps(make_jobs_document(job_lines)))
+        (fixtures_path / "nodes.json").write_text(json.dumps(make_nodes_document(node_lines)))
+
+        cls.previous_fixtures_dir = os.environ.get("SWATCH_FIXTURES_DIR")
+        os.environ["SWATCH_FIXTURES_DIR"] = str(fixtures_path)
+
+        try:
+            cls.server, cls.port = start_fake_slurmrestd("--jobs", str(job_count), "--nodes", str(node_count), "--seed", str(seed))
+        except RuntimeError:
+            cls.restore_environment()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        cls.restore_environment()
+
+    @classmethod
+    def restore_environment(cls):
+        if cls.previous_fixtures_dir is None:
+            os.environ.pop("SWATCH_FIXTURES_DIR", None)
+        else:
+            os.environ["SWATCH_FIXTURES_DIR"] = cls.previous_fixtures_dir
+
+        cls.fixtures_dir.cleanup()
+
+    async def asyncSetUp(self):
+        fake_scontrol = str(benchmarks_path / "fake_scontrol.py")
+
+        self.backends = {
+            "text": make_backend("text", scontrol=fake_scontrol),
+            "json": make_backend("json", scontrol=fake_scontrol),
+            "rest": make_backend("rest", slurmrestd_url=f"http://localhost:{self.port}"),
+        }
+
+    async def asyncTearDown(self):
+        for backend in self.backends.values():
+            await backend.close()
+
+    def assert_same_entities(self, entities_by_backend, values):
+        expected = entities_by_backend["text"]
+
+        for name, entities in entities_by_backend.items():
+            self.assertEqual(sorted(entities), sorted(expected), f"keys of the {name} backend")
+
+            for key, entity in entities.items():
+                for value_name, get_value in values.items():
+                    self.assertEqual(
+                        get_value(entity), get_value(expected[key]),
+                        f"{value_name} of {key} from the {name} backend"
+                    )
+
+    async def test_jobs(self):
+        jobs = {name: (await backend.query_jobs())[0] for name, backend in self.backends.items()}
+
+        self.assertEqual(len(jobs["text"]), job_count)
+        self.assert_same_entities(jobs, job_values)
+
+    async def test_nodes(self):
+        nodes = {name: (await backend.query_nodes())[0] for name, backend in self.backends.items()}
+
+        self.assertEqual(len(nodes["text"]), node_count)
+        self.assert_same_entities(nodes, node_values)
+
+    async def test_job(self):
+        jobs, _ = await self.backends["text"].query_jobs()
+        job_id = str(next(iter(jobs.values())).job_id)
+
+        for name, backend in self.backends.items():
+            job = await backend.query_job(job_id)
+
+            for value_name, get_value in job_values.items():
+                self.assertEqual(get_value(job), get_value(jobs[job.key]), f"{value_name} from the {name} backend")
+
+    async def test_unknown_job(self):
+        for name, backend in self.backends.items():
+            # lookups of unknown jobs do not suspend the queries of the cluster
+            for _ in range(5):
+                with self.assertRaises(BackendError, msg=name):
+                    await backend.query_job("999999999")
+
+            jobs, _ = await backend.query_jobs()
+            self.assertEqual(len(jobs), job_count, name)
+
+    async def test_incremental_refresh(self):
+        """A second refresh of an unchanged cluster reuses every job, except
+        running ones when their run time changed in between: JSON backends
+        compute it from the current time."""
+        for name, backend in self.backends.items():
+            first, _ = await backend.query_jobs()
+            second, diff = await backend.query_jobs()
+
+            self.assertEqual(sorted(second), sorted(first), name)
+            self.assertEqual(diff.added | diff.removed, set(), name)
+
+            for key in first:
+                if second[key] is not first[key]:
+                    self.assertIn(key, diff.changed, name)
+                    self.assertEqual(first[key].job_state, "RUNNING", name)
+                    self.assertNotEqual(first[key].run_time, second[key].run_time, name)
+
+
+class RestErrorTest(unittest.IsolatedAsyncioTestCase):
+    """slurmrestd behind a reverse proxy that answers with HTML error pages."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.port = start_fake_slurmrestd("--jobs", "10", "--nodes", "4", "--proxy-error", "502")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+
+    async def asyncSetUp(self):
+        self.backend = make_backend("rest", slurmrestd_url=f"http://localhost:{self.port}")
+
+    async def asyncTearDown(self):
+        await self.backend.close()
+
+    async def test_proxy_error(self):
+        for _ in range(self.backend.breaker.failure_threshold):
+            with self.assertRaises(SlurmUnavailableError) as raised:
+                await self.backend.query_jobs()
+
+            self.assertNotIsInstance(raised.exception, CircuitOpenError)
+            self.assertIn("HTTP 502", str(raised.exception))
+
+        # the circuit opened, as for any other unavailability
+        with self.assertRaises(CircuitOpenError):
+            await self.backend.query_nodes()
+
+    async def test_job_proxy_error(self):
+        with self.assertRaises(SlurmUnavailableError):
+            await self.backend.query_job("42")
+
+        self.assertEqual(self.backend.breaker.failures, 0)
+
+
+class JsonBackendTest(unittest.TestCase):
+    def test_fetch_is_abstract(self):
+        class IncompleteBackend(SlurmJsonBackend):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteBackend()
+
+
+if __name__ == "__main__":
+    unittest.main()
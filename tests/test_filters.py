@@ -0,0 +1,121 @@
+"""Checks that the job filters select the same jobs through `JobIndex`, through
+the columnar copy of snapshots (`--columnar`) and by testing every job, on
+clusters from `benchmarks/fixtures.py`.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import datetime
+import functools
+import sys
+import unittest
+from pathlib import Path
+
+from multidict import MultiDict
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+sys.path.insert(0, str(repository_path / "benchmarks"))
+
+from fixtures import make_job_lines
+from filters import job_filter_fields, select_jobs
+from query import compile_job_query
+from snapshot import build_snapshot, merge_snapshots
+from jobstate import *
+
+
+def make_cluster_snapshot(cluster: Optional[str], seed: int):
+    parser = IncrementalParser("JobId", functools.partial(JobState, cluster=cluster), "jobs", cluster)
+    jobs, job_diff = parser.parse(make_job_lines(2000, seed, 100))
+    return build_snapshot(1, datetime.datetime.now(), jobs, {}, job_diff, ParseDiff())
+
+
+def scan_jobs(snapshot, query) -> List[JobState]:
+    """The jobs matching `query`, testing each filter on each job."""
+    def matches(job, key, field_filter):
+        if key == "node":
+            return field_filter.matches_any(job.node_keys or [])
+
+        return field_filter.matches(job_filter_fields[key](job))
+
+    filters = compile_job_query(query)
+    return [job for job in snapshot.sorted_jobs if all(matches(job, key, field_filter) for key, field_filter in filters)]
+
+
+def make_queries(snapshot, clusters: List[str]):
+    def node(name: str) -> str:
+        return qualify(clusters[0], name) if len(clusters) > 0 else name
+
+    array_key = next(job.array_key for job in snapshot.sorted_jobs if job.array_key is not None)
+
+    return [
+        {},
+        {"user": "user001"},
+        {"user": "user001,user002,nobody"},
+        {"user": "!user001"},
+        {"user": "user00*"},
+        {"user": "user0*,!user01*"},
+        {"user": "!user0*,!user10*"},
+        {"user": "nobody*"},
+        {"state": "!PENDING", "partition": "gpu"},
+        {"state": "RUNNING,PENDING", "partition": "!gpu"},
+        {"state": "*"},
+        {"partition": "gp*,cpu*"},
+        {"node": node("gpu001")},
+        {"node": f"{node('gpu001')},{node('cpuonly002')}"},
+        {"node": node("gpu0*")},
+        {"node": "!" + node("cpuonly*")},
+        {"node": node("gpu*"), "state": "!RUNNING"},
+        {"array": array_key},
+        {"array": "!" + array_key},
+        {"array": array_key[:-1] + "*"},
+        {"cluster": ",".join(clusters) or "a"},
+        {"cluster": "!" + (clusters[0] if len(clusters) > 0 else "a")},
+        MultiDict([("state", "!PENDING"), ("state", "!COMPLETED")]),
+        MultiDict([("user", "user0*"), ("user", "user00*,user1*"), ("partition", "gpu")]),
+        MultiDict([("user", "user001"), ("user", "user002")]),
+    ]
+
+
+class FilterTest(unittest.TestCase):
+    def check_queries(self, snapshot, clusters: List[str]):
+        for query in make_queries(snapshot, clusters):
+            expected = scan_jobs(snapshot, query)
+
+            self.assertEqual(select_jobs(snapshot, query), expected, query)
+            self.assertEqual(select_jobs(snapshot, query, columnar=True), expected, query)
+
+    def test_single_cluster(self):
+        snapshot = make_cluster_snapshot(None, 1)
+        self.check_queries(snapshot, [])
+
+        # the filters are not all trivial
+        self.assertLess(len(select_jobs(snapshot, {"user": "user00*"})), len(snapshot.jobs) / 10)
+        self.assertGreater(len(select_jobs(snapshot, {"user": "user00*"})), 0)
+
+    def test_clusters(self):
+        snapshots = [make_cluster_snapshot(cluster, seed) for seed, cluster in enumerate(("a", "b"))]
+        self.check_queries(merge_snapshots(2, snapshots, snapshots[-1]), ["a", "b"])
+
+    def test_compile(self):
+        (key, field_filter), = compile_job_query({"user": "alice,bob*,!bobby,!carl*"})
+
+        self.assertEqual(key, "user")
+        self.assertEqual(field_filter.includes.exact, {"alice"})
+        self.assertEqual(field_filter.includes.prefixes, ("bob",))
+        self.assertEqual(field_filter.excludes.exact, {"bobby"})
+        self.assertEqual(field_filter.excludes.prefixes, ("carl",))
+
+        self.assertTrue(field_filter.matches("bobcat"))
+        self.assertFalse(field_filter.matches("bobby"))
+        self.assertFalse(field_filter.matches("carlos"))
+        self.assertFalse(field_filter.matches(None))
+
+        # only exclusions: anything else matches
+        (_, field_filter), = compile_job_query({"state": "!PENDING"})
+        self.assertIsNone(field_filter.includes)
+        self.assertTrue(field_filter.matches("RUNNING"))
+        self.assertTrue(field_filter.matches(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+"""Checks the job history against `benchmarks/fake_sacct.py`: that polling
+neither loses nor duplicates jobs, and that filters select the same jobs from
+the history as from the current jobs.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import datetime
+import math
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+
+from filters import JobIndex
+from jobhistory import JobHistoryPoller, JobHistoryStore, format_sacct_time
+from query import compile_job_query
+from scontrol import ScontrolRunner
+from snapshot import ParseDiff, build_snapshot
+
+fake_sacct = str(repository_path / "benchmarks" / "fake_sacct.py")
+
+# one job ending every 10 minutes, kept 2 days, queried 6 hours at a time
+period = 600
+retention = 2 * 86400
+max_window = 6 * 3600
+overlap = 300
+
+clusters = ("alpha", "beta")
+
+
+class RecordingRunner(ScontrolRunner):
+    """Runs the fake sacct, keeping the arguments of each command."""
+
+    def __init__(self):
+        super().__init__(fake_sacct)
+        self.commands = []
+
+    async def run(self, *command: str, count_errors: bool=True) -> bytes:
+        self.commands.append(command)
+        return await super().run(*command, count_errors=count_errors)
+
+
+def get_option(command, name: str) -> str:
+    return next(arg.split("=", 1)[1] for arg in command if arg.startswith(f"--{name}="))
+
+
+class JobHistoryTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.previous_period = os.environ.get("SWATCH_FAKE_SACCT_PERIOD")
+        os.environ["SWATCH_FAKE_SACCT_PERIOD"] = str(period)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.previous_period is None:
+            os.environ.pop("SWATCH_FAKE_SACCT_PERIOD", None)
+        else:
+            os.environ["SWATCH_FAKE_SACCT_PERIOD"] = cls.previous_period
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / "jobs.db")
+        self.store = await self.open_store()
+        self.runners = {cluster: RecordingRunner() for cluster in clusters}
+
+    async def asyncTearDown(self):
+        await self.close_store(self.store)
+        self.directory.cleanup()
+
+    async def open_store(self) -> JobHistoryStore:
+        store = JobHistoryStore(self.path, retention)
+        await store.run_in_thread(store.open)
+        return store
+
+    async def close_store(self, store: JobHistoryStore):
+        await store.run_in_thread(store.close)
+        store.executor.shutdown()
+
+    async def sql(self, statement: str, *parameters):
+        return await self.store.run_in_thread(lambda: self.store.connection.execute(statement, parameters).fetchall())
+
+    def make_poller(self) -> JobHistoryPoller:
+        return JobHistoryPoller(self.store, self.runners, overlap=overlap, max_window=max_window)
+
+    async def catch_up(self, poller: JobHistoryPoller, cluster: str) -> int:
+        """Polls `cluster` until it reaches the present, returning how many
+        queries it took."""
+        for count in range(1, 100):
+            if await poller.poll(cluster, self.runners[cluster]):
+                return count
+
+        self.fail(f"{cluster} never caught up")
+
+    async def test_cold_start(self):
+        """A first start fills the retention period in bounded windows, with
+        no gaps between them."""
+        poller = self.make_poller()
+
+        for cluster in clusters:
+            count = await self.catch_up(poller, cluster)
+
+            # each window overlaps the previous one
+            self.assertEqual(count, math.ceil((retention - max_window) / (max_window - overlap)) + 1)
+
+            windows = [
+                (get_option(command, "starttime"), get_option(command, "endtime"))
+                for command in self.runners[cluster].commands
+            ]
+
+            for (start, end), (next_start, _) in zip(windows, windows[1:]):
+                parsed_start, parsed_end = (datetime.datetime.fromisoformat(t) for t in (start, end))
+                self.assertLessEqual((parsed_end - parsed_start).total_seconds(), max_window)
+                self.assertEqual(datetime.datetime.fromisoformat(next_start), parsed_end - datetime.timedelta(seconds=overlap))
+
+            # one job per period, none missing
+            end_times = [end_time for (end_time,) in await self.sql("SELECT end_time FROM jobs WHERE cluster = ? ORDER BY end_time", cluster)]
+            self.assertEqual([b - a for a, b in zip(end_times, end_times[1:])], [period] * (len(end_times) - 1))
+            self.assertLess(end_times[0] - (time.time() - retention), period + 1)
+            self.assertLess(time.time() - end_times[-1], period + 5)
+
+    async def test_repeated_polls(self):
+        """Overlapping queries report jobs again, which are not duplicated."""
+        poller = self.make_poller()
+        for cluster in clusters:
+            await self.catch_up(poller, cluster)
+
+        jobs = await self.sql("SELECT cluster, job_id, end_time, record FROM jobs ORDER BY cluster, job_id")
+        job_nodes = await self.sql("SELECT * FROM job_nodes ORDER BY node, cluster, job_id")
+
+        for _ in range(2):
+            for cluster in clusters:
+                self.assertTrue(await poller.poll(cluster, self.runners[cluster]))
+
+                # the last query reported jobs that were already stored
+                self.assertGreater(len(self.runners[cluster].commands), 1)
+
+        self.assertEqual(await self.sql("SELECT cluster, job_id, end_time, record FROM jobs ORDER BY cluster, job_id"), jobs)
+        self.assertEqual(await self.sql("SELECT * FROM job_nodes ORDER BY node, cluster, job_id"), job_nodes)
+
+    async def test_reopen(self):
+        """The high-water mark survives restarts: the next query resumes
+        from it rather than from the start of the retention period."""
+        poller = self.make_poller()
+        await self.catch_up(poller, "alpha")
+
+        polled_until = await self.store.run_in_thread(self.store.get_polled_until, "alpha")
+        (job_count,) = (await self.sql("SELECT count(*) FROM jobs"))[0]
+
+        await self.close_store(self.store)
+        self.store = await self.open_store()
+
+        self.assertEqual(await self.store.run_in_thread(self.store.get_polled_until, "alpha"), polled_until)
+        self.assertIsNone(await self.store.run_in_thread(self.store.get_polled_until, "beta"))
+
+        self.runners["alpha"].commands.clear()
+        self.assertTrue(await self.make_poller().poll("alpha", self.runners["alpha"]))
+
+        (command,) = self.runners["alpha"].commands
+        self.assertEqual(get_option(command, "starttime"), format_sacct_time(polled_until - overlap))
+        self.assertGreaterEqual((await self.sql("SELECT count(*) FROM jobs"))[0][0], job_count)
+
+    async def test_retention(self):
+        poller = self.make_poller()
+        for cluster in clusters:
+            await self.catch_up(poller, cluster)
+
+        (job_count,) = (await self.sql("SELECT count(*) FROM jobs"))[0]
+
+        # a day later, about half of the jobs are too old
+        now = int(time.time()) + 86400
+        await self.store.run_in_thread(self.store.enforce_retention, now)
+
+        (remaining,) = (await self.sql("SELECT count(*) FROM jobs"))[0]
+        self.assertLess(remaining, job_count * 0.6)
+        self.assertGreater(remaining, job_count * 0.4)
+        self.assertEqual(await self.sql("SELECT count(*) FROM jobs WHERE end_time < ?", now - retention), [(0,)])
+
+        # nodes of the deleted jobs go with them
+        orphans = await self.sql(
+            "SELECT count(*) FROM job_nodes n WHERE NOT EXISTS "
+            "(SELECT 1 FROM jobs j WHERE j.cluster = n.cluster AND j.job_id = n.job_id)"
+        )
+        self.assertEqual(orphans, [(0,)])
+
+    async def test_filters(self):
+        """Filters select the same jobs from the store as from a snapshot of
+        the same jobs, see JobIndex."""
+        poller = self.make_poller()
+        for cluster in clusters:
+            await self.catch_up(poller, cluster)
+
+        jobs, total, _ = await self.store.run_in_thread(self.store.query, [], 0, None, False, 1, None)
+        self.assertEqual(len(jobs), total)
+
+        snapshot = build_snapshot(0, datetime.datetime.now(), {job.key: job for job in jobs}, {}, ParseDiff(), ParseDiff())
+        index = JobIndex(snapshot)
+
+        some_job = next(job for job in jobs if job.array_key is not None)
+
+        queries = [
+            {"cluster": "alpha"},
+            {"cluster": "!alpha"},
+            {"user": some_job.user_name},
+            {"user": f"!{some_job.user_name}"},
+            {"user": "user00*"},
+            {"user": "USER00*"},
+            {"user": "user00*,!user001"},
+            {"partition": "gpu"},
+            {"partition": "gp*", "state": "!COMPLETED"},
+            {"state": "FAILED,TIMEOUT"},
+            {"state": "CANCELLED"},
+            {"array": some_job.array_key},
+            {"array": f"!{some_job.array_key}"},
+            {"node": some_job.node_keys[0]},
+            {"node": "!alpha/gpu*"},
+            {"node": "beta/cpuonly00*", "user": "!user01*"},
+            {"user": "user_*"},
+            {"user": "user%"},
+        ]
+
+        for query in queries:
+            history_jobs, _, _ = await self.store.run_in_thread(self.store.query, compile_job_query(query), 0, None, False, 1, None)
+
+            self.assertEqual(
+                sorted(job.key for job in history_jobs),
+                sorted(job.key for job in index.select(query)),
+                query
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
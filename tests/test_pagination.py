@@ -0,0 +1,76 @@
+"""Checks the links of paginated job lists, of the current jobs and of the job
+history.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import datetime
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+from multidict import MultiDict
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+sys.path.insert(0, str(repository_path / "benchmarks"))
+
+from fixtures import make_job_lines
+from jobhistory import JobHistoryStore, paginate_job_history
+from pagination import paginate_jobs
+from snapshot import build_snapshot
+from jobstate import *
+
+
+def parse_url(url: str):
+    return parse_qsl(url[url.index("?") + 1:])
+
+
+class PageUrlTest(unittest.IsolatedAsyncioTestCase):
+    query = MultiDict([("user", "user001"), ("state", "!PENDING"), ("user", "!user002,user003"), ("page", "2")])
+
+    def check_urls(self, page):
+        self.assertEqual(
+            parse_url(page.page_url(3)),
+            [("user", "user001"), ("user", "!user002,user003"), ("state", "!PENDING"), ("page", "3")]
+        )
+        self.assertEqual(
+            parse_url(page.sort_url("user")),
+            [("user", "user001"), ("user", "!user002,user003"), ("state", "!PENDING"), ("sort", "user")]
+        )
+        self.assertEqual(
+            parse_url(page.page_url(1)),
+            [("user", "user001"), ("user", "!user002,user003"), ("state", "!PENDING")]
+        )
+
+    def test_jobs(self):
+        lines = make_job_lines(100)
+        jobs, diff = IncrementalParser("JobId", JobState, "jobs").parse(lines)
+        snapshot = build_snapshot(1, datetime.datetime.now(), jobs, {}, diff, ParseDiff())
+
+        page = paginate_jobs(snapshot, snapshot.sorted_jobs, self.query, default_per_page=10)
+        self.assertEqual(page.number, 2)
+        self.check_urls(page)
+
+    async def test_job_history(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JobHistoryStore(str(Path(directory) / "jobs.db"), 86400)
+            await store.run_in_thread(store.open)
+
+            try:
+                query = self.query.copy()
+                query["history"] = "24h"
+
+                page = await paginate_job_history(store, query, default_per_page=10)
+                self.assertEqual(parse_url(page.url()), [
+                    ("user", "user001"), ("user", "!user002,user003"), ("state", "!PENDING"),
+                    ("page", "2"), ("history", "24h")
+                ])
+            finally:
+                await store.run_in_thread(store.close)
+                store.executor.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+"""Checks the parsing of `scontrol --oneliner` lines and Slurm hostlists, and
+which jobs are parsed again between two outputs.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import functools
+import re
+import sys
+import unittest
+from pathlib import Path
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+sys.path.insert(0, str(repository_path / "benchmarks"))
+
+from fixtures import make_job_lines, make_node_lines
+from bench_parsing import parse_info_line_reference
+from jobstate import *
+
+
+class HostlistTest(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(expand_hostlist("gpu[001-003,007]"), ["gpu001", "gpu002", "gpu003", "gpu007"])
+        self.assertEqual(expand_hostlist("node[8-10]"), ["node8", "node9", "node10"])
+        self.assertEqual(expand_hostlist("node[08-10]"), ["node08", "node09", "node10"])
+
+    def test_several_groups(self):
+        self.assertEqual(expand_hostlist("a[1-2]b[3-4]"), ["a1b3", "a1b4", "a2b3", "a2b4"])
+
+    def test_lists(self):
+        self.assertEqual(expand_hostlist("cpu01"), ["cpu01"])
+        self.assertEqual(
+            expand_hostlist("gpu[001-002,005],cpu01,cpu[10-11]"),
+            ["gpu001", "gpu002", "gpu005", "cpu01", "cpu10", "cpu11"]
+        )
+
+    def test_null(self):
+        self.assertIsNone(parse_nullable_hostlist("(null)"))
+        self.assertIsNone(parse_nullable_hostlist(""))
+
+        job = JobState(parse_info_line("JobId=1 NodeList=(null) ReqNodeList=gpu[001-002]"))
+        self.assertIsNone(job.nodes)
+        self.assertIsNone(job.nodes_compact)
+        self.assertEqual(job.requested_nodes, ["gpu001", "gpu002"])
+
+
+class InfoLineTest(unittest.TestCase):
+    """`parse_info_line` splits lines as the original word-by-word parser
+    did: a word with a `=` starts a field, other words continue the last
+    one."""
+
+    def test_fields(self):
+        self.assertEqual(
+            parse_info_line("JobId=42 JobName=train UserId=user001(1001) NodeList=gpu[001-002]"),
+            {"JobId": "42", "JobName": "train", "UserId": "user001(1001)", "NodeList": "gpu[001-002]"}
+        )
+
+    def test_spaces(self):
+        self.assertEqual(
+            parse_info_line("JobId=1 WorkDir=/home/u/my experiments StdOut=/home/u/my experiments/out.txt"),
+            {"JobId": "1", "WorkDir": "/home/u/my experiments", "StdOut": "/home/u/my experiments/out.txt"}
+        )
+        self.assertEqual(
+            parse_info_line("NodeName=gpu001 Reason=Kill task failed [root@2022-11-01T10:00:00] Comment=(null)"),
+            {"NodeName": "gpu001", "Reason": "Kill task failed [root@2022-11-01T10:00:00]", "Comment": "(null)"}
+        )
+
+        # inner spaces are kept, surrounding ones are not
+        self.assertEqual(parse_info_line("  JobId=4   JobName=a  b  "), {"JobId": "4", "JobName": "a  b"})
+
+    def test_equal_signs(self):
+        # only the first `=` of a word separates its key from its value
+        self.assertEqual(
+            parse_info_line("JobId=1 Reason=a=b c TRES=cpu=4,mem=16G"),
+            {"JobId": "1", "Reason": "a=b c", "TRES": "cpu=4,mem=16G"}
+        )
+
+        # a word of a value that contains a `=` starts a field of its own
+        self.assertEqual(
+            parse_info_line("JobId=2 Command=/home/u/train.py --lr=0.001 --epochs 3 StdErr=/x"),
+            {"JobId": "2", "Command": "/home/u/train.py", "--lr": "0.001 --epochs 3", "StdErr": "/x"}
+        )
+
+    def test_empty_values(self):
+        self.assertEqual(parse_info_line("words JobId=3 Comment= Dependency="), {"JobId": "3", "Comment": "", "Dependency": ""})
+        self.assertEqual(parse_info_line(""), {})
+
+
+class ReferenceParserTest(unittest.TestCase):
+    """`parse_info_line` against the original parser, kept in
+    `benchmarks/bench_parsing.py`."""
+
+    def check_lines(self, lines):
+        for line in lines:
+            self.assertEqual(parse_info_line(line), parse_info_line_reference(line), line)
+
+    def test_fixtures(self):
+        self.check_lines(make_job_lines(5000, 2))
+        self.check_lines(make_node_lines(500, 2))
+
+    def test_edge_cases(self):
+        self.check_lines([
+            "",
+            " ",
+            "words only",
+            "JobId=1  JobName=two  spaces  ",
+            "JobId=2 Command=/home/u/train.py --lr=0.001 --epochs 3",
+            "JobId=3 Reason=a=b c == =d",
+            "JobId=4 JobId=5 Comment=duplicate keys",
+            "JobId=6\tTab=1",
+        ])
+
+
+def change_lines(lines):
+    """`lines` with the priority of the 11th job changed, a job added and the
+    last one removed, and the ids of these three jobs."""
+    changed_line = re.sub("Priority=[0-9]+", "Priority=1", lines[10])
+    added_line = re.sub("^JobId=[0-9]+", "JobId=999999", lines[0])
+
+    new_lines = lines[:10] + [changed_line] + lines[11:-1] + [added_line]
+    return new_lines, [parse_info_line(line)["JobId"] for line in (changed_line, added_line, lines[-1])]
+
+
+class IncrementalTest(unittest.TestCase):
+    """Changes between two outputs, for `IncrementalParser` on lines and
+    `IncrementalBuilder` on fields."""
+
+    cluster = "a"
+
+    def setUp(self):
+        self.lines = make_job_lines(200, 1, 40)
+        self.new_lines, job_ids = change_lines(self.lines)
+        self.changed, self.added, self.removed = (qualify(self.cluster, job_id) for job_id in job_ids)
+
+    def make_parsers(self):
+        make_state = functools.partial(JobState, cluster=self.cluster)
+        parser = IncrementalParser("JobId", make_state, "jobs", self.cluster)
+        builder = IncrementalBuilder("JobId", make_state, "jobs", self.cluster)
+
+        return {
+            "parser": lambda lines: parser.parse(lines),
+            "builder": lambda lines: builder.build([parse_info_line(line) for line in lines]),
+        }
+
+    def test_first_parse(self):
+        for name, parse in self.make_parsers().items():
+            jobs, diff = parse(self.lines)
+
+            self.assertEqual(len(jobs), 200, name)
+            self.assertEqual(diff, ParseDiff(added=set(jobs)), name)
+            self.assertTrue(all(key == job.key for key, job in jobs.items()), name)
+
+    def test_unchanged(self):
+        for name, parse in self.make_parsers().items():
+            jobs, _ = parse(self.lines)
+            # the order of the lines does not matter
+            new_jobs, diff = parse(self.lines[::-1])
+
+            self.assertTrue(diff.is_empty(), name)
+            self.assertEqual(new_jobs.keys(), jobs.keys(), name)
+            self.assertTrue(all(new_jobs[key] is jobs[key] for key in jobs), name)
+
+    def test_changes(self):
+        for name, parse in self.make_parsers().items():
+            jobs, _ = parse(self.lines)
+            new_jobs, diff = parse(self.new_lines)
+
+            self.assertEqual(diff, ParseDiff(added={self.added}, changed={self.changed}, removed={self.removed}), name)
+            self.assertEqual(new_jobs.keys(), jobs.keys() - {self.removed} | {self.added}, name)
+
+            self.assertEqual(new_jobs[self.changed].priority, 1, name)
+            self.assertEqual(new_jobs[self.added].job_id, 999999, name)
+
+            # only the changed and added jobs are new objects
+            reused = {key for key in new_jobs if key in jobs and new_jobs[key] is jobs[key]}
+            self.assertEqual(reused, new_jobs.keys() - {self.changed, self.added}, name)
+
+            # and the next output is compared to this one
+            _, diff = parse(self.new_lines)
+            self.assertTrue(diff.is_empty(), name)
+
+            _, diff = parse(self.lines)
+            self.assertEqual(diff, ParseDiff(added={self.removed}, changed={self.changed}, removed={self.added}), name)
+
+
+class SingleClusterIncrementalTest(IncrementalTest):
+    cluster = None
+
+
+if __name__ == "__main__":
+    unittest.main()
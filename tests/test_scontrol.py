@@ -0,0 +1,50 @@
+"""Checks that scontrol failures are reported as `SlurmUnavailableError` and
+open the circuit.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from scontrol import CircuitBreaker, CircuitOpenError, ScontrolRunner, SlurmUnavailableError
+
+
+class ScontrolRunnerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_missing_executable(self):
+        """Commands that cannot be started count as failures."""
+        breaker = CircuitBreaker(failure_threshold=2)
+        runner = ScontrolRunner("/nonexistent/scontrol", breaker=breaker)
+
+        for _ in range(2):
+            with self.assertRaises(SlurmUnavailableError) as raised:
+                await runner.run("show", "jobs")
+
+            self.assertIn("/nonexistent/scontrol", str(raised.exception))
+
+        self.assertTrue(breaker.is_open)
+
+        with self.assertRaises(CircuitOpenError):
+            await runner.run("show", "jobs")
+
+    async def test_failing_command(self):
+        breaker = CircuitBreaker()
+        runner = ScontrolRunner(sys.executable, ["-c", "import sys; sys.exit('no controller')"], breaker=breaker)
+
+        with self.assertRaises(SlurmUnavailableError) as raised:
+            await runner.run("show", "jobs")
+
+        self.assertIn("no controller", str(raised.exception))
+        self.assertEqual(breaker.failures, 1)
+
+        # e.g. an unknown job ID
+        with self.assertRaises(SlurmUnavailableError):
+            await runner.run("show", "job", "1", count_errors=False)
+
+        self.assertEqual(breaker.failures, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
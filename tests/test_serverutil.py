@@ -0,0 +1,122 @@
+"""Checks that requests arriving before the first snapshot wait for the first
+refresh of each cluster, and get an error rather than hanging when it fails,
+and that cached pages are sent in an encoding the client accepts.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from serverutil import CachedPage, MultiClusterPoller, SnapshotPoller, parse_accept_encoding
+
+
+def make_query(delay: float, error: str = None):
+    """Query answering after `delay` seconds, failing with `error` if set."""
+    async def query(previous):
+        await asyncio.sleep(delay)
+
+        if error is not None:
+            raise RuntimeError(error)
+
+        return "snapshot"
+
+    return query
+
+
+class PollerTest(unittest.IsolatedAsyncioTestCase):
+    async def start(self, poller):
+        context = poller.cleanup_ctx(None)
+        await context.__anext__()
+        self.addAsyncCleanup(self.stop, context)
+
+    async def stop(self, context):
+        with self.assertRaises(StopAsyncIteration):
+            await context.__anext__()
+
+    async def test_first_refresh(self):
+        poller = SnapshotPoller(make_query(0.1), name="a")
+        await self.start(poller)
+
+        self.assertEqual(await asyncio.wait_for(poller.get(), 5), "snapshot")
+
+    async def test_failed_first_refresh(self):
+        """Requests waiting for the first refresh are answered when it fails."""
+        poller = SnapshotPoller(make_query(0.1, "slurmctld is down"), name="a")
+        await self.start(poller)
+
+        with self.assertRaises(web.HTTPServiceUnavailable) as raised:
+            await asyncio.wait_for(poller.get(), 5)
+
+        self.assertIn("slurmctld is down", raised.exception.text)
+
+        # later requests do not wait at all
+        with self.assertRaises(web.HTTPServiceUnavailable):
+            await asyncio.wait_for(poller.get(), 0.05)
+
+    async def test_failed_clusters(self):
+        pollers = [
+            SnapshotPoller(make_query(0.05, "a is down"), name="a"),
+            SnapshotPoller(make_query(0.2, "b is down"), name="b"),
+        ]
+        multi_poller = MultiClusterPoller(pollers, startup_timeout=0)
+
+        for poller in pollers:
+            await self.start(poller)
+        await self.start(multi_poller)
+
+        with self.assertRaises(web.HTTPServiceUnavailable):
+            await asyncio.wait_for(multi_poller.get(), 5)
+
+        self.assertTrue(all(poller.attempted.is_set() for poller in pollers))
+
+
+class CachedPageTest(unittest.TestCase):
+    page = CachedPage("text/html", {"identity": b"identity", "gzip": b"gzip", "br": b"br"})
+
+    def get_encoding(self, accept_encoding: str, page: CachedPage = page) -> str:
+        response = page.response(make_mocked_request("GET", "/", headers={"Accept-Encoding": accept_encoding}))
+        encoding = response.headers.get("Content-Encoding", "identity")
+
+        self.assertEqual(response.body, page.bodies[encoding], accept_encoding)
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        return encoding
+
+    def test_parse(self):
+        self.assertEqual(parse_accept_encoding("br;q=0, gzip"), {"br": 0.0, "gzip": 1.0})
+        self.assertEqual(parse_accept_encoding(" GZIP ; Q=0.5 ,, *;q=0.1"), {"gzip": 0.5, "*": 0.1})
+        self.assertEqual(parse_accept_encoding("gzip;q=high"), {"gzip": 0.0})
+        self.assertEqual(parse_accept_encoding(""), {})
+
+    def test_encodings(self):
+        expected = {
+            "": "identity",
+            "gzip, deflate, br": "br",
+            "br;q=0, gzip": "gzip",
+            "gzip;q=0, br;q=0": "identity",
+            "gzip;q=0.0": "identity",
+            "br;q=0.5, gzip": "gzip",
+            "br;q=0.001, identity": "br",
+            "*": "br",
+            "*;q=0.5, br;q=0": "gzip",
+            "deflate": "identity",
+        }
+
+        for accept_encoding, encoding in expected.items():
+            self.assertEqual(self.get_encoding(accept_encoding), encoding, accept_encoding)
+
+    def test_without_brotli(self):
+        page = CachedPage("text/html", {"identity": b"identity", "gzip": b"gzip"})
+
+        self.assertEqual(self.get_encoding("br", page), "identity")
+        self.assertEqual(self.get_encoding("br, gzip;q=0.1", page), "gzip")
+
+
+if __name__ == "__main__":
+    unittest.main()
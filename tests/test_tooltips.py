@@ -0,0 +1,73 @@
+"""Checks that the tooltip titles of `html/include/tooltip.html` are only kept
+while pages use them.
+
+Run from the repository root: `python -m unittest discover tests`"""
+
+import re
+import sys
+import unittest
+from pathlib import Path
+
+from mako.lookup import TemplateLookup
+
+repository_path = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repository_path))
+sys.path.insert(0, str(repository_path / "benchmarks"))
+
+from fixtures import make_job_lines
+from jobstate import *
+
+match_title_id = re.compile('data-title-id="([0-9]+)"')
+
+
+class TooltipTest(unittest.TestCase):
+    def setUp(self):
+        # a lookup of its own, for the titles not to be shared with other tests
+        self.lookup = TemplateLookup(directories=[str(repository_path / "html")], default_filters=["h"])
+        self.tooltips = self.lookup.get_template("include/tooltip.html").module
+
+    def test_ids(self):
+        page_tooltips = {}
+        context = {"page_tooltips": page_tooltips}
+
+        first_id = self.tooltips.use_title(context, "first")
+        self.assertEqual(self.tooltips.use_title(context, "first"), first_id)
+        second_id = self.tooltips.use_title({}, "second")
+
+        self.assertEqual(page_tooltips, {first_id: "first"})
+        self.assertEqual(self.tooltips.get_tooltip_titles([second_id, 12345]), {second_id: "second"})
+
+        # titles used since the previous snapshot keep their id
+        self.tooltips.forget_old_tooltips()
+        self.assertEqual(self.tooltips.use_title({}, "first"), first_id)
+
+        self.tooltips.forget_old_tooltips()
+        self.assertEqual(self.tooltips.get_tooltip_titles([first_id, second_id]), {first_id: "first"})
+
+        self.tooltips.forget_old_tooltips()
+        self.assertEqual(self.tooltips.get_tooltip_titles([first_id, second_id]), {})
+
+        # and forgotten ones get a new one
+        self.assertNotIn(self.tooltips.use_title({}, "second"), (first_id, second_id))
+
+    def test_job_rows(self):
+        jobs, _ = IncrementalParser("JobId", JobState, "jobs").parse(make_job_lines(300))
+        rows = self.lookup.get_template("include/jobutil.html").get_def("make_job_rows")
+
+        for _ in range(3):
+            page_tooltips = {}
+            html = rows.render(jobs=list(jobs.values()), page_tooltips=page_tooltips)
+            title_ids = {int(title_id) for title_id in match_title_id.findall(html)}
+
+            self.assertGreater(len(title_ids), 300)
+            self.assertEqual(page_tooltips.keys(), title_ids)
+            self.assertEqual(self.tooltips.get_tooltip_titles(title_ids), page_tooltips)
+
+            self.tooltips.forget_old_tooltips()
+
+        # only the titles of the last two renders are kept
+        self.assertEqual(len(self.tooltips.get_tooltip_titles(range(self.tooltips.tooltip_counter + 1))), len(title_ids))
+
+
+if __name__ == "__main__":
+    unittest.main()